@@ -0,0 +1,369 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Benchmark of the commands sent by blenderRCBPanel on a local fake robot.
+#
+# It starts a private YARP name server and, for each case, N fakeMotionControl
+# boards, then drives them without Blender with the code of the panel:
+# "playback" calls at each frame the frame handler (playback.play_frame),
+# "stream" runs the streaming thread. yarpserver and yarpdev must be in the
+# PATH and the YARP python bindings importable:
+#
+#   python rcb_benchmark.py --parts 1,4 --joints 6,16 --modes playback,stream \
+#       --duration 10 --output report.json
+#
+# Two reports can be compared with:
+#
+#   python rcb_benchmark.py --compare old_report.json new_report.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RCB_DIR = os.path.join(SCRIPT_DIR, os.pardir, "blenderRCBPanel")
+
+MODES = ("playback", "stream")
+ROBOT = "rcb_benchmark"
+# Amplitude (degrees) and frequency (Hz) of the sinusoids commanded to the joints
+AMPLITUDE = 5.0
+FREQUENCY = 0.5
+JOINT_LIMIT = 90.0
+
+# ------------------------------------------------------------------------
+#    Fake robot
+# ------------------------------------------------------------------------
+
+def yarp_environment(work_dir):
+    # The name server and its configuration are private to the benchmark
+    env = dict(os.environ)
+    env["YARP_CONFIG_HOME"] = os.path.join(work_dir, "config")
+    env["YARP_DATA_HOME"] = os.path.join(work_dir, "data")
+    os.makedirs(env["YARP_CONFIG_HOME"], exist_ok=True)
+    os.makedirs(env["YARP_DATA_HOME"], exist_ok=True)
+    return env
+
+
+def start_name_server(env, port, log):
+    subprocess.run(["yarp", "conf", "127.0.0.1", str(port)], env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    return subprocess.Popen(["yarpserver", "--ip", "127.0.0.1", "--socket", str(port)], env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+def start_board(env, part, joints, period, log):
+    names = " ".join("{}_j{}".format(part, joint) for joint in range(joints))
+    return subprocess.Popen(["yarpdev", "--device", "fakeMotionControl",
+                             "--name", "/{}/{}".format(ROBOT, part),
+                             "--period", str(period),
+                             "--GENERAL::Joints", str(joints),
+                             "--GENERAL::AxisName", "({})".format(names),
+                             "--LIMITS::Max", "({})".format(" ".join([str(JOINT_LIMIT)] * joints)),
+                             "--LIMITS::Min", "({})".format(" ".join([str(-JOINT_LIMIT)] * joints))],
+                            env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_port(yarp, name, timeout):
+    start = time.perf_counter()
+    while not yarp.Network.exists(name, True):
+        if time.perf_counter() - start > timeout:
+            return False
+        time.sleep(0.1)
+    return True
+
+
+def stop_processes(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def process_cpu_time(pid):
+    # User and system time in seconds of a process, None outside linux
+    try:
+        with open("/proc/{}/stat".format(pid)) as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+# ------------------------------------------------------------------------
+#    Measurement
+# ------------------------------------------------------------------------
+
+class DelayedInterface:
+    # Interface whose setPositions waits latency seconds, a slower network
+
+    def __init__(self, interface, latency):
+        self.interface = interface
+        self.latency = latency
+
+    def setPositions(self, *args):
+        time.sleep(self.latency)
+        return self.interface.setPositions(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.interface, name)
+
+
+def make_board_class(latency):
+    # Board adding a simulated network latency to each command
+    from control_board import ControlBoard
+
+    class SlowBoard(ControlBoard):
+        def open(self, metadata=None):
+            error = super().open(metadata)
+            if error is None:
+                self.iposDir = DelayedInterface(self.iposDir, latency)
+            return error
+
+    return SlowBoard if latency > 0.0 else ControlBoard
+
+
+def targets_of(joints, frames, fps, phase):
+    # Sinusoids starting from 0, where fakeMotionControl starts
+    times = np.arange(frames) / fps
+    offsets = np.arange(joints) * 0.1 + phase
+    return AMPLITUDE * (np.sin(2.0 * np.pi * FREQUENCY * times[:, None] + offsets) - np.sin(offsets))
+
+
+def run_playback(boards, targets, fps, telemetry):
+    # The frame handler of the panel (playback.play_frame) at fps, skipping
+    # the frames when late as the playback does
+    from playback import play_frame
+    frames = len(targets[0])
+    parts = {board.part: board for board in boards}
+    values = {board.part: part_targets for board, part_targets in zip(boards, targets)}
+    start = time.perf_counter()
+    frame = 0
+    skipped = 0
+    while frame < frames:
+        # The joints too far are not approached, the fake boards follow the targets
+        _, frame_skipped = play_frame(parts, lambda board: values[board.part][frame], telemetry=telemetry,
+                                      frame=frame)
+        skipped += frame_skipped
+        elapsed = time.perf_counter() - start
+        next_frame = max(frame + 1, int(elapsed * fps))
+        delay = next_frame / fps - elapsed
+        if delay > 0.0:
+            time.sleep(delay)
+        frame = next_frame
+    return skipped
+
+
+def run_stream(boards, targets, fps, rate, telemetry):
+    from streaming import StreamingEngine
+    engine = StreamingEngine(list(zip(boards, targets)), fps, rate, telemetry=telemetry)
+    engine.start()
+    engine.join()
+    if engine.error is not None:
+        raise RuntimeError(engine.error)
+    return 0
+
+
+def run_case(yarp, env, args, mode, parts, joints, log):
+    from control_board import open_control_boards
+    from telemetry import Telemetry
+
+    names = ["part{}".format(part) for part in range(parts)]
+    devices = [start_board(env, name, joints, args.period, log) for name in names]
+    boards = []
+    case = {"mode": mode, "parts": parts, "joints": joints, "latency_ms": args.latency, "success": False}
+    try:
+        for name in names:
+            if not wait_port(yarp, "/{}/{}/rpc:i".format(ROBOT, name), args.timeout):
+                case["error"] = "fakeMotionControl of {} did not start".format(name)
+                return case
+        start = time.perf_counter()
+        results = open_control_boards(ROBOT, names, make_board_class(args.latency / 1000.0))
+        case["connect_time"] = time.perf_counter() - start
+        boards = [board for board, _ in results.values() if board is not None]
+        errors = [error for board, error in results.values() if board is None]
+        if errors:
+            case["error"] = " ".join(errors)
+            return case
+        for board in boards:
+            board.select_axes(range(len(board.axis_names)))
+
+        frames = int(args.duration * args.fps) + 1
+        targets = [targets_of(joints, frames, args.fps, part) for part in range(parts)]
+        telemetry = Telemetry()
+        for board in boards:
+            board.telemetry = telemetry
+
+        devices_cpu = [process_cpu_time(device.pid) for device in devices]
+        cpu = time.process_time()
+        start = time.perf_counter()
+        if mode == "playback":
+            skipped = run_playback(boards, targets, args.fps, telemetry)
+        else:
+            skipped = run_stream(boards, targets, args.fps, args.rate, telemetry)
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        devices_cpu = [process_cpu_time(device.pid) - before if before is not None else None
+                       for device, before in zip(devices, devices_cpu)]
+
+        summary = telemetry.summary()
+        commands = sum(stats["calls"] for stats in summary["parts"].values())
+        case.update({"success": True,
+                     "elapsed": elapsed,
+                     "ticks": summary["frames"],
+                     "tick_rate": summary["frames"] / elapsed,
+                     "command_rate": commands / elapsed,
+                     "tick_mean_ms": summary["handler_mean"],
+                     "tick_p95_ms": summary["handler_p95"],
+                     "tick_max_ms": summary["handler_max"],
+                     "dropped": summary["dropped"],
+                     "skipped_parts": skipped,
+                     "command_p95_ms": max(stats["rpc_p95"] for stats in summary["parts"].values()),
+                     "lag_mean_ms": max(stats["lag_mean"] for stats in summary["parts"].values()),
+                     "cpu_percent": 100.0 * cpu / elapsed,
+                     "devices_cpu_percent": (100.0 * sum(devices_cpu) / elapsed
+                                             if all(value is not None for value in devices_cpu) else None),
+                     "parts_stats": summary["parts"]})
+        return case
+    except Exception as e:
+        case["error"] = str(e)
+        return case
+    finally:
+        for board in boards:
+            board.close()
+        stop_processes(devices)
+
+# ------------------------------------------------------------------------
+#    Driver
+# ------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="rcb_benchmark_")
+    env = yarp_environment(work_dir)
+    # The bindings read the configuration of the private name server
+    os.environ.update(env)
+    sys.path.append(os.path.abspath(RCB_DIR))
+    import yarp
+
+    log = open(os.path.join(work_dir, "yarp.log"), 'w')
+    server = start_name_server(env, args.port, log)
+    cases = []
+    try:
+        yarp.Network.init()
+        if not yarp.Network.checkNetwork(args.timeout):
+            print("The name server did not start, see", log.name)
+            return False
+        for mode in args.modes:
+            for parts in args.parts:
+                for joints in args.joints:
+                    case = run_case(yarp, env, args, mode, parts, joints, log)
+                    if case["success"]:
+                        print("{:>8} {:>3} parts x {:>3} joints: {:7.1f} commands/s, tick p95 {:.2f} ms, "
+                              "lag {:.1f} ms, {} dropped, cpu {:.0f}%".format(
+                              mode, parts, joints, case["command_rate"], case["tick_p95_ms"], case["lag_mean_ms"],
+                              case["dropped"], case["cpu_percent"]))
+                    else:
+                        print("{:>8} {:>3} parts x {:>3} joints: FAILED {}".format(mode, parts, joints,
+                                                                                  case.get("error", "")))
+                    cases.append(case)
+    finally:
+        yarp.Network.fini()
+        stop_processes([server])
+        log.close()
+
+    report = {"revision": git_revision(),
+              "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "fps": args.fps,
+              "rate": args.rate,
+              "period": args.period,
+              "duration": args.duration,
+              "cases": cases}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print("Report written in", args.output)
+    return all(case.get("success") for case in cases)
+
+
+def compare_reports(old_filename, new_filename, threshold):
+    # Print the ratio new/old of the command rate and of the tick time of the
+    # common cases, returns False if some case is worse than threshold
+    with open(old_filename) as f:
+        old = json.load(f)
+    with open(new_filename) as f:
+        new = json.load(f)
+
+    def key(case):
+        return (case["mode"], case["parts"], case["joints"], case["latency_ms"])
+
+    old_cases = {key(case): case for case in old["cases"] if case.get("success")}
+    ok = True
+    for case in new["cases"]:
+        if not case.get("success") or key(case) not in old_cases:
+            continue
+        reference = old_cases[key(case)]
+        rate = reference["command_rate"] / case["command_rate"] if case["command_rate"] > 0 else float("inf")
+        tick = case["tick_p95_ms"] / reference["tick_p95_ms"] if reference["tick_p95_ms"] > 0 else 1.0
+        regression = rate > threshold or tick > threshold
+        ok = ok and not regression
+        print("{:>8} {:>3} parts x {:>3} joints ({} ms): {:.1f} -> {:.1f} commands/s, "
+              "tick p95 {:.2f} -> {:.2f} ms{}".format(*key(case), reference["command_rate"], case["command_rate"],
+                                                     reference["tick_p95_ms"], case["tick_p95_ms"],
+                                                     "  REGRESSION" if regression else ""))
+    return ok
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark of blenderRCBPanel on a local fake robot")
+    parser.add_argument("--parts", type=lambda v: parse_list(v, int), default=[1, 4], help="number of control boards")
+    parser.add_argument("--joints", type=lambda v: parse_list(v, int), default=[6, 16], help="joints of each board")
+    parser.add_argument("--modes", type=parse_list, default=list(MODES))
+    parser.add_argument("--fps", type=float, default=30.0, help="frame rate of the animation")
+    parser.add_argument("--rate", type=float, default=100.0, help="rate of the streaming")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of animation of each case")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to each command")
+    parser.add_argument("--period", type=float, default=0.01, help="period of the fakeMotionControl boards")
+    parser.add_argument("--port", type=int, default=10100, help="port of the private name server")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds waited for the name server and boards")
+    parser.add_argument("--work_dir", default=None)
+    parser.add_argument("--output", default="rcb_benchmark_report.json")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown considered a regression")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    for mode in args.modes:
+        if mode not in MODES:
+            parser.error("unknown mode " + mode)
+
+    if args.compare:
+        return compare_reports(args.compare[0], args.compare[1], args.threshold)
+    return run_benchmark(args)
+
+
+if __name__ == '__main__':
+    if not main(sys.argv[1:]):
+        sys.exit(1)
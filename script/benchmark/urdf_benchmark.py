@@ -0,0 +1,293 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Benchmark of urdfToBlender on synthetic models.
+#
+# Run it with plain python, it generates the urdfs and converts each of them
+# in a separate headless blender, so that the peak memory is per model:
+#
+#   python urdf_benchmark.py --sizes 10,100,1000 --topologies chain,tree \
+#       --geometries box,mesh --output report.json
+#
+# Two reports can be compared with:
+#
+#   python urdf_benchmark.py --compare old_report.json new_report.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTER_DIR = os.path.join(SCRIPT_DIR, os.pardir, "urdfToBlender")
+
+TOPOLOGIES = ("chain", "tree", "star")
+GEOMETRIES = ("none", "box", "sphere", "cylinder", "mesh")
+
+# ------------------------------------------------------------------------
+#    Synthetic models
+# ------------------------------------------------------------------------
+
+def write_tube_stl(path, segments=32, rings=16, radius=20.0, length=50.0):
+    # Binary stl of a closed tube in millimeters, 2*segments*(rings+1) triangles
+    vertices = []
+    for ring in range(rings + 1):
+        z = length * ring / rings
+        for segment in range(segments):
+            angle = 2.0 * math.pi * segment / segments
+            vertices.append((radius * math.cos(angle), radius * math.sin(angle), z))
+    triangles = []
+    for ring in range(rings):
+        for segment in range(segments):
+            a = ring * segments + segment
+            b = ring * segments + (segment + 1) % segments
+            c = a + segments
+            d = b + segments
+            triangles.append((a, b, d))
+            triangles.append((a, d, c))
+    bottom = (0.0, 0.0, 0.0)
+    top = (0.0, 0.0, length)
+    caps = []
+    for segment in range(segments):
+        a = segment
+        b = (segment + 1) % segments
+        caps.append((bottom, vertices[b], vertices[a]))
+        caps.append((top, vertices[rings * segments + a], vertices[rings * segments + b]))
+    with open(path, 'wb') as f:
+        f.write(b"synthetic tube".ljust(80, b" "))
+        f.write(struct.pack("<I", len(triangles) + len(caps)))
+        for tri in [tuple(vertices[i] for i in t) for t in triangles] + caps:
+            f.write(struct.pack("<3f", 0.0, 0.0, 0.0))
+            for v in tri:
+                f.write(struct.pack("<3f", *v))
+            f.write(b"\0\0")
+
+
+def parent_of(link_idx, topology, branching):
+    if topology == "chain":
+        return link_idx - 1
+    if topology == "star":
+        return 0
+    # balanced tree
+    return (link_idx - 1) // branching
+
+
+def geometry_xml(geometry, mesh_filename):
+    if geometry == "box":
+        return '<box size="0.02 0.03 0.05"/>'
+    if geometry == "sphere":
+        return '<sphere radius="0.02"/>'
+    if geometry == "cylinder":
+        return '<cylinder radius="0.02" length="0.05"/>'
+    if geometry == "mesh":
+        return '<mesh filename="{}" scale="0.001 0.001 0.001"/>'.format(mesh_filename)
+    return None
+
+
+def generate_urdf(directory, nr_of_links, topology="chain", geometry="box",
+                  branching=3, unique_meshes=False, mesh_segments=32):
+    # Write the urdf of a synthetic robot with nr_of_links links connected by
+    # revolute joints, returns its path
+    name = "bench_{}_{}_{}".format(topology, geometry, nr_of_links)
+    os.makedirs(directory, exist_ok=True)
+    shared_mesh = os.path.join(directory, "tube_{}.stl".format(mesh_segments))
+    if geometry == "mesh" and not unique_meshes and not os.path.isfile(shared_mesh):
+        write_tube_stl(shared_mesh, segments=mesh_segments)
+
+    lines = ['<?xml version="1.0"?>', '<robot name="{}">'.format(name)]
+    for link_idx in range(nr_of_links):
+        link_name = "root_link" if link_idx == 0 else "link_{}".format(link_idx)
+        lines.append('  <link name="{}">'.format(link_name))
+        lines.append('    <inertial><mass value="0.1"/><origin xyz="0 0 0"/>'
+                     '<inertia ixx="1e-4" ixy="0" ixz="0" iyy="1e-4" iyz="0" izz="1e-4"/></inertial>')
+        mesh_filename = shared_mesh
+        if geometry == "mesh" and unique_meshes:
+            mesh_filename = os.path.join(directory, "{}_{}.stl".format(name, link_idx))
+            write_tube_stl(mesh_filename, segments=mesh_segments)
+        shape = geometry_xml(geometry, mesh_filename)
+        if shape is not None:
+            lines.append('    <visual><origin xyz="0 0 0" rpy="0 0 0"/><geometry>{}</geometry></visual>'.format(shape))
+        lines.append('  </link>')
+    axes = ("1 0 0", "0 1 0", "0 0 1")
+    for link_idx in range(1, nr_of_links):
+        parent_idx = parent_of(link_idx, topology, branching)
+        parent_name = "root_link" if parent_idx == 0 else "link_{}".format(parent_idx)
+        # Spread the children of the same parent around it
+        angle = 2.0 * math.pi * (link_idx % max(branching, 1)) / max(branching, 1)
+        offset = "0 0 0.06" if topology == "chain" else "{:.4f} {:.4f} 0.06".format(0.04 * math.cos(angle),
+                                                                                 0.04 * math.sin(angle))
+        lines.append('  <joint name="joint_{}" type="revolute">'.format(link_idx))
+        lines.append('    <parent link="{}"/><child link="link_{}"/>'.format(parent_name, link_idx))
+        lines.append('    <origin xyz="{}" rpy="0 0 0"/><axis xyz="{}"/>'.format(offset, axes[link_idx % 3]))
+        lines.append('    <limit lower="-1.57" upper="1.57" effort="10" velocity="1"/>')
+        lines.append('  </joint>')
+    lines.append('</robot>')
+
+    path = os.path.join(directory, name + ".urdf")
+    with open(path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+# ------------------------------------------------------------------------
+#    Measurement (executed inside blender)
+# ------------------------------------------------------------------------
+
+def run_case(urdf_filename, result_filename, mesh_cache_dir=None):
+    import bpy
+    sys.path.append(os.path.abspath(CONVERTER_DIR))
+    import urdfToBlender
+    from profiling import Profiler
+
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    profiler = Profiler()
+    ok = urdfToBlender.rigify(urdf_filename, mesh_cache_dir, profiler)
+
+    blend_filename = os.path.splitext(result_filename)[0] + ".blend"
+    with profiler.stage("save"):
+        bpy.ops.wm.save_as_mainfile(filepath=blend_filename)
+
+    armatures = [obj for obj in bpy.data.objects if obj.type == 'ARMATURE']
+    result = profiler.report()
+    result.update({"success": bool(ok),
+                   "total_time": sum(profiler.stages.values()),
+                   "objects": len(bpy.data.objects),
+                   "meshes": len(bpy.data.meshes),
+                   "bones": sum(len(obj.data.bones) for obj in armatures),
+                   "vertices": sum(len(mesh.vertices) for mesh in bpy.data.meshes),
+                   "blend_size": os.path.getsize(blend_filename)})
+    with open(result_filename, 'w') as f:
+        json.dump(result, f, indent=4)
+
+# ------------------------------------------------------------------------
+#    Driver
+# ------------------------------------------------------------------------
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SCRIPT_DIR,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="urdf_benchmark_")
+    cases = []
+    for topology in args.topologies:
+        for geometry in args.geometries:
+            for size in args.sizes:
+                urdf_filename = generate_urdf(os.path.join(work_dir, "models"), size, topology, geometry,
+                                              args.branching, args.unique_meshes, args.mesh_segments)
+                result_filename = os.path.join(work_dir, os.path.basename(urdf_filename) + ".json")
+                command = [args.blender, "--python-use-system-env", "-b", "--factory-startup",
+                           "-P", os.path.abspath(__file__), "--",
+                           "--run_case", urdf_filename, result_filename]
+                if args.mesh_cache_dir:
+                    command += ["--mesh_cache_dir", args.mesh_cache_dir]
+                start = time.perf_counter()
+                process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         universal_newlines=True)
+                case = {"topology": topology, "geometry": geometry, "links": size,
+                        "process_time": time.perf_counter() - start}
+                if process.returncode == 0 and os.path.isfile(result_filename):
+                    with open(result_filename) as f:
+                        case.update(json.load(f))
+                else:
+                    case["success"] = False
+                    case["log"] = process.stdout[-4000:]
+                print("{:>6} {:>8} {:>5} links: {}".format(topology, geometry, size,
+                      "{:.3f} s".format(case["total_time"]) if case.get("success") else "FAILED"))
+                cases.append(case)
+
+    report = {"revision": git_revision(),
+              "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "cases": cases}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print("Report written in", args.output)
+    return all(case.get("success") for case in cases)
+
+
+def compare_reports(old_filename, new_filename, threshold):
+    # Print the ratio new/old of the times of the common cases, returns False
+    # if some case is slower than threshold
+    with open(old_filename) as f:
+        old = json.load(f)
+    with open(new_filename) as f:
+        new = json.load(f)
+
+    def key(case):
+        return (case["topology"], case["geometry"], case["links"])
+
+    old_cases = {key(case): case for case in old["cases"] if case.get("success")}
+    ok = True
+    for case in new["cases"]:
+        if not case.get("success") or key(case) not in old_cases:
+            continue
+        reference = old_cases[key(case)]
+        ratio = case["total_time"] / reference["total_time"] if reference["total_time"] > 0 else float("inf")
+        regression = ratio > threshold
+        ok = ok and not regression
+        print("{:>6} {:>8} {:>5} links: {:.3f} s -> {:.3f} s (x{:.2f}){}".format(
+              *key(case), reference["total_time"], case["total_time"], ratio,
+              "  REGRESSION" if regression else ""))
+        for stage, value in case.get("stages", {}).items():
+            if stage in reference.get("stages", {}):
+                print("        {:<24} {:.3f} s -> {:.3f} s".format(stage, reference["stages"][stage], value))
+        if "operator_calls" in case and "operator_calls" in reference:
+            print("        {:<24} {} -> {}".format("bpy.ops calls", reference["operator_calls"], case["operator_calls"]))
+    return ok
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark of urdfToBlender on synthetic urdfs")
+    parser.add_argument("--sizes", type=lambda v: parse_list(v, int), default=[10, 100, 1000])
+    parser.add_argument("--topologies", type=parse_list, default=["chain", "tree"])
+    parser.add_argument("--geometries", type=parse_list, default=["box", "mesh"])
+    parser.add_argument("--branching", type=int, default=3, help="children of each link in the tree topology")
+    parser.add_argument("--mesh_segments", type=int, default=32, help="resolution of the generated meshes")
+    parser.add_argument("--unique_meshes", action="store_true", help="one mesh file for each link")
+    parser.add_argument("--mesh_cache_dir", default=None, help="enable the mesh cache in this directory")
+    parser.add_argument("--blender", default="blender")
+    parser.add_argument("--work_dir", default=None)
+    parser.add_argument("--output", default="urdf_benchmark_report.json")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown considered a regression")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--run_case", nargs=2, metavar=("URDF", "RESULT"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    for topology in args.topologies:
+        if topology not in TOPOLOGIES:
+            parser.error("unknown topology " + topology)
+    for geometry in args.geometries:
+        if geometry not in GEOMETRIES:
+            parser.error("unknown geometry " + geometry)
+
+    if args.run_case:
+        run_case(args.run_case[0], args.run_case[1], args.mesh_cache_dir)
+        return True
+    if args.compare:
+        return compare_reports(args.compare[0], args.compare[1], args.threshold)
+    return run_benchmark(args)
+
+
+if __name__ == '__main__':
+    # Inside blender the arguments of the script follow "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    if not main(argv):
+        sys.exit(1)
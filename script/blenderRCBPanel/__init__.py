@@ -32,6 +32,17 @@ from bpy.props import (StringProperty,
 from .blenderRCBPanel import (MyProperties,
                               WM_OT_Disconnect,
                               WM_OT_Connect,
+                              WM_OT_ConnectAll,
+                              WM_OT_BakeTrajectory,
+                              WM_OT_ExportTrajectory,
+                              WM_OT_StartRecording,
+                              WM_OT_StopRecording,
+                              WM_OT_SaveRecording,
+                              WM_OT_RecordingToAction,
+                              WM_OT_ResetTelemetry,
+                              WM_OT_ExportTelemetry,
+                              WM_OT_StartStreaming,
+                              WM_OT_StopStreaming,
                               WM_OT_Configure,
                               WM_OT_ReachTarget,
                               WM_OT_initiate_drag_drop,
@@ -40,6 +51,14 @@ from .blenderRCBPanel import (MyProperties,
                               OT_OpenConfigurationFile,
                               ListItem,
                               MY_UL_List,
+                              stop_streaming,
+                              stop_approach,
+                              stop_recording,
+                              stop_telemetry,
+                              invalidate_trajectory,
+                              discard_trajectory,
+                              get_session,
+                              sync_connections,
                               )
 
 # ------------------------------------------------------------------------
@@ -50,6 +69,17 @@ classes = (
     MyProperties,
     WM_OT_Disconnect,
     WM_OT_Connect,
+    WM_OT_ConnectAll,
+    WM_OT_BakeTrajectory,
+    WM_OT_ExportTrajectory,
+    WM_OT_StartRecording,
+    WM_OT_StopRecording,
+    WM_OT_SaveRecording,
+    WM_OT_RecordingToAction,
+    WM_OT_ResetTelemetry,
+    WM_OT_ExportTelemetry,
+    WM_OT_StartStreaming,
+    WM_OT_StopStreaming,
     WM_OT_Configure,
     WM_OT_ReachTarget,
     WM_OT_initiate_drag_drop,
@@ -76,8 +106,15 @@ def register():
     except:
         print("A problem in the registration occurred")
 
-    # initialize the dict
-    bpy.types.Scene.rcb_wrapper = {}
+    # The connected parts, they survive the reload of the addon
+    bpy.types.Scene.rcb_wrapper = get_session().boards
+    if sync_connections not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(sync_connections)
+
+    if invalidate_trajectory not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(invalidate_trajectory)
+    if discard_trajectory not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(discard_trajectory)
 
 
 def unregister():
@@ -93,6 +130,20 @@ def unregister():
     except:
         print("Exception raised when deleting the scene.")
 
+    # The streaming and approach threads must not outlive the addon
+    stop_approach()
+    stop_streaming()
+    stop_recording()
+    stop_telemetry()
+
+    if invalidate_trajectory in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(invalidate_trajectory)
+    if discard_trajectory in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(discard_trajectory)
+    # The drivers are not closed, the session is reused by the next register
+    if sync_connections in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(sync_connections)
+
     try:
         # remove the callback
         bpy.app.handlers.frame_change_post.clear()
@@ -0,0 +1,63 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+import time
+
+
+class ApproachMotion(threading.Thread):
+    # Brings the joints too far from their targets close to them in position
+    # control, on all the parts at the same time and without blocking the
+    # caller, then puts them back in position direct.
+    # moves is the list of (part, indices, targets), where indices selects the
+    # mapped axes of the part (an rcb_wrapper) to move and targets is the array
+    # in degrees of all its mapped axes.
+
+    def __init__(self, moves, speed=10.0, timeout=30.0, period=0.01, on_converged=None):
+        super().__init__(name="rcb_approach", daemon=True)
+        self.moves = moves
+        self.speed = speed
+        self.timeout = timeout
+        self.period = period
+        # Called from the main thread once every joint reached the target
+        self.on_converged = on_converged
+        self.converged = False
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def stop(self, wait=True):
+        self._stop_event.set()
+        if wait and self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        try:
+            # Multi-joint commands, one per part
+            for part, indices, targets in self.moves:
+                part.position_move(indices, targets, self.speed)
+            pending = [(part, indices) for part, indices, _ in self.moves]
+            start = time.perf_counter()
+            while pending and not self._stop_event.is_set():
+                pending = [(part, part.moving(indices)) for part, indices in pending]
+                pending = [(part, indices) for part, indices in pending if len(indices) > 0]
+                if not pending:
+                    break
+                if time.perf_counter() - start > self.timeout:
+                    self.error = "timeout"
+                    break
+                self._stop_event.wait(self.period)
+            self.converged = not pending and not self._stop_event.is_set()
+        except Exception as e:
+            self.error = e
+        finally:
+            # Position direct is restored anyway, the streaming expects it
+            for part, indices, _ in self.moves:
+                try:
+                    part.position_direct(indices)
+                except Exception as e:
+                    print("Cannot restore the position direct mode:", e)
+        if self.error is not None:
+            print("The approach did not converge:", self.error)
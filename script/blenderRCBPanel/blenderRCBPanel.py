@@ -10,17 +10,31 @@ import os
 # import sys
 import yarp
 import idyntree.bindings as iDynTree
-# import numpy as np
+import numpy as np
 import math
 import json
+import time
 from .common_functions import (printError,
+                               load_model_snapshot,
                                look_for_bones_with_drivers,
                                bones_with_driver,
                                IkVariables as ikv,
                                InverseKinematics,
                                )
-
-from bpy_extras.io_utils import ImportHelper
+from .streaming import StreamingEngine
+from .playback import play_frame
+from .trajectory import sample_action, bake_action, save_parts, BONE_PATH_PREFIX, BONE_PATH_SUFFIX
+from .recorder import Recorder
+from .telemetry import Telemetry
+from .approach import ApproachMotion
+from .control_board import (ControlBoard,
+                            APPROACH_SPEED,
+                            SAFETY_THRESHOLD,
+                            )
+from .session import get_session
+
+from bpy_extras.io_utils import ImportHelper, ExportHelper
+from bpy.app.handlers import persistent
 from bpy_extras import view3d_utils
 
 from bpy.props import (StringProperty,
@@ -40,29 +54,97 @@ from bpy.types import (Panel,
                        )
 
 list_of_links = []
+# The animation baked by WM_OT_BakeTrajectory, None if not baked or changed
+baked_trajectory = None
+# The streaming thread, when active
+streaming_engine = None
+# The motion bringing the joints close to the animation, when active
+approach_motion = None
+# The recorder of the encoders, the last one is kept once stopped
+recorder = None
+# RMS and peak tracking error of each axis of the last recording
+recording_error = None
+# The instrumentation of the playback and of the streaming, when enabled
+telemetry = None
 
 # ------------------------------------------------------------------------
 #    Structures
 # ------------------------------------------------------------------------
 
-class rcb_wrapper():
-    def __init__(self, driver, icm, iposDir, ipos, ienc, encs, iax, joint_limits):
-        self.driver = driver
-        self.icm = icm
-        self.iposDir = iposDir
-        self.ipos = ipos
-        self.ienc = ienc
-        self.encs = encs
-        self.iax = iax
-        self.joint_limits = joint_limits
+class rcb_wrapper(ControlBoard):
+    def __init__(self, *args):
+        super().__init__(*args)
+        # Mapping axis<->bone, built by map_bones for the current armature
+        self.armature_pointer = None
+        self.bones = []
+        # Columns of the mapped axes in the baked trajectory
+        self.trajectory = None
+        self.trajectory_columns = None
+
+    def map_bones(self, armature):
+        # Select the axes that have a bone in the armature, with the bone
+        # references in the same order
+        pose_bones = armature.pose.bones
+        axes = [axis for axis, name in enumerate(self.axis_names) if name in pose_bones]
+        self.armature_pointer = armature.as_pointer()
+        self.bones = [pose_bones[self.axis_names[axis]] for axis in axes]
+        # The icub hands encoders are not reliable for the safety check.
+        if armature.name == "iCub":
+            self.select_axes(axes, np.array(axes, dtype=np.int32) <= 5)
+        else:
+            self.select_axes(axes)
+        self.trajectory = None
+
+    def update_mapping(self, armature):
+        if self.armature_pointer != armature.as_pointer():
+            self.map_bones(armature)
+
+    def targets(self, armature):
+        # Targets in degrees of the mapped axes
+        self.update_mapping(armature)
+        return np.degrees(np.fromiter((bone.rotation_euler[1] for bone in self.bones),
+                                      dtype=np.float64, count=len(self.bones)))
+
+    def trajectory_targets(self, trajectory, armature, frame_start, frame_end=None):
+        # Targets of the mapped axes from the baked trajectory, in the frames
+        # [frame_start, frame_end] or only at frame_start if frame_end is None.
+        # None if the trajectory does not cover them. At a single frame the
+        # bones not baked take their value from the rig.
+        self.update_mapping(armature)
+        if self.trajectory is not trajectory:
+            self.trajectory = trajectory
+            self.trajectory_columns = trajectory.columns([bone.name for bone in self.bones])
+        baked = self.trajectory_columns >= 0
+        if frame_end is None:
+            row = trajectory.row(frame_start)
+            if row is None:
+                return None
+            if baked.all():
+                return row[self.trajectory_columns]
+            targets = self.targets(armature)
+            targets[baked] = row[self.trajectory_columns[baked]]
+            return targets
+        if not baked.all():
+            return None
+        if frame_start < trajectory.frame_start or frame_end > trajectory.frame_end:
+            return None
+        rows = slice(frame_start - trajectory.frame_start, frame_end - trajectory.frame_start + 1)
+        return trajectory.values[rows][:, self.trajectory_columns]
 
 
 # ------------------------------------------------------------------------
 #    Operators
 # ------------------------------------------------------------------------
-def register_rcb(rcb_instance, rcb_name):
-    scene = bpy.types.Scene
-    scene.rcb_wrapper[rcb_name] = rcb_instance
+@persistent
+def sync_connections(dummy=None):
+    # Show as connected the parts of the session in the loaded scenes
+    boards = get_session().boards
+    for scene in bpy.data.scenes:
+        if not hasattr(scene, "my_list"):
+            continue
+        for item in scene.my_list:
+            if item.isConnected != (item.value in boards):
+                item.isConnected = item.value in boards
 
 
 def unregister_rcb(rcb_name):
@@ -72,64 +154,202 @@ def unregister_rcb(rcb_name):
         pass
 
 
-def move(dummy):
-    threshold = 10.0 # degrees
-    scene = bpy.types.Scene
-    mytool = bpy.context.scene.my_tool
-    for key in scene.rcb_wrapper:
-        rcb_instance = scene.rcb_wrapper[key]
-        # Get the handles
-        icm     = rcb_instance.icm
-        iposDir = rcb_instance.iposDir
-        ipos    = rcb_instance.ipos
-        ienc    = rcb_instance.ienc
-        encs    = rcb_instance.encs
-        iax     = rcb_instance.iax
-        joint_limits     = rcb_instance.joint_limits
-        # Get the targets from the rig
-        ok_enc = ienc.getEncoders(encs.data())
-        if not ok_enc:
-            print("I cannot read the encoders, skipping")
-            return
-        for joint in range(0, ipos.getAxes()):
-            # TODO handle the name of the armature, just keep iCub for now
-            joint_name = iax.getAxisName(joint)
-            if joint_name not in bpy.data.objects[mytool.my_armature].pose.bones.keys():
+def is_streaming():
+    return streaming_engine is not None and streaming_engine.running
+
+
+def stop_streaming():
+    global streaming_engine
+    if streaming_engine is not None:
+        streaming_engine.stop()
+        streaming_engine = None
+
+
+def is_approaching():
+    return approach_motion is not None and approach_motion.is_alive()
+
+
+def stop_approach():
+    global approach_motion
+    if approach_motion is not None:
+        approach_motion.stop()
+        approach_motion = None
+
+
+def start_approach(moves, on_converged=None):
+    # Move all the joints too far from the targets at the same time, the
+    # completion is checked by a timer, Blender is not blocked meanwhile
+    global approach_motion
+    approach_motion = ApproachMotion(moves, APPROACH_SPEED, on_converged=on_converged)
+    approach_motion.start()
+    bpy.app.timers.register(follow_approach, first_interval=0.05)
+
+
+def follow_approach():
+    global approach_motion
+    if approach_motion is None:
+        return None
+    if approach_motion.is_alive():
+        return 0.05
+    motion = approach_motion
+    approach_motion = None
+    if motion.converged and motion.on_converged is not None:
+        motion.on_converged()
+    return None
+
+
+def resume_playback():
+    # Called from a timer, the operator needs a window in the context
+    window = bpy.context.window_manager.windows[0]
+    if hasattr(bpy.context, "temp_override"):
+        with bpy.context.temp_override(window=window, screen=window.screen):
+            bpy.ops.screen.animation_play()
+    else:
+        bpy.ops.screen.animation_play({"window": window, "screen": window.screen})
+
+
+def is_recording():
+    return recorder is not None and recorder.running
+
+
+def stop_recording():
+    # Stop the recorder keeping what it recorded, returns False if it was not running
+    global recording_error
+    if not is_recording():
+        return False
+    recorder.stop()
+    recording_error = recorder.tracking_error()
+    return True
+
+
+def recording_to_action(armature, recorder, fps, frame_start):
+    # New action with the recorded encoders of the bones of the armature,
+    # resampled at the frames of the scene from frame_start, None if nothing
+    # was recorded
+    times, encoders, _ = recorder.recording()
+    if len(times) == 0:
+        return None
+    # Once the buffer wrapped the oldest sample is not at time 0
+    times = times - times[0]
+    frames = np.arange(frame_start, frame_start + int(times[-1] * fps) + 1)
+    frame_times = (frames - frame_start) / fps
+    action = bpy.data.actions.new(armature.name + "_recorded")
+    action.use_fake_user = True
+    for _, _, columns, joints in recorder.parts:
+        for column, bone in zip(range(columns.start, columns.stop), joints["names"]):
+            values = encoders[:, column]
+            valid = ~np.isnan(values)
+            if bone not in armature.pose.bones or not valid.any():
                 continue
+            fcurve = action.fcurves.new(BONE_PATH_PREFIX + bone + BONE_PATH_SUFFIX, index=1, action_group=bone)
+            fcurve.keyframe_points.add(len(frames))
+            # All the keyframes in a single call
+            co = np.column_stack((frames, np.radians(np.interp(frame_times, times[valid], values[valid]))))
+            fcurve.keyframe_points.foreach_set("co", co.ravel())
+            fcurve.update()
+    return action
+
+
+@persistent
+def discard_trajectory(dummy=None):
+    # Handler discarding the baked trajectory when another file is loaded
+    global baked_trajectory
+    baked_trajectory = None
+
+
+@persistent
+def invalidate_trajectory(scene, depsgraph=None):
+    # Handler discarding the baked trajectory once an action is edited
+    global baked_trajectory
+    if baked_trajectory is None or depsgraph is None:
+        return
+    for update in depsgraph.updates:
+        if isinstance(update.id, bpy.types.Action):
+            baked_trajectory = None
+            print("The animation changed, the baked trajectory has been discarded.")
+            return
 
-            target = math.degrees(bpy.data.objects[mytool.my_armature].pose.bones[joint_name].rotation_euler[1])
-            min    = joint_limits[joint][0]
-            max    = joint_limits[joint][1]
-            if target < min or target > max:
-                print("The target", target, "it is outside the boundaries (", min, ",", max, "), skipping.")
-                continue
 
-            safety_check=None
-            # The icub hands encoders are not reliable for the safety check.
-            if mytool.my_armature == "iCub" and joint > 5 :
-                safety_check = False
-            else:
-                safety_check = (abs(encs[joint] - target) > threshold)
-
-            if safety_check:
-                print("The target is too far, reaching in position control, for joint", joint_name, "by ", abs(encs[joint] - target), " degrees" )
-
-                # Pause the animation
-                bpy.ops.screen.animation_play() # We have to check if it is ok
-                # Switch to position control and move to the target
-                # TODO try to find a way to use the s methods
-                icm.setControlMode(joint, yarp.VOCAB_CM_POSITION)
-                ipos.setRefSpeed(joint,10)
-                ipos.positionMove(joint,target)
-                done = ipos.isMotionDone(joint)
-                while not done:
-                    done = ipos.isMotionDone(joint)
-                    yarp.delay(0.001)
-                # Once finished put the joints in position direct and replay the animation back
-                icm.setControlMode(joint, yarp.VOCAB_CM_POSITION_DIRECT)
-                bpy.ops.screen.animation_play()
-            else:
-                iposDir.setPosition(joint,target)
+def follow_streaming():
+    # Timer showing in the viewport the frame streamed to the robot
+    if not is_streaming():
+        return None
+    bpy.context.scene.frame_current = int(round(streaming_engine.frame))
+    return 1.0 / 30.0
+
+
+def move(dummy):
+    # While streaming the commands are sent by the streaming thread, while
+    # approaching the targets the playback is paused
+    if is_streaming() or is_approaching():
+        return
+    moves = move_parts()
+    if moves:
+        # Pause the animation and replay it once all the parts reached the targets
+        was_playing = bpy.context.screen is not None and bpy.context.screen.is_animation_playing
+        if was_playing:
+            bpy.ops.screen.animation_cancel(restore_frame=False)
+        start_approach(moves, resume_playback if was_playing else None)
+
+
+def move_parts():
+    # Send the current frame to the connected parts, returns the joints too
+    # far from their targets (see playback.play_frame)
+    mytool = bpy.context.scene.my_tool
+    frame = bpy.context.scene.frame_current
+    # TODO handle the name of the armature, just keep iCub for now
+    armature = bpy.data.objects[mytool.my_armature]
+
+    def targets_of(rcb_instance):
+        # Get the targets from the baked trajectory, or from the rig
+        targets = None
+        if baked_trajectory is not None:
+            targets = rcb_instance.trajectory_targets(baked_trajectory, armature, frame)
+        if targets is None:
+            targets = rcb_instance.targets(armature)
+        return targets
+
+    # The frames are skipped by the playback only, not when changing frame by hand
+    playing = bpy.context.screen is not None and bpy.context.screen.is_animation_playing
+    moves, _ = play_frame(bpy.types.Scene.rcb_wrapper, targets_of, SAFETY_THRESHOLD, telemetry, frame,
+                          None if playing else 0)
+    return moves
+
+
+def attach_telemetry():
+    # The boards report their commands and state to the telemetry, if enabled
+    for board in get_session().boards.values():
+        board.telemetry = telemetry
+
+
+def toggle_telemetry(self, context):
+    global telemetry
+    if self.my_telemetry:
+        telemetry = Telemetry()
+        bpy.app.timers.register(refresh_telemetry)
+    else:
+        telemetry = None
+    attach_telemetry()
+
+
+def stop_telemetry():
+    # The boards survive the reload of the addon, they must not keep feeding it
+    global telemetry
+    telemetry = None
+    attach_telemetry()
+    if bpy.app.timers.is_registered(refresh_telemetry):
+        bpy.app.timers.unregister(refresh_telemetry)
+
+
+def refresh_telemetry():
+    # Timer redrawing the panel, the statistics are updated by other threads
+    if telemetry is None:
+        return None
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+    return 0.5
 
 
 def float_callback(self, context):
@@ -230,6 +450,48 @@ class MyProperties(PropertyGroup):
         max=0.1
     )
 
+    my_stream_rate: IntProperty(
+        name="Rate (Hz)",
+        description="Rate of the references sent to the robot while streaming",
+        default=100,
+        min=10,
+        max=1000
+        )
+
+    my_stream_loop: BoolProperty(
+        name="Loop",
+        description="Restart from the current frame once the end of the animation is reached",
+        default=False
+        )
+
+    my_record_rate: IntProperty(
+        name="Rate (Hz)",
+        description="Rate of the encoders recorded, usually the one of the controller",
+        default=100,
+        min=1,
+        max=1000
+        )
+
+    my_telemetry: BoolProperty(
+        name="Telemetry",
+        description="Measure the time spent for each frame, the latency of the commands and the lag of the encoders",
+        default=False,
+        update=toggle_telemetry
+        )
+
+    my_record_duration: IntProperty(
+        name="Buffer (s)",
+        description="Seconds kept by the recorder, the oldest samples are overwritten",
+        default=300,
+        min=1
+        )
+
+    my_bake_memmap: BoolProperty(
+        name="Memory-mapped",
+        description="Store the baked trajectory in a temporary file instead of in memory, for long animations",
+        default=False
+        )
+
     my_string: StringProperty(
         name="Robot",
         description=":",
@@ -333,7 +595,9 @@ class MY_UL_List(UIList):
 
     def draw_item(self, context, layout, data, item, icon, active_data,
                   active_propname, index):
-        if (item.isConnected):
+        if item.value in get_session().reconnecting:
+            custom_icon = 'FILE_REFRESH'
+        elif (item.isConnected):
             custom_icon = 'LINKED'
         else:
             custom_icon = 'UNLINKED'
@@ -357,9 +621,10 @@ class WM_OT_Disconnect(bpy.types.Operator):
 
         if rcb_instance is None:
             return {'CANCELLED'}
-        rcb_instance.driver.close()
-
-        del bpy.types.Scene.rcb_wrapper[getattr(parts[scene.list_index], "value")]
+        # The streaming thread must not use the driver being closed
+        stop_streaming()
+        stop_approach()
+        get_session().disconnect(getattr(parts[scene.list_index], "value"))
 
         setattr(parts[scene.list_index], "isConnected", False)
 
@@ -381,53 +646,350 @@ class WM_OT_Connect(bpy.types.Operator):
             printError(self, "YARP server is not running!")
             return {'CANCELLED'}
 
-        options = yarp.Property()
-        driver = yarp.PolyDriver()
+        part = getattr(parts[scene.list_index], "value")
+        rcb_instance, error = get_session().connect(mytool.my_string, [part], rcb_wrapper)[part]
+        if rcb_instance is None:
+            printError(self, error)
+            return {'CANCELLED'}
+
+        if mytool.my_armature in bpy.data.objects:
+            rcb_instance.map_bones(bpy.data.objects[mytool.my_armature])
+        rcb_instance.telemetry = telemetry
+
+        setattr(parts[scene.list_index], "isConnected", True)
+
+        # TODO check if we need this
+        #bpy.app.handlers.frame_change_post.clear()
+        #bpy.app.handlers.frame_change_post.append(move)
+
+        return {'FINISHED'}
 
-        # set the poly driver options
-        options.put("robot", mytool.my_string)
-        options.put("device", "remote_controlboard")
-        options.put("local", "/blender_controller/client/"+getattr(parts[scene.list_index], "value"))
-        options.put("remote", "/"+mytool.my_string+"/"+getattr(parts[scene.list_index], "value"))
 
-        # opening the drivers
-        print('Opening the motor driver...')
-        driver.open(options)
+class WM_OT_ConnectAll(bpy.types.Operator):
+    bl_label = "Connect all"
+    bl_idname = "wm.connect_all"
+    bl_description= "connect all the parts at the same time"
+
+    def execute(self, context):
+        scene = bpy.context.scene
+        parts = scene.my_list
+        mytool = scene.my_tool
 
-        if not driver.isValid():
-            printError(self, "Cannot open the driver!")
+        yarp.Network.init()
+        if not yarp.Network.checkNetwork():
+            printError(self, "YARP server is not running!")
             return {'CANCELLED'}
 
-        # opening the drivers
-        print('Viewing motor position/encoders...')
-        icm = driver.viewIControlMode()
-        iposDir = driver.viewIPositionDirect()
-        ipos = driver.viewIPositionControl()
-        ienc = driver.viewIEncoders()
-        iax = driver.viewIAxisInfo()
-        ilim = driver.viewIControlLimits()
-        if ienc is None or ipos is None or icm is None or iposDir is None or iax is None or ilim is None:
-            printError(self, "Cannot view one of the interfaces!")
+        names = [item.value for item in parts if item.value not in bpy.types.Scene.rcb_wrapper]
+        results = get_session().connect(mytool.my_string, names, rcb_wrapper)
+
+        # The parts opened are registered even if some others failed
+        errors = []
+        for item in parts:
+            if item.value not in results:
+                continue
+            rcb_instance, error = results[item.value]
+            if rcb_instance is None:
+                errors.append(error)
+                continue
+            if mytool.my_armature in bpy.data.objects:
+                rcb_instance.map_bones(bpy.data.objects[mytool.my_armature])
+            rcb_instance.telemetry = telemetry
+            setattr(item, "isConnected", True)
+
+        if errors:
+            printError(self, " ".join(errors))
+            return {'CANCELLED'} if len(errors) == len(names) else {'FINISHED'}
+        return {'FINISHED'}
+
+
+class WM_OT_BakeTrajectory(bpy.types.Operator):
+    bl_label = "Bake"
+    bl_idname = "wm.bake_trajectory"
+    bl_description = "Evaluate the animation once for all the joints, the playback and the streaming use the baked values"
+
+    def execute(self, context):
+        global baked_trajectory
+        scene = context.scene
+        mytool = scene.my_tool
+        armature = bpy.data.objects[mytool.my_armature]
+        filename = None
+        if mytool.my_bake_memmap:
+            # A new file for each bake, the previous one may still be mapped
+            filename = os.path.join(bpy.app.tempdir, "rcb_trajectory_{}_{}.npy".format(bpy.path.clean_name(armature.name),
+                                                                                       time.time_ns()))
+        fps = scene.render.fps / scene.render.fps_base
+        baked_trajectory = bake_action(armature, scene.frame_start, scene.frame_end, fps, filename)
+
+        out_of_limits = baked_trajectory.out_of_limits()
+        for column in np.flatnonzero(out_of_limits):
+            print("The joint", baked_trajectory.joint_names[column], "is outside the limits in", out_of_limits[column], "frames.")
+        self.report({'INFO'}, "Baked {} frames of {} joints".format(len(baked_trajectory.values),
+                                                                 len(baked_trajectory.joint_names)))
+        return {'FINISHED'}
+
+
+class WM_OT_ExportTrajectory(Operator, ExportHelper):
+    bl_label = "Export"
+    bl_idname = "wm.export_trajectory"
+    bl_description = "Export the baked trajectory of the connected parts for replaying it without Blender (rcb_replay.py)"
+
+    filename_ext = ".npz"
+
+    filter_glob: StringProperty(
+        default='*.npz;*.csv',
+        options={'HIDDEN'}
+    )
+
+    file_format: EnumProperty(
+        name="Format",
+        items=[("NPZ", "Binary (.npz)", "Compressed numpy archive"),
+               ("CSV", "CSV (.csv)", "Text file with the timestamps, the mapping of the parts is written in a .json next to it")],
+        default="NPZ"
+    )
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+        if baked_trajectory is None:
+            printError(self, "Bake the trajectory first")
             return {'CANCELLED'}
+        armature = bpy.data.objects[mytool.my_armature]
+        exported = []
+        for item in scene.my_list:
+            rcb_instance = bpy.types.Scene.rcb_wrapper.get(item.value)
+            if rcb_instance is None:
+                continue
+            # The order of the axes is known only once the part is connected
+            if len(rcb_instance.axes) == 0:
+                continue
+            values = rcb_instance.trajectory_targets(baked_trajectory, armature,
+                                                     baked_trajectory.frame_start, baked_trajectory.frame_end)
+            if values is None:
+                # Some bones are not animated by the action, they keep their current value
+                values = sample_action(armature, rcb_instance.bones, baked_trajectory.frame_start,
+                                       baked_trajectory.frame_end)
+            exported.append({"name": item.value,
+                             "display": item.viewValue,
+                             "axes": rcb_instance.axes,
+                             "joints": [rcb_instance.axis_names[axis] for axis in rcb_instance.axes],
+                             "values": values,
+                             "limits": rcb_instance.limits,
+                             "safety_mask": rcb_instance.safety_mask})
+        if not exported:
+            printError(self, "No connected part to export")
+            return {'CANCELLED'}
+        filepath = self.filepath
+        if self.file_format == "CSV":
+            filepath = os.path.splitext(filepath)[0] + ".csv"
+        save_parts(filepath, exported, baked_trajectory.fps, mytool.my_string)
+        self.report({'INFO'}, "Exported {} parts in {}".format(len(exported), filepath))
+        return {'FINISHED'}
 
-        encs = yarp.Vector(ipos.getAxes())
-        joint_limits = []
 
-        for joint in range(0, ipos.getAxes()):
-            min = yarp.Vector(1)
-            max = yarp.Vector(1)
-            icm.setControlMode(joint, yarp.VOCAB_CM_POSITION_DIRECT)
-            ilim.getLimits(joint, min.data(), max.data())
-            joint_limits.append([min.get(0), max.get(0)])
+class WM_OT_StartRecording(bpy.types.Operator):
+    bl_label = "Record"
+    bl_idname = "wm.start_recording"
+    bl_description = "Record in background the encoders of the connected parts and the targets sent to them"
 
-        register_rcb(rcb_wrapper(driver, icm, iposDir, ipos, ienc, encs, iax, joint_limits), getattr(parts[scene.list_index], "value"))
+    def execute(self, context):
+        global recorder, recording_error
+        scene = context.scene
+        mytool = scene.my_tool
+        if is_recording():
+            return {'CANCELLED'}
+        parts = []
+        for item in scene.my_list:
+            rcb_instance = bpy.types.Scene.rcb_wrapper.get(item.value)
+            if rcb_instance is not None and len(rcb_instance.axes) > 0:
+                parts.append((item.value, rcb_instance))
+        if not parts:
+            printError(self, "No connected part to record")
+            return {'CANCELLED'}
+        recorder = Recorder(parts, mytool.my_record_rate, mytool.my_record_duration)
+        recording_error = None
+        recorder.start()
+        return {'FINISHED'}
 
-        setattr(parts[scene.list_index], "isConnected", True)
 
-        # TODO check if we need this
-        #bpy.app.handlers.frame_change_post.clear()
-        #bpy.app.handlers.frame_change_post.append(move)
+class WM_OT_StopRecording(bpy.types.Operator):
+    bl_label = "Stop recording"
+    bl_idname = "wm.stop_recording"
+    bl_description = "Stop the recorder, the recording can then be saved or converted to an action"
 
+    def execute(self, context):
+        if not stop_recording():
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Recorded {} samples, {} late".format(len(recorder.buffer), recorder.late_ticks))
+        return {'FINISHED'}
+
+
+class WM_OT_SaveRecording(Operator, ExportHelper):
+    bl_label = "Save"
+    bl_idname = "wm.save_recording"
+    bl_description = "Save the recorded encoders, in the format of the exported trajectories"
+
+    filename_ext = ".npz"
+
+    filter_glob: StringProperty(
+        default='*.npz;*.csv',
+        options={'HIDDEN'}
+    )
+
+    file_format: EnumProperty(
+        name="Format",
+        items=[("NPZ", "Binary (.npz)", "Compressed numpy archive, with also the commanded targets"),
+               ("CSV", "CSV (.csv)", "Text file with the timestamps, the mapping of the parts is written in a .json next to it")],
+        default="NPZ"
+    )
+
+    def execute(self, context):
+        scene = context.scene
+        if recorder is None or is_recording() or len(recorder.buffer) == 0:
+            printError(self, "Nothing recorded")
+            return {'CANCELLED'}
+        names = {item.value: item.viewValue for item in scene.my_list}
+        parts = recorder.export_parts()
+        for part in parts:
+            part["display"] = names.get(part["name"], part["name"])
+        filepath = self.filepath
+        if self.file_format == "CSV":
+            filepath = os.path.splitext(filepath)[0] + ".csv"
+        times, _, _ = recorder.recording()
+        save_parts(filepath, parts, recorder.rate, scene.my_tool.my_string, times)
+        self.report({'INFO'}, "Saved {} samples in {}".format(len(times), filepath))
+        return {'FINISHED'}
+
+
+class WM_OT_RecordingToAction(bpy.types.Operator):
+    bl_label = "To action"
+    bl_idname = "wm.recording_to_action"
+    bl_description = "Create an action with the recorded encoders, keyed at each frame from the start of the scene"
+
+    def execute(self, context):
+        scene = context.scene
+        if recorder is None or is_recording() or len(recorder.buffer) == 0:
+            printError(self, "Nothing recorded")
+            return {'CANCELLED'}
+        armature = bpy.data.objects[scene.my_tool.my_armature]
+        fps = scene.render.fps / scene.render.fps_base
+        action = recording_to_action(armature, recorder, fps, scene.frame_start)
+        if action is None:
+            printError(self, "Nothing recorded")
+            return {'CANCELLED'}
+        self.report({'INFO'}, "Created the action " + action.name)
+        return {'FINISHED'}
+
+
+class WM_OT_ResetTelemetry(bpy.types.Operator):
+    bl_label = "Reset"
+    bl_idname = "wm.reset_telemetry"
+    bl_description = "Discard the measurements collected so far"
+
+    def execute(self, context):
+        if telemetry is None:
+            return {'CANCELLED'}
+        telemetry.reset()
+        return {'FINISHED'}
+
+
+class WM_OT_ExportTelemetry(Operator, ExportHelper):
+    bl_label = "Export"
+    bl_idname = "wm.export_telemetry"
+    bl_description = "Save the time series and the histograms of the telemetry"
+
+    filename_ext = ".npz"
+
+    filter_glob: StringProperty(
+        default='*.npz;*.csv',
+        options={'HIDDEN'}
+    )
+
+    file_format: EnumProperty(
+        name="Format",
+        items=[("NPZ", "Binary (.npz)", "Compressed numpy archive, with the histograms"),
+               ("CSV", "CSV (.csv)", "Text file with a row per sample: time, series, part, value")],
+        default="NPZ"
+    )
+
+    def execute(self, context):
+        if telemetry is None:
+            printError(self, "Enable the telemetry first")
+            return {'CANCELLED'}
+        filepath = self.filepath
+        if self.file_format == "CSV":
+            filepath = os.path.splitext(filepath)[0] + ".csv"
+        telemetry.save(filepath)
+        self.report({'INFO'}, "Telemetry saved in " + filepath)
+        return {'FINISHED'}
+
+
+class WM_OT_StartStreaming(bpy.types.Operator):
+    bl_label = "Start streaming"
+    bl_idname = "wm.start_streaming"
+    bl_description = "Stream the animation from the current frame to the connected parts at a fixed rate"
+
+    def execute(self, context):
+        scene = context.scene
+        mytool = scene.my_tool
+
+        if is_streaming() or is_approaching():
+            return {'CANCELLED'}
+        if scene.frame_current > scene.frame_end:
+            printError(self, "The current frame is after the end of the animation")
+            return {'CANCELLED'}
+        armature = bpy.data.objects[mytool.my_armature]
+
+        parts = []
+        moves = []
+        for key, rcb_instance in bpy.types.Scene.rcb_wrapper.items():
+            # Refresh the mapping if the armature changed
+            rcb_instance.update_mapping(armature)
+            if len(rcb_instance.axes) == 0:
+                continue
+            targets = None
+            if baked_trajectory is not None:
+                targets = rcb_instance.trajectory_targets(baked_trajectory, armature, scene.frame_current, scene.frame_end)
+            if targets is None:
+                targets = sample_action(armature, rcb_instance.bones, scene.frame_current, scene.frame_end)
+            # The references are sent in position direct, the joints far from
+            # the first frame have to reach it before
+            encs = rcb_instance.encoders()
+            if encs is None:
+                printError(self, "Cannot read the encoders of", key)
+                return {'CANCELLED'}
+            far = np.flatnonzero(rcb_instance.check(targets[0], encs)[1])
+            if len(far) > 0:
+                moves.append((rcb_instance, far, targets[0]))
+            parts.append((rcb_instance, targets))
+        if not parts:
+            printError(self, "No connected part to stream")
+            return {'CANCELLED'}
+
+        fps = scene.render.fps / scene.render.fps_base
+
+        def start_engine():
+            global streaming_engine
+            streaming_engine = StreamingEngine(parts, fps, mytool.my_stream_rate, scene.frame_current, mytool.my_stream_loop,
+                                               telemetry)
+            streaming_engine.start()
+            bpy.app.timers.register(follow_streaming)
+
+        if moves:
+            start_approach(moves, start_engine)
+        else:
+            start_engine()
+        return {'FINISHED'}
+
+
+class WM_OT_StopStreaming(bpy.types.Operator):
+    bl_label = "Stop streaming"
+    bl_idname = "wm.stop_streaming"
+    bl_description = "Stop streaming the animation"
+
+    def execute(self, context):
+        stop_approach()
+        stop_streaming()
         return {'FINISHED'}
 
 
@@ -594,11 +1156,91 @@ class OBJECT_PT_robot_controller(Panel):
         box.prop(mytool, "my_string")
         row_connect = box.row(align=True)
         row_connect.operator("wm.connect")
+        row_connect_all = box.row(align=True)
+        row_connect_all.operator("wm.connect_all")
         layout.separator()
         row_disconnect = box.row(align=True)
         row_disconnect.operator("wm.disconnect")
         layout.separator()
 
+        box_trajectory = layout.box()
+        box_trajectory.label(text="Trajectory")
+        row_bake = box_trajectory.row(align=True)
+        row_bake.operator("wm.bake_trajectory")
+        row_bake.prop(mytool, "my_bake_memmap")
+        row_export = box_trajectory.row(align=True)
+        row_export.operator("wm.export_trajectory")
+        row_export.enabled = baked_trajectory is not None and len(rcb_wrapper) > 0
+        if baked_trajectory is not None:
+            box_trajectory.label(text="{} frames ({}-{}), {} joints".format(len(baked_trajectory.values),
+                                                                        baked_trajectory.frame_start,
+                                                                        baked_trajectory.frame_end,
+                                                                        len(baked_trajectory.joint_names)))
+            out_of_limits = int(np.count_nonzero(baked_trajectory.out_of_limits()))
+            if out_of_limits > 0:
+                box_trajectory.label(text="{} joints outside the limits".format(out_of_limits), icon='ERROR')
+            velocities = baked_trajectory.peak_velocities()
+            if len(velocities) > 0:
+                column = int(np.argmax(velocities))
+                box_trajectory.label(text="Peak speed {:.1f} deg/s ({})".format(velocities[column],
+                                                                             baked_trajectory.joint_names[column]))
+
+        box_streaming = layout.box()
+        box_streaming.label(text="Streaming")
+        box_streaming.row(align=True).prop(mytool, "my_stream_rate")
+        box_streaming.row(align=True).prop(mytool, "my_stream_loop")
+        if is_approaching():
+            box_streaming.label(text="Approaching the animation...")
+            box_streaming.operator("wm.stop_streaming")
+        elif is_streaming():
+            box_streaming.label(text="Frame {:.1f}, {} late ticks".format(streaming_engine.frame,
+                                                                        streaming_engine.late_ticks))
+            box_streaming.operator("wm.stop_streaming")
+        else:
+            if streaming_engine is not None and streaming_engine.error is not None:
+                box_streaming.label(text="Stopped: {}".format(streaming_engine.error))
+            box_streaming.operator("wm.start_streaming")
+        box_streaming.enabled = len(rcb_wrapper) > 0
+
+        box_telemetry = layout.box()
+        box_telemetry.prop(mytool, "my_telemetry")
+        if telemetry is not None:
+            summary = telemetry.summary()
+            box_telemetry.label(text="Frame {:.2f} ms (p95 {:.1f}, max {:.1f}), {} dropped".format(summary["handler_mean"],
+                                                                                              summary["handler_p95"],
+                                                                                              summary["handler_max"],
+                                                                                              summary["dropped"]))
+            for part, stats in summary["parts"].items():
+                box_telemetry.label(text="{}: command {:.2f} ms (p95 {:.1f}), lag {:.0f} ms".format(part,
+                                                                                              stats["rpc_mean"],
+                                                                                              stats["rpc_p95"],
+                                                                                              stats["lag_mean"]))
+            row_telemetry = box_telemetry.row(align=True)
+            row_telemetry.operator("wm.reset_telemetry")
+            row_telemetry.operator("wm.export_telemetry")
+
+        box_recorder = layout.box()
+        box_recorder.label(text="Recorder")
+        box_recorder.row(align=True).prop(mytool, "my_record_rate")
+        box_recorder.row(align=True).prop(mytool, "my_record_duration")
+        if is_recording():
+            box_recorder.label(text="{} samples, {} late ticks".format(len(recorder.buffer), recorder.late_ticks))
+            box_recorder.operator("wm.stop_recording")
+        else:
+            box_recorder.operator("wm.start_recording")
+            if recorder is not None and recorder.error is not None:
+                box_recorder.label(text="Stopped: {}".format(recorder.error))
+            if recorder is not None and len(recorder.buffer) > 0:
+                box_recorder.label(text="{} samples ({:.1f} s)".format(len(recorder.buffer),
+                                                                     len(recorder.buffer) / recorder.rate))
+                if recording_error is not None and not np.all(np.isnan(recording_error[1])):
+                    column = int(np.nanargmax(recording_error[1]))
+                    box_recorder.label(text="Max tracking error {:.2f} deg".format(recording_error[1][column]))
+                row_recording = box_recorder.row(align=True)
+                row_recording.operator("wm.save_recording")
+                row_recording.operator("wm.recording_to_action")
+        box_recorder.enabled = len(rcb_wrapper) > 0 or recorder is not None
+
         reach_box = layout.box()
         reach_box.label(text="Reach target")
         reach_box.row(align=True).prop(mytool, "my_baseframeenum")
@@ -647,14 +1289,18 @@ class OBJECT_PT_robot_controller(Panel):
         else:
             box.enabled = True
             box_configure.enabled = False
-            if bpy.context.screen.is_animation_playing:
+            if bpy.context.screen.is_animation_playing or is_streaming() or is_approaching():
+                box_streaming.enabled = is_streaming() or is_approaching()
+                box_trajectory.enabled = False
                 row_disconnect.enabled = False
                 row_connect.enabled = False
+                row_connect_all.enabled = False
                 box_joints.enabled = False
                 reach_box.enabled = False
             else:
                 box_joints.enabled = True
                 reach_box.enabled = ikv.configured
+                row_connect_all.enabled = any(item.value not in rcb_wrapper for item in parts)
                 if getattr(parts[scene.list_index], "value") in rcb_wrapper.keys():
                     row_disconnect.enabled = True
                     row_connect.enabled = False
@@ -695,10 +1341,15 @@ def configure_ik():
         ikv.configured = False
         return
     ikv.configured = True
-    model_urdf = bpy.context.scene['model_urdf']
-    mdlLoader = iDynTree.ModelLoader()
-    mdlLoader.loadModelFromString(model_urdf)
-    ikv.iDynTreeModel = mdlLoader.model()
+    ikv.iDynTreeModel = None
+    # Prefer the compiled kinematic snapshot, it does not require to parse the urdf
+    if 'model_snapshot' in bpy.context.scene:
+        ikv.iDynTreeModel = load_model_snapshot(bpy.context.scene['model_snapshot'])
+    if ikv.iDynTreeModel is None:
+        model_urdf = bpy.context.scene['model_urdf']
+        mdlLoader = iDynTree.ModelLoader()
+        mdlLoader.loadModelFromString(model_urdf)
+        ikv.iDynTreeModel = mdlLoader.model()
 
     # list_of_links = []
     for link_idx in range(ikv.iDynTreeModel.getNrOfLinks()):
@@ -1,5 +1,8 @@
 import bpy
+import base64
+import io
 import math
+import numpy as np
 import idyntree.bindings as iDynTree
 
 
@@ -12,6 +15,64 @@ class IkVariables:
 bones_with_driver = []
 
 
+# Layout written by urdfToBlender (see urdfToBlender/kinematics.py)
+SNAPSHOT_VERSION = 1
+JOINT_REVOLUTE = 1
+JOINT_PRISMATIC = 2
+
+
+def to_idyntree_transform(matrix):
+    rotation = iDynTree.Rotation(*[float(v) for v in matrix[:3, :3].ravel()])
+    position = iDynTree.Position(*[float(v) for v in matrix[:3, 3]])
+    return iDynTree.Transform(rotation, position)
+
+
+def load_model_snapshot(encoded):
+    # Build the iDynTree model from the kinematic snapshot stored in the scene,
+    # returns None if the snapshot is not compatible.
+    with np.load(io.BytesIO(base64.b64decode(encoded))) as data:
+        if int(data["version"]) != SNAPSHOT_VERSION:
+            return None
+        snapshot = {key: data[key] for key in data.files}
+
+    model = iDynTree.Model()
+    # The links are added in the same order, so the indices are preserved
+    for link_name in snapshot["link_names"]:
+        model.addLink(str(link_name), iDynTree.Link())
+
+    for joint_idx, joint_name in enumerate(snapshot["joint_names"]):
+        parent = int(snapshot["joint_parent"][joint_idx])
+        child = int(snapshot["joint_child"][joint_idx])
+        joint_type = int(snapshot["joint_type"][joint_idx])
+        if joint_type == JOINT_REVOLUTE:
+            joint = iDynTree.RevoluteJoint()
+        elif joint_type == JOINT_PRISMATIC:
+            joint = iDynTree.PrismaticJoint()
+        else:
+            joint = iDynTree.FixedJoint()
+        joint.setAttachedLinks(parent, child)
+        joint.setRestTransform(to_idyntree_transform(snapshot["joint_rest"][joint_idx]))
+        if joint_type in (JOINT_REVOLUTE, JOINT_PRISMATIC):
+            direction = snapshot["joint_axis"][joint_idx, :3]
+            origin = snapshot["joint_axis"][joint_idx, 3:]
+            axis = iDynTree.Axis(iDynTree.Direction(*[float(v) for v in direction]),
+                                 iDynTree.Position(*[float(v) for v in origin]))
+            joint.setAxis(axis, child, parent)
+            joint.enablePosLimits(True)
+            joint.setPosLimits(0,
+                               float(snapshot["joint_limits"][joint_idx, 0]),
+                               float(snapshot["joint_limits"][joint_idx, 1]))
+        model.addJoint(str(joint_name), joint)
+
+    for frame_idx, frame_name in enumerate(snapshot["frame_names"]):
+        link_name = str(snapshot["link_names"][int(snapshot["frame_link"][frame_idx])])
+        model.addAdditionalFrameToLink(link_name, str(frame_name),
+                                       to_idyntree_transform(snapshot["frame_transform"][frame_idx]))
+
+    model.setDefaultBaseLink(int(snapshot["base_link"]))
+    return model
+
+
 def printError(object, *args):
     object.report({"ERROR"}, " ".join(args))
 
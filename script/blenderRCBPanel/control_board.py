@@ -0,0 +1,362 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Access to a remote_controlboard without blender, shared by the panel and by
+# the standalone replayer (rcb_replay.py).
+
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import yarp
+
+try:
+    from .state_reader import StateReader
+except ImportError:
+    from state_reader import StateReader
+
+CLIENT_PREFIX = "/blender_controller/client/"
+# Maximum distance (degrees) between encoders and targets for moving in position direct
+SAFETY_THRESHOLD = 10.0
+# Speed (degrees/s) of the joints when approaching the targets in position control
+APPROACH_SPEED = 10.0
+# Time (seconds) waited for the first encoders streamed by the board
+STATE_WAIT = 1.0
+
+
+def default_metadata_file():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "blender-robotics-utils", "control_boards.json")
+
+
+class MetadataCache:
+    # Axis names and limits of the control boards by remote port, stored in a
+    # json file so that connecting again does not query them joint by joint.
+    # An entry is used only if the board still has the same number of axes.
+    # If filename is None nothing is written on disk.
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.hits = 0
+        self._lock = threading.Lock()
+        if filename is not None and os.path.isfile(filename):
+            try:
+                with open(filename) as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print("Ignoring the metadata cache", filename, ":", e)
+
+    def lookup(self, remote, axes):
+        # (limits, names) of the remote, None if unknown or not valid anymore
+        entry = self.entries.get(remote)
+        if entry is None or entry["axes"] != axes or len(entry["names"]) != axes or len(entry["limits"]) != axes:
+            return None
+        self.hits += 1
+        return entry["limits"], entry["names"]
+
+    def store(self, remote, limits, names):
+        with self._lock:
+            self.entries[remote] = {"axes": len(names), "limits": limits, "names": names}
+            if self.filename is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+                # Written aside and renamed, the parts are opened concurrently
+                temp = self.filename + ".tmp"
+                with open(temp, 'w') as f:
+                    json.dump(self.entries, f, indent=4)
+                os.replace(temp, self.filename)
+            except OSError as e:
+                print("Cannot write the metadata cache", self.filename, ":", e)
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}
+            if self.filename is not None and os.path.isfile(self.filename):
+                os.remove(self.filename)
+
+
+def open_driver(robot, part):
+    # Open the remote_controlboard of the part and view its interfaces.
+    # Returns (driver, interfaces) or (None, error message).
+    options = yarp.Property()
+    driver = yarp.PolyDriver()
+
+    # set the poly driver options
+    options.put("robot", robot)
+    options.put("device", "remote_controlboard")
+    options.put("local", CLIENT_PREFIX + part)
+    options.put("remote", "/" + robot + "/" + part)
+
+    # opening the drivers
+    print('Opening the motor driver of', part, '...')
+    driver.open(options)
+
+    if not driver.isValid():
+        return None, "Cannot open the driver of " + part + "!"
+
+    interfaces = (driver.viewIControlMode(),
+                  driver.viewIPositionDirect(),
+                  driver.viewIPositionControl(),
+                  driver.viewIEncoders(),
+                  driver.viewIAxisInfo(),
+                  driver.viewIControlLimits())
+    if any(interface is None for interface in interfaces):
+        driver.close()
+        return None, "Cannot view one of the interfaces of " + part + "!"
+    return driver, interfaces
+
+
+class ControlBoard:
+    # Interfaces of a remote_controlboard and the multi-joint commands on the
+    # selected axes (see select_axes). Targets and encoders are in degrees.
+    # The board can be opened again after the device went away (see reopen),
+    # keeping the selected axes, meanwhile the commands return False.
+
+    def __init__(self, robot, part):
+        self.robot = robot
+        self.part = part
+        self.driver = None
+        # Background reader of the streamed encoders
+        self.state = None
+        self.joint_limits = []
+        # Queried once at connect time, getAxisName is a remote call
+        self.axis_names = []
+        # Taken by the commands, the driver can be replaced by another thread
+        self.lock = threading.RLock()
+        # Telemetry (see telemetry.py) fed by the commands and the state, if enabled
+        self.telemetry = None
+        self.select_axes([])
+
+    @property
+    def remote(self):
+        return "/" + self.robot + "/" + self.part
+
+    @property
+    def connected(self):
+        return self.driver is not None
+
+    def open(self, metadata=None):
+        # Open the driver and put all the joints in position direct. The axis
+        # names and limits are taken from metadata (a MetadataCache) when
+        # valid. Returns None or the error message.
+        driver, interfaces = open_driver(self.robot, self.part)
+        if driver is None:
+            return interfaces
+        icm, iposDir, ipos, ienc, iax, ilim = interfaces
+
+        axes = ipos.getAxes()
+        cached = metadata.lookup(self.remote, axes) if metadata is not None else None
+        if cached is not None:
+            joint_limits, axis_names = cached
+        else:
+            # IControlLimits has no multi-joint getter, the limits are read
+            # here in the thread of the part when opened by open_control_boards
+            joint_limits = []
+            axis_names = []
+            min = yarp.Vector(1)
+            max = yarp.Vector(1)
+            for joint in range(0, axes):
+                ilim.getLimits(joint, min.data(), max.data())
+                joint_limits.append([min.get(0), max.get(0)])
+                axis_names.append(iax.getAxisName(joint))
+            if metadata is not None:
+                metadata.store(self.remote, joint_limits, axis_names)
+        if self.axis_names and axis_names != self.axis_names:
+            driver.close()
+            return "The axes of " + self.part + " changed, connect it again!"
+
+        # All the joints in position direct with a single call
+        icm.setControlModes(axes, yarp.IVector(list(range(axes))), yarp.IVector([yarp.VOCAB_CM_POSITION_DIRECT] * axes))
+
+        with self.lock:
+            self.driver = driver
+            self.icm = icm
+            self.iposDir = iposDir
+            self.ipos = ipos
+            self.ienc = ienc
+            self.iax = iax
+            self.encs = yarp.Vector(axes)
+            self.joint_limits = joint_limits
+            self.axis_names = axis_names
+            self.select_axes(self.axes, self.safety_mask)
+        if not self.stream_state():
+            print("The state of", self.part, "is not streamed, the encoders will be read with getEncoders")
+        return None
+
+    def reopen(self, metadata=None):
+        # Close the driver and open it again, returns None or the error message
+        self.close()
+        return self.open(metadata)
+
+    def healthy(self):
+        # False if the board stopped answering or streaming its state
+        if self.driver is None:
+            return False
+        if self.state is not None:
+            return self.state.latest() is not None
+        with self.lock:
+            return self.driver is not None and self.ienc.getEncoders(self.encs.data())
+
+    def select_axes(self, axes, safety_mask=None):
+        # Axes commanded, with their limits in the same order. The safety
+        # check is skipped for the axes false in safety_mask.
+        self.axes = np.array(axes, dtype=np.int32)
+        self.limits = np.array([self.joint_limits[axis] for axis in self.axes]).reshape(-1, 2)
+        if safety_mask is None:
+            safety_mask = np.ones(len(self.axes), dtype=bool)
+        self.safety_mask = np.asarray(safety_mask, dtype=bool)
+        self.axes_vector = yarp.IVector([int(axis) for axis in self.axes])
+        # Last targets sent to the selected axes, nan if none was sent
+        self.commanded = np.full(len(self.axes), np.nan)
+
+    def check(self, targets, encs, threshold=SAFETY_THRESHOLD):
+        # Returns the masks of the targets within the limits and of the ones
+        # too far from the encoders for being sent in position direct
+        in_limits = (targets >= self.limits[:, 0]) & (targets <= self.limits[:, 1])
+        far = in_limits & self.safety_mask & (np.abs(encs - targets) > threshold)
+        return in_limits, far
+
+    def send(self, targets, threshold=SAFETY_THRESHOLD):
+        # A frame of the playback: the targets within the limits and close to
+        # the encoders are sent in a single call, the far ones have to be
+        # approached. Returns (in_limits, far, encs), None without encoders.
+        encs = self.encoders()
+        if encs is None:
+            return None
+        in_limits, far = self.check(targets, encs, threshold)
+        self.set_positions(np.flatnonzero(in_limits & ~far), targets)
+        return in_limits, far, encs
+
+    def stream_state(self, timeout=STATE_WAIT):
+        # Read the encoders from the state port of the board instead of
+        # calling getEncoders, False if the board does not stream them
+        reader = StateReader(CLIENT_PREFIX + self.part + "/state:i", self.remote + "/state:o")
+        if not reader.open():
+            return False
+        if not reader.wait(timeout):
+            reader.stop()
+            return False
+        reader.on_sample = self.state_received
+        self.state = reader
+        return True
+
+    def state_received(self, values):
+        # Called by the state reader, for the lag between commands and encoders
+        telemetry = self.telemetry
+        if telemetry is not None and len(values) == len(self.axis_names):
+            telemetry.state(self.part, values[self.axes])
+
+    def encoders(self):
+        # Encoders in degrees of the selected axes, None if they cannot be
+        # read or the streamed ones are stale
+        state = self.state
+        if state is not None:
+            values = state.latest()
+            if values is None or len(values) != len(self.axis_names):
+                return None
+            return values[self.axes]
+        with self.lock:
+            if self.driver is None or not self.ienc.getEncoders(self.encs.data()):
+                return None
+            return np.fromiter((self.encs[int(axis)] for axis in self.axes),
+                               dtype=np.float64, count=len(self.axes))
+
+    def joints(self, indices):
+        # Axes selected by indices among the selected ones
+        if len(indices) == len(self.axes):
+            return self.axes_vector
+        return yarp.IVector([int(axis) for axis in self.axes[indices]])
+
+    def set_positions(self, indices, targets):
+        # Send the targets of the axes selected by indices in a single call
+        if len(indices) == 0:
+            return True
+        with self.lock:
+            if self.driver is None:
+                return False
+            self.commanded[indices] = targets[indices]
+            telemetry = self.telemetry
+            if telemetry is None:
+                return self.iposDir.setPositions(len(indices), self.joints(indices), yarp.DVector([float(t) for t in targets[indices]]))
+            start = time.perf_counter()
+            result = self.iposDir.setPositions(len(indices), self.joints(indices), yarp.DVector([float(t) for t in targets[indices]]))
+            telemetry.call(self.part, time.perf_counter() - start)
+            telemetry.command(self.part, self.commanded)
+            return result
+
+    def position_move(self, indices, targets, speed=APPROACH_SPEED):
+        # Reach the targets in position control, one multi-joint call per interface
+        n = len(indices)
+        joints = self.joints(indices)
+        with self.lock:
+            if self.driver is None:
+                return False
+            self.icm.setControlModes(n, joints, yarp.IVector([yarp.VOCAB_CM_POSITION] * n))
+            self.ipos.setRefSpeeds(n, joints, yarp.DVector([float(speed)] * n))
+            self.commanded[indices] = targets[indices]
+            return self.ipos.positionMove(n, joints, yarp.DVector([float(t) for t in targets[indices]]))
+
+    def moving(self, indices):
+        # The indices whose motion is not done yet. The axes are checked in
+        # order up to the first still moving, the ones after it are kept
+        # pending and checked at the next poll.
+        indices = np.asarray(indices, dtype=np.int64)
+        with self.lock:
+            if self.driver is None:
+                return indices
+            for k, i in enumerate(indices):
+                if not self.ipos.isMotionDone(int(self.axes[i])):
+                    return indices[k:]
+            return indices[:0]
+
+    def position_direct(self, indices):
+        n = len(indices)
+        with self.lock:
+            if self.driver is None:
+                return False
+            return self.icm.setControlModes(n, self.joints(indices), yarp.IVector([yarp.VOCAB_CM_POSITION_DIRECT] * n))
+
+    def close(self):
+        # The reader first, its port would keep the name taken by a new one
+        if self.state is not None:
+            self.state.stop()
+            self.state = None
+        with self.lock:
+            if self.driver is not None:
+                self.driver.close()
+                self.driver = None
+
+
+def open_control_board(robot, part, cls=ControlBoard, metadata=None):
+    # Open the remote_controlboard of the part and put all its joints in
+    # position direct. Returns (board, None) or (None, error message).
+    board = cls(robot, part)
+    error = board.open(metadata)
+    if error is not None:
+        return None, error
+    return board, None
+
+
+def open_control_boards(robot, parts, cls=ControlBoard, metadata=None):
+    # Open the control boards of the parts at the same time, one thread per
+    # part, so that connecting the whole robot takes about as long as its
+    # slowest part. Returns the dict part -> (board, error message).
+    if not parts:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        futures = {part: executor.submit(open_control_board, robot, part, cls, metadata) for part in parts}
+    results = {}
+    for part, future in futures.items():
+        try:
+            results[part] = future.result()
+        except Exception as e:
+            results[part] = (None, "Cannot open the driver of " + part + ": " + str(e))
+    return results
@@ -0,0 +1,50 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import time
+
+import numpy as np
+
+try:
+    from .control_board import SAFETY_THRESHOLD
+except ImportError:
+    from control_board import SAFETY_THRESHOLD
+
+
+def play_frame(boards, targets_of, threshold=SAFETY_THRESHOLD, telemetry=None, frame=None, dropped=None):
+    # A frame of the playback, without Blender: boards is the dict part ->
+    # board, targets_of(board) gives the targets of the mapped axes of the
+    # board at the frame. The targets within the limits and close to the
+    # encoders are sent, the far ones are returned as the list of (board, far
+    # indices, targets) to approach in position control. The time spent is
+    # reported to telemetry, if given, with the frame and the dropped frames.
+    # Returns (moves, number of parts skipped without encoders).
+    start = time.perf_counter()
+    moves = []
+    skipped = 0
+    for key, board in boards.items():
+        targets = targets_of(board)
+        if len(targets) == 0:
+            continue
+        # The encoders are streamed by the board, a part whose state is stale
+        # is skipped without affecting the others
+        sent = board.send(targets, threshold)
+        if sent is None:
+            print("I cannot read the encoders of", key, ", skipping")
+            skipped += 1
+            continue
+        in_limits, safety_check, encs = sent
+        for i in np.flatnonzero(~in_limits):
+            print("The target", targets[i], "it is outside the boundaries (", board.limits[i, 0], ",", board.limits[i, 1], "), skipping.")
+
+        far = np.flatnonzero(safety_check)
+        for i in far:
+            print("The target is too far, reaching in position control, for joint", board.axis_names[board.axes[i]], "by ", abs(encs[i] - targets[i]), " degrees" )
+        if len(far) > 0:
+            moves.append((board, far, targets))
+    if telemetry is not None:
+        telemetry.frame(time.perf_counter() - start, frame, dropped)
+    return moves, skipped
@@ -0,0 +1,160 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Replay without Blender the trajectories exported by the RCB panel (Export in
+# the Trajectory section), streaming them in position direct at a fixed rate:
+#
+#   python rcb_replay.py trajectory.npz --robot icub --rate 100
+#
+# The same checks of the panel are applied: the targets outside the limits of
+# the robot are not sent, and the joints farther than --threshold degrees from
+# the first frame reach it in position control before starting. While
+# replaying, the replay stops if a joint gets farther than --threshold degrees
+# from its target. The references follow the time column of the export.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import yarp
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from approach import ApproachMotion
+from control_board import (open_control_boards, MetadataCache, default_metadata_file,
+                           SAFETY_THRESHOLD, APPROACH_SPEED)
+from streaming import StreamingEngine
+from telemetry import Telemetry
+from trajectory import load_parts
+
+
+def select_axes(board, name, joints):
+    # Select on the board the axes of the trajectory, checking that the robot
+    # has the same joints of the exported part
+    for axis, joint_name in zip(joints["axes"], joints["names"]):
+        if axis >= len(board.axis_names) or board.axis_names[axis] != joint_name:
+            return "The axis {} of {} is not {}, the trajectory has been exported for another robot".format(axis, name, joint_name)
+    board.select_axes(joints["axes"], joints["safety_mask"])
+    return None
+
+
+def replay(args):
+    metadata, times, values = load_parts(args.trajectory)
+    robot = args.robot or metadata["robot"]
+    names = [name for name, _ in metadata["parts"] if not args.parts or name in args.parts]
+    if not names:
+        print("No part to replay")
+        return False
+
+    yarp.Network.init()
+    if not yarp.Network.checkNetwork():
+        print("YARP server is not running!")
+        return False
+
+    boards = []
+    try:
+        results = open_control_boards(robot, names, metadata=MetadataCache(default_metadata_file()))
+        boards = [board for board, _ in results.values() if board is not None]
+        for name in names:
+            board, error = results[name]
+            if board is None:
+                print(error)
+                return False
+            error = select_axes(board, name, metadata["joints"][name])
+            if error is not None:
+                print(error)
+                return False
+        parts = [(board, values[name]) for board, name in zip(boards, names)]
+
+        # The targets outside the limits of the robot are skipped, as in the panel
+        for (board, targets), name in zip(parts, names):
+            in_limits, _ = board.check(targets, targets)
+            for column in np.flatnonzero(~in_limits.all(axis=0)):
+                print("The joint", board.axis_names[board.axes[column]], "of", name, "is outside the boundaries in",
+                      np.count_nonzero(~in_limits[:, column]), "frames, they will be skipped.")
+
+        # The joints too far from the first frame reach it in position control
+        moves = []
+        for (board, targets), name in zip(parts, names):
+            encs = board.encoders()
+            if encs is None:
+                print("Cannot read the encoders of", name)
+                return False
+            far = np.flatnonzero(board.check(targets[0], encs, args.threshold)[1])
+            if len(far) > 0:
+                print("Reaching the first frame in position control for", len(far), "joints of", name)
+                moves.append((board, far, targets[0]))
+        if args.dry_run:
+            print("Dry run,", len(times), "frames of", len(names), "parts checked.")
+            return True
+        if moves:
+            approach = ApproachMotion(moves, args.speed, timeout=args.timeout)
+            approach.start()
+            approach.join()
+            if not approach.converged:
+                return False
+
+        telemetry = None
+        if args.telemetry:
+            telemetry = Telemetry()
+            for board in boards:
+                board.telemetry = telemetry
+        # The references follow the timestamps of the export, and each of them
+        # is checked against the encoders: the replay stops if a joint gets
+        # farther than the threshold
+        engine = StreamingEngine(parts, metadata["fps"], args.rate, 0, args.loop, telemetry,
+                                 args.threshold, True, times)
+        start = time.perf_counter()
+        engine.start()
+        try:
+            while engine.is_alive():
+                engine.join(0.1)
+        except KeyboardInterrupt:
+            print("Stopping")
+            engine.stop()
+        elapsed = time.perf_counter() - start
+        print("Streamed {} references in {:.2f} s ({:.1f} Hz), {} late ticks".format(
+              engine.ticks, elapsed, engine.ticks / elapsed if elapsed > 0 else 0.0, engine.late_ticks))
+        if engine.missing > 0:
+            print(engine.missing, "references skipped without the encoders of their part")
+        if telemetry is not None:
+            summary = telemetry.summary()
+            print("Tick {:.2f} ms (p95 {:.1f}, max {:.1f})".format(summary["handler_mean"], summary["handler_p95"],
+                                                                    summary["handler_max"]))
+            for part, stats in summary["parts"].items():
+                print("{}: command {:.2f} ms (p95 {:.1f}, max {:.1f}), lag {:.1f} ms (p95 {:.1f})".format(
+                      part, stats["rpc_mean"], stats["rpc_p95"], stats["rpc_max"], stats["lag_mean"], stats["lag_p95"]))
+            telemetry.save(args.telemetry)
+            print("Telemetry saved in", args.telemetry)
+        return engine.error is None
+    finally:
+        for board in boards:
+            board.close()
+        yarp.Network.fini()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay a trajectory exported by the RCB panel")
+    parser.add_argument("trajectory", help=".npz or .csv file exported by the panel")
+    parser.add_argument("--robot", default=None, help="prefix of the robot ports, by default the one of the export")
+    parser.add_argument("--parts", type=lambda v: [p for p in v.split(",") if p], default=[],
+                        help="comma separated parts to replay, by default all the exported ones")
+    parser.add_argument("--rate", type=float, default=100.0, help="rate of the references in Hz")
+    parser.add_argument("--loop", action="store_true", help="replay until interrupted")
+    parser.add_argument("--threshold", type=float, default=SAFETY_THRESHOLD,
+                        help="maximum distance in degrees between encoders and targets for sending them in position direct")
+    parser.add_argument("--speed", type=float, default=APPROACH_SPEED,
+                        help="speed in degrees/s for reaching the first frame")
+    parser.add_argument("--timeout", type=float, default=30.0, help="timeout in seconds for reaching the first frame")
+    parser.add_argument("--dry_run", action="store_true", help="connect and check the trajectory without moving")
+    parser.add_argument("--telemetry", default=None,
+                        help=".npz or .csv file where to save the latency of the commands and the lag of the encoders")
+    return replay(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
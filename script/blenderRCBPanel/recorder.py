@@ -0,0 +1,154 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+import time
+
+import numpy as np
+
+
+class RingBuffer:
+    # Preallocated rows of timestamped values, once full the oldest rows are
+    # overwritten
+
+    def __init__(self, capacity, columns):
+        self.capacity = int(capacity)
+        self.times = np.empty(self.capacity)
+        self.values = np.empty((self.capacity, columns))
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def overwritten(self):
+        return max(0, self.count - self.capacity)
+
+    def append(self, time, row):
+        index = self.count % self.capacity
+        self.times[index] = time
+        self.values[index] = row
+        self.count += 1
+
+    def arrays(self):
+        # Copy of the times and values, from the oldest row
+        if self.count <= self.capacity:
+            return self.times[:self.count].copy(), self.values[:self.count].copy()
+        start = self.count % self.capacity
+        return (np.concatenate((self.times[start:], self.times[:start])),
+                np.concatenate((self.values[start:], self.values[:start])))
+
+
+class Recorder(threading.Thread):
+    # Samples at a fixed rate the encoders of the selected axes of the parts,
+    # together with the last targets commanded to them, in a ring buffer of
+    # duration seconds. parts is the list of (name, board). The encoders are
+    # the ones streamed by the boards (see ControlBoard.encoders), the
+    # recording does not add remote calls to the ones of the playback.
+    # A part whose state is not available is recorded as nan.
+    # The axes recorded are the ones selected when the recording starts, if
+    # they change (e.g. the armature is mapped again) the recording stops.
+
+    def __init__(self, parts, rate=100.0, duration=300.0):
+        super().__init__(name="rcb_recorder", daemon=True)
+        # (name, board, columns, joints), joints are the recorded axes with
+        # their names, limits and safety mask
+        self.parts = []
+        column = 0
+        for name, board in parts:
+            joints = {"axes": board.axes.copy(),
+                      "names": [board.axis_names[axis] for axis in board.axes],
+                      "limits": board.limits.copy(),
+                      "safety_mask": board.safety_mask.copy()}
+            self.parts.append((name, board, slice(column, column + len(board.axes)), joints))
+            column += len(board.axes)
+        self.columns = column
+        # Columns of the commanded targets of each part
+        self.commanded = [slice(column + columns.start, column + columns.stop) for _, _, columns, _ in self.parts]
+        self.rate = rate
+        self.period = 1.0 / rate
+        # Encoders in the first half of the row, commanded targets in the second
+        self.buffer = RingBuffer(max(1, int(rate * duration)), 2 * column)
+        self.ticks = 0
+        self.late_ticks = 0
+        self.missing = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.is_alive() and not self._stop_event.is_set()
+
+    def stop(self, wait=True):
+        self._stop_event.set()
+        if wait and self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def sample(self, row):
+        for (name, board, columns, joints), commanded in zip(self.parts, self.commanded):
+            if not np.array_equal(board.axes, joints["axes"]):
+                raise RuntimeError("the axes of {} changed".format(name))
+            encs = board.encoders()
+            if encs is None:
+                row[columns] = np.nan
+                self.missing += 1
+            else:
+                row[columns] = encs
+            row[commanded] = board.commanded
+
+    def run(self):
+        row = np.empty(2 * self.columns)
+        start = time.perf_counter()
+        next_tick = start
+        try:
+            while not self._stop_event.is_set():
+                self.sample(row)
+                self.buffer.append(time.perf_counter() - start, row)
+                self.ticks += 1
+                next_tick += self.period
+                delay = next_tick - time.perf_counter()
+                if delay > 0.0:
+                    self._stop_event.wait(delay)
+                else:
+                    self.late_ticks += 1
+                    next_tick = time.perf_counter()
+        except Exception as e:
+            self.error = e
+            print("Recording stopped:", e)
+        self._stop_event.set()
+
+    def recording(self):
+        # Times, encoders and commanded targets recorded, from the oldest sample
+        times, values = self.buffer.arrays()
+        return times, values[:, :self.columns], values[:, self.columns:]
+
+    def tracking_error(self, encoders=None, commanded=None):
+        # RMS and maximum absolute difference between encoders and commanded
+        # targets of each recorded axis, ignoring the samples without either
+        if encoders is None:
+            _, encoders, commanded = self.recording()
+        error = np.abs(encoders - commanded)
+        valid = ~np.isnan(error)
+        count = valid.sum(axis=0)
+        error = np.where(valid, error, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rms = np.where(count > 0, np.sqrt((error ** 2).sum(axis=0) / count), np.nan)
+        peak = np.where(count > 0, error.max(axis=0, initial=0.0), np.nan)
+        return rms, peak
+
+    def export_parts(self):
+        # Recorded parts in the format of trajectory.save_parts
+        _, encoders, commanded = self.recording()
+        parts = []
+        for name, _, columns, joints in self.parts:
+            parts.append({"name": name,
+                          "axes": joints["axes"],
+                          "joints": joints["names"],
+                          "values": encoders[:, columns],
+                          "commanded": commanded[:, columns],
+                          "limits": joints["limits"],
+                          "safety_mask": joints["safety_mask"]})
+        return parts
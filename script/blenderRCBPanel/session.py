@@ -0,0 +1,120 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+
+try:
+    from .control_board import ControlBoard, MetadataCache, default_metadata_file, open_control_boards
+except ImportError:
+    from control_board import ControlBoard, MetadataCache, default_metadata_file, open_control_boards
+
+# Period (seconds) of the health check of the connected boards
+MONITOR_PERIOD = 1.0
+# Consecutive failed checks before opening a board again: a stale state may
+# only mean that Blender held the interpreter for a long operator
+MONITOR_FAILURES = 3
+
+# The session of the process, see get_session. Not reset when the module is
+# reloaded, the boards it holds are still open.
+if "_session" not in globals():
+    _session = None
+
+
+class SessionManager:
+    # The control boards connected, by part. A thread checks periodically that
+    # they are still answering and opens again the ones whose device went
+    # away (failures checks in a row), keeping the same board object so that
+    # its users are not affected.
+    # The axis names and limits are cached in metadata (a MetadataCache), so
+    # that opening a part again only asks the number of its axes.
+
+    def __init__(self, metadata=None, period=MONITOR_PERIOD, failures=MONITOR_FAILURES):
+        self.boards = {}
+        self.metadata = MetadataCache() if metadata is None else metadata
+        self.period = period
+        self.failures = failures
+        # Consecutive failed checks of each part
+        self.failed = {}
+        # Parts whose device went away, being opened again
+        self.reconnecting = set()
+        self.reconnections = 0
+        self._monitor = None
+        self._stop_event = threading.Event()
+
+    def connect(self, robot, parts, cls=ControlBoard):
+        # Open the parts concurrently, returns the dict part -> (board, error)
+        results = open_control_boards(robot, parts, cls, self.metadata)
+        for part, (board, _) in results.items():
+            if board is not None:
+                self.boards[part] = board
+        if self.boards:
+            self.start_monitor()
+        return results
+
+    def disconnect(self, part):
+        board = self.boards.pop(part, None)
+        self.reconnecting.discard(part)
+        self.failed.pop(part, None)
+        if board is not None:
+            board.close()
+
+    def close(self):
+        self.stop_monitor()
+        for part in list(self.boards):
+            self.disconnect(part)
+
+    def start_monitor(self):
+        if self._monitor is not None and self._monitor.is_alive():
+            return
+        self._stop_event.clear()
+        self._monitor = threading.Thread(target=self.run, name="rcb_session", daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self):
+        self._stop_event.set()
+        if self._monitor is not None and self._monitor.is_alive():
+            self._monitor.join()
+        self._monitor = None
+
+    def check(self):
+        # Open again the boards that are not healthy
+        for part, board in list(self.boards.items()):
+            try:
+                if board.healthy():
+                    self.reconnecting.discard(part)
+                    self.failed.pop(part, None)
+                    continue
+                self.failed[part] = self.failed.get(part, 0) + 1
+                if self.failed[part] < self.failures:
+                    continue
+                if part not in self.reconnecting:
+                    print("The device of", part, "is not answering, reconnecting...")
+                    self.reconnecting.add(part)
+                error = board.reopen(self.metadata)
+                if self.boards.get(part) is not board:
+                    # Disconnected meanwhile
+                    board.close()
+                elif error is None:
+                    self.reconnecting.discard(part)
+                    self.failed.pop(part, None)
+                    self.reconnections += 1
+                    print(part, "reconnected")
+            except Exception as e:
+                print("Cannot check the connection of", part, ":", e)
+
+    def run(self):
+        while not self._stop_event.wait(self.period):
+            self.check()
+
+
+def get_session():
+    # The session of the process: it survives the reload of the addon and the
+    # loading of another file, so the parts stay connected and are never
+    # opened twice
+    global _session
+    if _session is None:
+        _session = SessionManager(MetadataCache(default_metadata_file()))
+    return _session
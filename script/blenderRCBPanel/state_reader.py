@@ -0,0 +1,93 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+import time
+
+import numpy as np
+import yarp
+
+# Age (seconds) after which the cached state is not trusted anymore
+STATE_TIMEOUT = 0.5
+
+
+class StateReader(threading.Thread):
+    # Reads in background the encoders streamed by the control board on its
+    # state:o port and keeps the latest sample, so that the handlers can read
+    # them without a remote call. The sample is (values in degrees, timestamp
+    # of the robot, local time of reception).
+
+    def __init__(self, local, remote, timeout=STATE_TIMEOUT):
+        super().__init__(name="rcb_state" + local.replace("/", "_"), daemon=True)
+        self.local = local
+        self.remote = remote
+        self.timeout = timeout
+        self.port = yarp.BufferedPortVector()
+        self.sample = None
+        self.samples = 0
+        self.error = None
+        # Called from the thread of the reader with the values of each sample
+        self.on_sample = None
+        self._received = threading.Event()
+        self._stop_event = threading.Event()
+
+    def open(self):
+        # Open the port and connect it to the control board, False if the
+        # board does not stream its state
+        if not self.port.open(self.local):
+            return False
+        if not yarp.Network.connect(self.remote, self.local):
+            self.port.close()
+            return False
+        self.start()
+        return True
+
+    def wait(self, timeout):
+        # Wait for the first sample, False if it did not arrive in time
+        return self._received.wait(timeout)
+
+    def stop(self):
+        self._stop_event.set()
+        self.port.interrupt()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.port.close()
+
+    def age(self):
+        # Seconds since the last sample, inf if none arrived
+        sample = self.sample
+        if sample is None:
+            return np.inf
+        return time.monotonic() - sample[2]
+
+    def latest(self):
+        # Latest values, None if stale
+        sample = self.sample
+        if sample is None or time.monotonic() - sample[2] > self.timeout:
+            return None
+        return sample[0]
+
+    def run(self):
+        stamp = yarp.Stamp()
+        try:
+            while not self._stop_event.is_set():
+                vector = self.port.read(True)
+                if vector is None:
+                    # interrupted
+                    continue
+                values = np.fromiter((vector.get(i) for i in range(vector.size())), dtype=np.float64, count=vector.size())
+                self.port.getEnvelope(stamp)
+                robot_time = stamp.getTime() if stamp.isValid() else None
+                # A single assignment, the readers never see a partial sample
+                self.sample = (values, robot_time, time.monotonic())
+                self.samples += 1
+                self._received.set()
+                if self.on_sample is not None:
+                    self.on_sample(values)
+        except Exception as e:
+            # The sample becomes stale, the handlers skip the part
+            self.error = e
+            print("Cannot read the state from", self.remote, ":", e)
@@ -0,0 +1,137 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import threading
+import time
+
+import numpy as np
+
+try:
+    from .control_board import SAFETY_THRESHOLD
+except ImportError:
+    from control_board import SAFETY_THRESHOLD
+
+
+def interpolate(targets, position):
+    # Row of targets at the fractional index position
+    last = len(targets) - 1
+    if last <= 0 or position <= 0.0:
+        return targets[0]
+    if position >= last:
+        return targets[last]
+    index = int(position)
+    alpha = position - index
+    return targets[index] * (1.0 - alpha) + targets[index + 1] * alpha
+
+
+class StreamingEngine(threading.Thread):
+    # Sends the position direct references of the connected parts from a
+    # dedicated thread at a fixed rate, independent of the frame rate of the
+    # viewport. The targets sampled at each frame are linearly interpolated.
+    # parts is the list of (part, targets), where part is an rcb_wrapper and
+    # targets the (frames, axes) array of its mapped axes in degrees.
+    # As in the playback, each reference is checked against the encoders: the
+    # targets farther than threshold degrees are not sent and stop the
+    # streaming if stop_on_far, a part without encoders is skipped.
+    # If times are given (the timestamps of the rows of targets, as saved by
+    # trajectory.save_parts) they time the references instead of fps.
+
+    def __init__(self, parts, fps, rate=100.0, frame_start=0, loop=False, telemetry=None,
+                 threshold=SAFETY_THRESHOLD, stop_on_far=True, times=None):
+        super().__init__(name="rcb_streaming", daemon=True)
+        self.parts = parts
+        self.fps = fps
+        self.period = 1.0 / rate
+        self.frame_start = frame_start
+        self.length = min(len(targets) for _, targets in parts)
+        if times is None:
+            self.times = None
+            self.duration = (self.length - 1) / fps
+        else:
+            self.length = min(self.length, len(times))
+            self.times = np.asarray(times[:self.length], dtype=np.float64) - times[0]
+            self.duration = self.times[-1]
+        self.loop = loop
+        # Frame being streamed, read by the viewport
+        self.frame = frame_start
+        self.ticks = 0
+        self.late_ticks = 0
+        self.threshold = threshold
+        self.stop_on_far = stop_on_far
+        # Targets not sent because too far from the encoders, and references
+        # of parts skipped because their encoders were not available
+        self.far_targets = 0
+        self.missing = 0
+        self.error = None
+        # Time of each tick and late ticks, if given (see telemetry.py)
+        self.telemetry = telemetry
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self):
+        return self.is_alive() and not self._stop_event.is_set()
+
+    def stop(self, wait=True):
+        self._stop_event.set()
+        if wait and self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def position(self, elapsed):
+        # Fractional index of the targets elapsed seconds after the start
+        if self.times is None:
+            return elapsed * self.fps
+        return float(np.interp(elapsed, self.times, np.arange(self.length)))
+
+    def send(self, position):
+        for part, targets in self.parts:
+            row = interpolate(targets, position)
+            sent = part.send(row, self.threshold)
+            if sent is None:
+                self.missing += 1
+                continue
+            _, far, encs = sent
+            far = np.flatnonzero(far)
+            self.far_targets += len(far)
+            if len(far) > 0 and self.stop_on_far:
+                i = far[0]
+                raise RuntimeError("the target of the joint {} of {} is {:.1f} degrees far from the encoders".format(
+                                   part.axis_names[part.axes[i]], part.part, abs(row[i] - encs[i])))
+
+    def run(self):
+        start = time.perf_counter()
+        next_tick = start
+        try:
+            while not self._stop_event.is_set():
+                elapsed = time.perf_counter() - start
+                finished = False
+                if elapsed >= self.duration:
+                    if self.loop and self.duration > 0.0:
+                        elapsed %= self.duration
+                    else:
+                        elapsed = self.duration
+                        finished = True
+                position = self.position(elapsed)
+                tick = time.perf_counter()
+                self.send(position)
+                sent = time.perf_counter()
+                self.frame = self.frame_start + position
+                self.ticks += 1
+                if finished:
+                    break
+                next_tick += self.period
+                delay = next_tick - time.perf_counter()
+                if self.telemetry is not None:
+                    self.telemetry.frame(sent - tick, self.frame, 0 if delay > 0.0 else 1)
+                if delay > 0.0:
+                    self._stop_event.wait(delay)
+                else:
+                    # Late, restart from now instead of sending a burst of references
+                    self.late_ticks += 1
+                    next_tick = time.perf_counter()
+        except Exception as e:
+            self.error = e
+            print("Streaming stopped:", e)
+        self._stop_event.set()
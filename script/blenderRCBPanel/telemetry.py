@@ -0,0 +1,205 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+try:
+    from .recorder import RingBuffer
+except ImportError:
+    from recorder import RingBuffer
+
+# Upper edges (milliseconds) of the bins of the latency histograms
+LATENCY_EDGES = np.array([0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, np.inf])
+# Distance (degrees) within which the encoders reached a commanded target
+LAG_TOLERANCE = 0.5
+# Commands waiting to be reached by the encoders, per part
+PENDING_COMMANDS = 256
+
+
+class Histogram:
+    # Durations in milliseconds counted by bins of edges
+
+    def __init__(self, edges=LATENCY_EDGES):
+        self.edges = edges
+        self.counts = np.zeros(len(edges), dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[np.searchsorted(self.edges, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, q):
+        # Upper edge of the bin containing the q-th percentile, capped to the maximum
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), q / 100.0 * self.count))
+        return min(self.edges[min(index, len(self.edges) - 1)], self.max)
+
+
+class PartTelemetry:
+
+    def __init__(self, capacity):
+        self.rpc = Histogram()
+        self.lag = Histogram()
+        # Time series of (time, milliseconds)
+        self.calls = RingBuffer(capacity, 1)
+        self.lags = RingBuffer(capacity, 1)
+        self.pending = collections.deque(maxlen=PENDING_COMMANDS)
+
+
+class Telemetry:
+    # Opt-in instrumentation of the playback and of the streaming: time spent
+    # in the handler at each frame, dropped frames, latency of the commands
+    # sent to each part and lag between a command and the encoders reaching it.
+    # The lag is measured on the encoders streamed by the boards (see
+    # ControlBoard.stream_state), the telemetry adds no remote call.
+    # It is fed from the main thread and from the streaming and state threads.
+
+    def __init__(self, capacity=100000, tolerance=LAG_TOLERANCE):
+        self.capacity = capacity
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.start = time.perf_counter()
+            self.handler = Histogram()
+            # Time series of (time, handler ms, frame, dropped frames so far)
+            self.frames = RingBuffer(self.capacity, 3)
+            self.dropped = 0
+            self._last_frame = None
+            self.parts = {}
+
+    def _part(self, part):
+        telemetry = self.parts.get(part)
+        if telemetry is None:
+            telemetry = self.parts[part] = PartTelemetry(self.capacity)
+        return telemetry
+
+    def frame(self, seconds, frame, dropped=None):
+        # Time spent for a frame. The frames dropped are the ones skipped
+        # since the previous one, unless given.
+        with self._lock:
+            if dropped is None:
+                if self._last_frame is not None and frame > self._last_frame + 1:
+                    dropped = int(frame - self._last_frame - 1)
+                else:
+                    dropped = 0
+            self._last_frame = frame
+            self.dropped += dropped
+            ms = seconds * 1000.0
+            self.handler.add(ms)
+            self.frames.append(time.perf_counter() - self.start, (ms, frame, self.dropped))
+
+    def call(self, part, seconds):
+        # Duration of a command sent to the part
+        with self._lock:
+            telemetry = self._part(part)
+            ms = seconds * 1000.0
+            telemetry.rpc.add(ms)
+            telemetry.calls.append(time.perf_counter() - self.start, (ms,))
+
+    def command(self, part, targets):
+        # Targets just sent to the part, nan for the axes not commanded
+        now = time.perf_counter()
+        with self._lock:
+            self._part(part).pending.append((now, targets.copy()))
+
+    def state(self, part, encs):
+        # Encoders received from the part: the command they match best (the
+        # newest among equally close ones) gives the lag, it and the older
+        # ones are not waited anymore
+        now = time.perf_counter()
+        with self._lock:
+            telemetry = self.parts.get(part)
+            if telemetry is None or not telemetry.pending:
+                return
+            best = None
+            best_error = self.tolerance
+            for index in range(len(telemetry.pending) - 1, -1, -1):
+                targets = telemetry.pending[index][1]
+                commanded = ~np.isnan(targets)
+                if len(targets) != len(encs) or not commanded.any():
+                    continue
+                error = np.abs(encs[commanded] - targets[commanded]).max()
+                if error < best_error or (best is None and error <= best_error):
+                    best = index
+                    best_error = error
+            if best is None:
+                return
+            ms = (now - telemetry.pending[best][0]) * 1000.0
+            telemetry.lag.add(ms)
+            telemetry.lags.append(now - self.start, (ms,))
+            for _ in range(best + 1):
+                telemetry.pending.popleft()
+
+    def summary(self):
+        # Statistics for the panel
+        with self._lock:
+            parts = {}
+            for part, telemetry in self.parts.items():
+                parts[part] = {"rpc_mean": telemetry.rpc.mean,
+                               "rpc_p95": telemetry.rpc.percentile(95),
+                               "rpc_max": telemetry.rpc.max,
+                               "lag_mean": telemetry.lag.mean,
+                               "lag_p95": telemetry.lag.percentile(95),
+                               "calls": telemetry.rpc.count}
+            return {"frames": self.handler.count,
+                    "handler_mean": self.handler.mean,
+                    "handler_p95": self.handler.percentile(95),
+                    "handler_max": self.handler.max,
+                    "dropped": self.dropped,
+                    "parts": parts}
+
+    def save(self, filename):
+        # Time series and histograms, as .npz or as .csv with a row per
+        # sample (time, series, part, value)
+        with self._lock:
+            frame_times, frames = self.frames.arrays()
+            series = {part: (telemetry.calls.arrays(), telemetry.lags.arrays(), telemetry.rpc.counts.copy(),
+                             telemetry.lag.counts.copy())
+                      for part, telemetry in self.parts.items()}
+            handler_counts = self.handler.counts.copy()
+        if filename.lower().endswith(".csv"):
+            rows = [(t, "handler_ms", "", v[0]) for t, v in zip(frame_times, frames)]
+            rows += [(t, "frame", "", v[1]) for t, v in zip(frame_times, frames)]
+            rows += [(t, "dropped", "", v[2]) for t, v in zip(frame_times, frames)]
+            for part, ((call_times, calls), (lag_times, lags), _, _) in series.items():
+                rows += [(t, "rpc_ms", part, v[0]) for t, v in zip(call_times, calls)]
+                rows += [(t, "lag_ms", part, v[0]) for t, v in zip(lag_times, lags)]
+            rows.sort(key=lambda row: row[0])
+            with open(filename, 'w') as f:
+                f.write("time,series,part,value\n")
+                for row in rows:
+                    f.write("{:.6f},{},{},{:.6f}\n".format(*row))
+            return
+        arrays = {"edges_ms": LATENCY_EDGES,
+                  "frame_time": frame_times,
+                  "handler_ms": frames[:, 0],
+                  "frame": frames[:, 1],
+                  "dropped": frames[:, 2],
+                  "handler_hist": handler_counts}
+        for part, ((call_times, calls), (lag_times, lags), rpc_counts, lag_counts) in series.items():
+            arrays[part + "_call_time"] = call_times
+            arrays[part + "_rpc_ms"] = calls[:, 0]
+            arrays[part + "_lag_time"] = lag_times
+            arrays[part + "_lag_ms"] = lags[:, 0]
+            arrays[part + "_rpc_hist"] = rpc_counts
+            arrays[part + "_lag_hist"] = lag_counts
+        np.savez_compressed(filename, **arrays)
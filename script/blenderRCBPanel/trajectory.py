@@ -0,0 +1,170 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import json
+import os
+
+import numpy as np
+
+BONE_PATH_PREFIX = 'pose.bones["'
+BONE_PATH_SUFFIX = '"].rotation_euler'
+
+
+def joint_curves(action):
+    # Curves of the rotation around y of the bones, by bone name
+    curves = {}
+    for fcurve in action.fcurves:
+        path = fcurve.data_path
+        if fcurve.array_index != 1 or not (path.startswith(BONE_PATH_PREFIX) and path.endswith(BONE_PATH_SUFFIX)):
+            continue
+        curves[path[len(BONE_PATH_PREFIX):-len(BONE_PATH_SUFFIX)]] = fcurve
+    return curves
+
+
+def sample_curves(armature, bones, frames, out):
+    # Fill out[i, j] with the target in degrees of bones[j] at frames[i],
+    # evaluated directly on the curves of the action without changing the
+    # current frame. The bones without curve keep their current value.
+    action = armature.animation_data.action if armature.animation_data else None
+    curves = joint_curves(action) if action is not None else {}
+    for column, bone in enumerate(bones):
+        fcurve = curves.get(bone.name)
+        if fcurve is None:
+            out[:, column] = np.degrees(bone.rotation_euler[1])
+        else:
+            out[:, column] = np.degrees([fcurve.evaluate(frame) for frame in frames])
+    return out
+
+
+def sample_action(armature, bones, frame_start, frame_end):
+    # Targets in degrees of the bones at each frame in [frame_start, frame_end]
+    frames = np.arange(frame_start, frame_end + 1)
+    return sample_curves(armature, bones, frames, np.empty((len(frames), len(bones))))
+
+
+def bone_limits(bone):
+    # Limits in degrees of the LIMIT_ROTATION constraint of the bone
+    for constraint in bone.constraints:
+        if constraint.type == "LIMIT_ROTATION" and constraint.use_limit_y:
+            return [np.degrees(constraint.min_y), np.degrees(constraint.max_y)]
+    return [-np.inf, np.inf]
+
+
+class Trajectory:
+    # Joint targets baked from an action: values[i, j] is the target in degrees
+    # of joint_names[j] at frame frame_start + i. values can be a memory mapped
+    # .npy file for long animations.
+
+    def __init__(self, joint_names, values, frame_start, fps, limits=None):
+        self.joint_names = list(joint_names)
+        self.values = values
+        self.frame_start = int(frame_start)
+        self.fps = fps
+        if limits is None:
+            limits = np.tile([-np.inf, np.inf], (len(self.joint_names), 1))
+        self.limits = np.asarray(limits, dtype=np.float64)
+        self._index = {name: column for column, name in enumerate(self.joint_names)}
+
+    @property
+    def frame_end(self):
+        return self.frame_start + len(self.values) - 1
+
+    def columns(self, names):
+        # Columns of the joints, -1 for the ones not baked
+        return np.array([self._index.get(name, -1) for name in names], dtype=np.int64)
+
+    def row(self, frame):
+        # Targets at the frame, None outside of the baked range
+        index = int(frame) - self.frame_start
+        if index < 0 or index >= len(self.values):
+            return None
+        return self.values[index]
+
+    def out_of_limits(self):
+        # Number of frames outside of the limits, for each joint
+        return ((self.values < self.limits[:, 0]) | (self.values > self.limits[:, 1])).sum(axis=0)
+
+    def peak_velocities(self):
+        # Maximum speed in degrees/s of each joint
+        if len(self.values) < 2:
+            return np.zeros(len(self.joint_names))
+        return np.abs(np.diff(self.values, axis=0)).max(axis=0) * self.fps
+
+
+def bake_action(armature, frame_start, frame_end, fps, filename=None):
+    # Evaluate once the action of the armature for all its bones with a curve,
+    # if filename is given the values are stored in a memory mapped .npy file.
+    # The bones without curve (moved by drivers, constraints or IK) are not
+    # baked, the playback reads them from the rig.
+    action = armature.animation_data.action if armature.animation_data else None
+    curves = joint_curves(action) if action is not None else {}
+    bones = [bone for bone in armature.pose.bones if bone.name in curves]
+    frames = np.arange(frame_start, frame_end + 1)
+    shape = (len(frames), len(bones))
+    if filename is None:
+        values = np.empty(shape)
+    else:
+        values = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64, shape=shape)
+    sample_curves(armature, bones, frames, values)
+    if filename is not None:
+        values.flush()
+    return Trajectory([bone.name for bone in bones], values, frame_start, fps,
+                      [bone_limits(bone) for bone in bones])
+
+
+def save_parts(filename, parts, fps, robot="", times=None):
+    # Export the trajectory of the parts for the standalone replayer
+    # (rcb_replay.py). parts is a list of dict with name, display, axes,
+    # joints, values (frames, axes), limits and safety_mask, and optionally
+    # the commanded values of a recording (.npz only). times are the
+    # timestamps of the frames, by default spaced by 1 / fps.
+    # The .npz file contains the time of each frame, the values of each part
+    # and the metadata. For .csv the metadata are written in a .json next to
+    # it, whose "parts" entry has the same format of the parts.json of the panel.
+    frames = min(len(part["values"]) for part in parts)
+    if times is None:
+        times = np.arange(frames) / fps
+    else:
+        frames = min(frames, len(times))
+        times = np.asarray(times)[:frames]
+    metadata = {"robot": robot,
+                "fps": fps,
+                "parts": [[part["name"], part.get("display", part["name"])] for part in parts],
+                "joints": {part["name"]: {"axes": [int(axis) for axis in part["axes"]],
+                                          "names": list(part["joints"]),
+                                          "limits": np.asarray(part["limits"]).tolist(),
+                                          "safety_mask": [bool(v) for v in part["safety_mask"]]}
+                           for part in parts}}
+    if filename.lower().endswith(".csv"):
+        columns = ["time"] + [part["name"] + "/" + joint for part in parts for joint in part["joints"]]
+        data = np.column_stack([times] + [np.asarray(part["values"])[:frames] for part in parts])
+        np.savetxt(filename, data, delimiter=",", header=",".join(columns), comments="", fmt="%.6f")
+        with open(os.path.splitext(filename)[0] + ".json", 'w') as f:
+            json.dump(metadata, f, indent=4)
+    else:
+        arrays = {"part_" + part["name"]: np.asarray(part["values"])[:frames] for part in parts}
+        arrays.update({"commanded_" + part["name"]: np.asarray(part["commanded"])[:frames]
+                       for part in parts if "commanded" in part})
+        np.savez_compressed(filename, time=times, metadata=np.array(json.dumps(metadata)), **arrays)
+
+
+def load_parts(filename):
+    # Returns the metadata, the times and the values of each part saved by save_parts
+    if filename.lower().endswith(".csv"):
+        with open(os.path.splitext(filename)[0] + ".json") as f:
+            metadata = json.load(f)
+        data = np.loadtxt(filename, delimiter=",", skiprows=1, ndmin=2)
+        times = data[:, 0]
+        values = {}
+        column = 1
+        for name, _ in metadata["parts"]:
+            count = len(metadata["joints"][name]["axes"])
+            values[name] = data[:, column:column + count]
+            column += count
+        return metadata, times, values
+    with np.load(filename) as data:
+        metadata = json.loads(str(data["metadata"]))
+        return metadata, data["time"], {name: data["part_" + name] for name, _ in metadata["parts"]}
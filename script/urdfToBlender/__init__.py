@@ -30,7 +30,10 @@ from bpy.props import (StringProperty,
                        )
 
 from .urdfToBlender import (OBJECT_PT_urdf2blender_converter,
-                            WM_OT_OpenFilebrowser)
+                            WM_OT_OpenFilebrowser,
+                            WM_OT_GenerateProxies,
+                            WM_OT_SetLevelOfDetail,
+                            WM_OT_LoadLinkMeshes)
 
 # ------------------------------------------------------------------------
 #    Registration
@@ -38,6 +41,9 @@ from .urdfToBlender import (OBJECT_PT_urdf2blender_converter,
 
 classes = (
     WM_OT_OpenFilebrowser,
+    WM_OT_GenerateProxies,
+    WM_OT_SetLevelOfDetail,
+    WM_OT_LoadLinkMeshes,
     OBJECT_PT_urdf2blender_converter
 )
 
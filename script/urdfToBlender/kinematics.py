@@ -0,0 +1,139 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import base64
+import io
+
+import numpy as np
+
+# Snapshot of the kinematic description of the model stored in the scene, it
+# is read by blenderRCBPanel (see common_functions.load_model_snapshot) for
+# building the iDynTree model without parsing the urdf.
+# Bump the version when the layout of the arrays changes.
+SNAPSHOT_VERSION = 1
+
+JOINT_FIXED = 0
+JOINT_REVOLUTE = 1
+JOINT_PRISMATIC = 2
+
+
+def buildSnapshot(model, traversal, root_H_link=None):
+    nr_of_links = model.getNrOfLinks()
+    nr_of_joints = model.getNrOfJoints()
+
+    joint_parent = np.empty(nr_of_joints, dtype=np.int32)
+    joint_child = np.empty(nr_of_joints, dtype=np.int32)
+    joint_type = np.full(nr_of_joints, JOINT_FIXED, dtype=np.int8)
+    # Axis (direction and origin) expressed in the child link frame
+    joint_axis = np.zeros((nr_of_joints, 6))
+    joint_limits = np.zeros((nr_of_joints, 2))
+    # parent_H_child at rest
+    joint_rest = np.empty((nr_of_joints, 4, 4))
+    for joint_idx in range(nr_of_joints):
+        joint = model.getJoint(joint_idx)
+        parentIdx = traversal.getParentLinkIndexFromJointIndex(model, joint_idx)
+        childIdx = traversal.getChildLinkIndexFromJointIndex(model, joint_idx)
+        joint_parent[joint_idx] = parentIdx
+        joint_child[joint_idx] = childIdx
+        joint_rest[joint_idx] = joint.getRestTransform(parentIdx, childIdx).asHomogeneousTransform().toNumPy()
+        # isPrismaticJoint is available only in recent iDynTree versions
+        is_prismatic = hasattr(joint, "isPrismaticJoint") and joint.isPrismaticJoint()
+        if joint.isRevoluteJoint() or is_prismatic:
+            if joint.isRevoluteJoint():
+                joint_type[joint_idx] = JOINT_REVOLUTE
+                joint = joint.asRevoluteJoint()
+            else:
+                joint_type[joint_idx] = JOINT_PRISMATIC
+                joint = joint.asPrismaticJoint()
+            axis = joint.getAxis(childIdx, parentIdx)
+            joint_axis[joint_idx, :3] = axis.getDirection().toNumPy()
+            joint_axis[joint_idx, 3:] = axis.getOrigin().toNumPy()
+            joint_limits[joint_idx] = [joint.getMinPosLimit(0), joint.getMaxPosLimit(0)]
+
+    # Additional frames (e.g. the end-effectors), link_H_frame
+    frame_names = []
+    frame_link = []
+    frame_transform = []
+    for frame_idx in range(nr_of_links, model.getNrOfFrames()):
+        frame_names.append(model.getFrameName(frame_idx))
+        frame_link.append(model.getFrameLink(frame_idx))
+        frame_transform.append(model.getFrameTransform(frame_idx).asHomogeneousTransform().toNumPy())
+
+    return {"version": np.array(SNAPSHOT_VERSION),
+            "link_names": np.array([model.getLinkName(i) for i in range(nr_of_links)], dtype=str),
+            "joint_names": np.array([model.getJointName(i) for i in range(nr_of_joints)], dtype=str),
+            "base_link": np.array(model.getDefaultBaseLink()),
+            "joint_parent": joint_parent,
+            "joint_child": joint_child,
+            "joint_type": joint_type,
+            "joint_axis": joint_axis,
+            "joint_limits": joint_limits,
+            "joint_rest": joint_rest,
+            # root_link_H_link at rest
+            "link_rest": root_H_link if root_H_link is not None else computeRestTransforms(model, traversal),
+            "frame_names": np.array(frame_names, dtype=str),
+            "frame_link": np.array(frame_link, dtype=np.int32),
+            "frame_transform": np.array(frame_transform).reshape(-1, 4, 4)}
+
+
+def encodeSnapshot(snapshot):
+    # Compressed npz encoded in base64, so that it can be stored as string
+    # property of the scene
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **snapshot)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def computeRestTransforms(model, traversal, root_link="root_link"):
+    # Forward kinematics of all the links at the zero configuration, computed
+    # with a single visit of the traversal. Returns the (nr_of_links,4,4) array
+    # of the root_link_H_link transforms, indexed by link index.
+    nr_of_links = model.getNrOfLinks()
+    base_H_link = np.empty((nr_of_links, 4, 4))
+    for visit_idx in range(traversal.getNrOfVisitedLinks()):
+        linkIdx = traversal.getLink(visit_idx).getIndex()
+        if visit_idx == 0:
+            base_H_link[linkIdx] = np.eye(4)
+            continue
+        parentIdx = traversal.getParentLink(visit_idx).getIndex()
+        parent_H_link = traversal.getParentJoint(visit_idx).getRestTransform(parentIdx, linkIdx)
+        base_H_link[linkIdx] = base_H_link[parentIdx] @ parent_H_link.asHomogeneousTransform().toNumPy()
+
+    # Express everything wrt the root link if it is not the base of the traversal
+    rootIdx = model.getLinkIndex(root_link)
+    if rootIdx >= 0 and rootIdx != traversal.getBaseLink().getIndex():
+        base_H_link = np.linalg.inv(base_H_link[rootIdx]) @ base_H_link
+    return base_H_link
+
+
+def buildTopology(model, traversal):
+    # Index of the kinematic tree computed once from the traversal:
+    # - visit_order: link indices in traversal order (parents before children)
+    # - link_parent_joint/link_parent_link: -1 for the base link
+    # - joint_parent_link/joint_child_link
+    nr_of_links = model.getNrOfLinks()
+    nr_of_joints = model.getNrOfJoints()
+    visit_order = np.empty(traversal.getNrOfVisitedLinks(), dtype=np.int32)
+    link_parent_joint = np.full(nr_of_links, -1, dtype=np.int32)
+    link_parent_link = np.full(nr_of_links, -1, dtype=np.int32)
+    joint_parent_link = np.full(nr_of_joints, -1, dtype=np.int32)
+    joint_child_link = np.full(nr_of_joints, -1, dtype=np.int32)
+    for visit_idx in range(traversal.getNrOfVisitedLinks()):
+        linkIdx = traversal.getLink(visit_idx).getIndex()
+        visit_order[visit_idx] = linkIdx
+        if visit_idx == 0:
+            continue
+        parentIdx = traversal.getParentLink(visit_idx).getIndex()
+        jointIdx = traversal.getParentJoint(visit_idx).getIndex()
+        link_parent_joint[linkIdx] = jointIdx
+        link_parent_link[linkIdx] = parentIdx
+        joint_parent_link[jointIdx] = parentIdx
+        joint_child_link[jointIdx] = linkIdx
+    return {"visit_order": visit_order,
+            "link_parent_joint": link_parent_joint,
+            "link_parent_link": link_parent_link,
+            "joint_parent_link": joint_parent_link,
+            "joint_child_link": joint_child_link}
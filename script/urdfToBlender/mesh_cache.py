@@ -0,0 +1,183 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import hashlib
+import os
+
+import bpy
+import numpy as np
+
+try:
+    from . import mesh_utils, mesh_readers
+except ImportError:
+    import mesh_utils, mesh_readers
+
+
+# Part of the key of the cached meshes, bump it when the readers or the layout
+# of the .npz entries change so that the entries decoded before are not reused
+CACHE_VERSION = 2
+
+
+def default_cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "blender-robotics-utils", "meshes")
+
+
+def file_digest(filePath):
+    sha = hashlib.sha1()
+    with open(filePath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class MeshCache:
+    # Cache of the external meshes keyed by file path, content hash, scale and
+    # version of the readers.
+    # Within a conversion the links referencing the same file get linked
+    # duplicates of a single mesh datablock, while the decoded arrays are
+    # stored as .npz in cache_dir to be reused by the following conversions.
+    # If cache_dir is None nothing is written on disk.
+    # The STL/PLY files are decoded by mesh_readers, the collada files carry
+    # also materials and hierarchies, they go through the blender importer and
+    # are shared only in memory.
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.objects = {}
+        self.decoded = {}
+        self.digests = {}
+        self.hits = 0
+        self.disk_hits = 0
+
+    def key(self, filePath, scale):
+        filePath = os.path.abspath(filePath)
+        stat = os.stat(filePath)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        # Hash the content only once per file and per conversion
+        if filePath not in self.digests or self.digests[filePath][0] != stamp:
+            self.digests[filePath] = (stamp, file_digest(filePath))
+        content = self.digests[filePath][1]
+        return hashlib.sha1("{}|{}|{}|{!r}".format(CACHE_VERSION, filePath, content,
+                                                    float(scale)).encode()).hexdigest()
+
+    def stamp_key(self, filePath, scale):
+        # Key of the file by path, modification time, size and scale, without
+        # reading it. Used for the placeholders, whose mesh is not loaded yet.
+        filePath = os.path.abspath(filePath)
+        stat = os.stat(filePath)
+        return hashlib.sha1("{}|{}|{}|{!r}".format(filePath, stat.st_mtime_ns, stat.st_size,
+                                                    float(scale)).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _load_from_disk(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return data["vertices"], data["loop_vertices"], data["loop_totals"]
+        except (OSError, KeyError, ValueError) as e:
+            print("Discarding the corrupted cache entry", path, ":", e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _save_to_disk(self, key, arrays):
+        if self.cache_dir is None:
+            return
+        vertices, loop_vertices, loop_totals = arrays
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._disk_path(key)
+            tmp_path = path + ".tmp"
+            # Write in a temporary file first, parallel conversions must not
+            # see a partially written entry
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, vertices=vertices, loop_vertices=loop_vertices, loop_totals=loop_totals)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Unable to store the mesh in the cache:", e)
+
+    def prefetch(self, filePaths, scale=0.001, max_workers=None):
+        # Decode in parallel all the files that are neither in memory nor on disk
+        to_decode = {}
+        for filePath in filePaths:
+            if not mesh_readers.can_read(filePath):
+                continue
+            key = self.key(filePath, scale)
+            if key in self.objects or key in self.decoded or key in to_decode.values():
+                continue
+            if self.cache_dir is not None and os.path.isfile(self._disk_path(key)):
+                continue
+            to_decode[filePath] = key
+        for filePath, arrays in mesh_readers.read_meshes(to_decode.keys(), scale, max_workers).items():
+            key = to_decode[filePath]
+            self.decoded[key] = arrays
+            self._save_to_disk(key, arrays)
+
+    def import_mesh(self, name, filePath, scale=0.001):
+        # Return a new object for the link, its mesh is shared with all the
+        # other links referencing the same file.
+        key = self.key(filePath, scale)
+        if key in self.objects:
+            self.hits += 1
+            source = self.objects[key]
+            obj = mesh_utils.link_object(name, source.data)
+            # The importers may apply the units conversion on the object
+            obj.scale = source.scale
+            return obj
+
+        arrays = None
+        if mesh_readers.can_read(filePath):
+            arrays = self.decoded.pop(key, None)
+            if arrays is None:
+                arrays = self._load_from_disk(key)
+                if arrays is not None:
+                    self.disk_hits += 1
+            if arrays is None:
+                try:
+                    arrays = mesh_readers.read_mesh(filePath, scale)
+                    self._save_to_disk(key, arrays)
+                except (OSError, ValueError, KeyError, IndexError) as e:
+                    print("Unable to decode", filePath, "falling back to the blender importer:", e)
+        if arrays is not None:
+            obj = mesh_utils.link_object(name, mesh_utils.meshFromArrays(name, *arrays))
+        else:
+            obj = mesh_utils.importExternalMesh(filePath, scale)
+            if obj is None:
+                return None
+        obj.data["mesh_cache_key"] = key
+        self.objects[key] = obj
+        return obj
+
+    def adopt(self, objects):
+        # Share the meshes already in the scene, e.g. the ones loaded by a
+        # previous conversion, with the objects imported from now on
+        for obj in objects:
+            if obj.type == 'MESH' and "mesh_cache_key" in obj.data:
+                self.objects.setdefault(obj.data["mesh_cache_key"], obj)
+
+    def load_into(self, obj, filePath, scale=0.001):
+        # Replace the mesh of an existing object (e.g. a placeholder) with the
+        # one of the file, shared as in import_mesh. Returns False on failure.
+        loaded = self.import_mesh(obj.name, filePath, scale)
+        if loaded is None:
+            return False
+        obj.data = loaded.data
+        obj.scale = loaded.scale
+        key = self.key(filePath, scale)
+        # The object just imported is not needed, obj becomes the source of the duplicates
+        if self.objects.get(key) == loaded:
+            self.objects[key] = obj
+        bpy.data.objects.remove(loaded)
+        return True
@@ -0,0 +1,324 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+# Readers for the STL and PLY meshes based only on numpy, so that they can run
+# in worker processes without blender.
+# Every reader returns the tuple (vertices, loop_vertices, loop_totals), i.e.
+# the (N,3) float32 vertex positions already scaled, the flat vertex indices
+# of all the polygons and the number of vertices of each polygon.
+
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import multiprocessing
+import os
+import re
+import sys
+
+import numpy as np
+
+STL_BINARY_HEADER_SIZE = 84
+STL_BINARY_DTYPE = np.dtype([("normal", "<f4", (3,)),
+                             ("vertices", "<f4", (3, 3)),
+                             ("attribute", "<u2")])
+STL_ASCII_VERTEX = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+PLY_TYPES = {"char": "i1", "int8": "i1",
+             "uchar": "u1", "uint8": "u1",
+             "short": "i2", "int16": "i2",
+             "ushort": "u2", "uint16": "u2",
+             "int": "i4", "int32": "i4",
+             "uint": "u4", "uint32": "u4",
+             "float": "f4", "float32": "f4",
+             "double": "f8", "float64": "f8"}
+
+
+def _weld_triangles(triangles, scale):
+    # STL stores three independent vertices per triangle, merge the duplicates
+    # like the blender importer does and apply the scale in the same step
+    triangles = triangles.reshape(-1, 3)
+    vertices, loop_vertices = np.unique(triangles, axis=0, return_inverse=True)
+    vertices = (vertices * scale).astype(np.float32)
+    loop_totals = np.full(len(triangles) // 3, 3, dtype=np.int32)
+    return vertices, loop_vertices.astype(np.int32).ravel(), loop_totals
+
+
+def read_stl(filePath, scale=1.0):
+    with open(filePath, 'rb') as f:
+        data = f.read()
+    if len(data) >= STL_BINARY_HEADER_SIZE:
+        count = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0])
+        # Some binary files start with "solid" too, the size is the only reliable check
+        if len(data) == STL_BINARY_HEADER_SIZE + count * STL_BINARY_DTYPE.itemsize:
+            facets = np.frombuffer(data, dtype=STL_BINARY_DTYPE, count=count, offset=STL_BINARY_HEADER_SIZE)
+            return _weld_triangles(facets["vertices"].astype(np.float64), scale)
+    triangles = np.array(STL_ASCII_VERTEX.findall(data), dtype=np.float64)
+    # A truncated or padded binary file is not parsed as text, let the
+    # blender importer handle it instead of returning an empty mesh
+    if len(triangles) == 0 or len(triangles) % 3 != 0:
+        raise ValueError("No facets could be read from {}".format(filePath))
+    return _weld_triangles(triangles, scale)
+
+
+def _parse_ply_header(f):
+    if f.readline().strip() != b"ply":
+        raise ValueError("{} is not a ply file".format(f.name))
+    fmt = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of the ply header")
+        tokens = line.decode("ascii", "replace").split()
+        if not tokens or tokens[0] in ("comment", "obj_info"):
+            continue
+        if tokens[0] == "end_header":
+            break
+        if tokens[0] == "format":
+            fmt = tokens[1]
+        elif tokens[0] == "element":
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == "property":
+            if tokens[1] == "list":
+                # (name, count type, item type)
+                elements[-1][2].append((tokens[4], PLY_TYPES[tokens[2]], PLY_TYPES[tokens[3]]))
+            else:
+                elements[-1][2].append((tokens[2], PLY_TYPES[tokens[1]], None))
+    return fmt, elements
+
+
+def _read_ply_binary_element(data, offset, count, properties, endian):
+    # Elements without lists map directly to a structured dtype
+    if all(item is None for _, _, item in properties):
+        dtype = np.dtype([(name, endian + kind) for name, kind, _ in properties])
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        return array, offset + count * dtype.itemsize
+    # Elements with lists (e.g. faces), try with the size of the first list
+    # for all the elements, that is the common case of triangulated meshes
+    fields = []
+    probe = offset
+    for name, kind, item in properties:
+        if item is None:
+            fields.append((name, endian + kind))
+            probe += np.dtype(kind).itemsize
+        else:
+            size = int(np.frombuffer(data, dtype=endian + kind, count=1, offset=probe)[0]) if count else 0
+            fields.append((name + "_count", endian + kind))
+            fields.append((name, endian + item, (size,)))
+            probe += np.dtype(kind).itemsize + size * np.dtype(item).itemsize
+    dtype = np.dtype(fields)
+    if offset + count * dtype.itemsize <= len(data):
+        array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        if all((array[name + "_count"] == dtype[name].shape[0]).all()
+               for name, _, item in properties if item is not None):
+            return array, offset + count * dtype.itemsize
+    # Mixed polygons, walk the elements one by one
+    rows = []
+    for _ in range(count):
+        row = {}
+        for name, kind, item in properties:
+            value = np.frombuffer(data, dtype=endian + kind, count=1, offset=offset)[0]
+            offset += np.dtype(kind).itemsize
+            if item is not None:
+                row[name] = np.frombuffer(data, dtype=endian + item, count=int(value), offset=offset)
+                offset += int(value) * np.dtype(item).itemsize
+            else:
+                row[name] = value
+        rows.append(row)
+    return rows, offset
+
+
+def _read_ply_ascii_element(lines, count, properties):
+    rows = lines[:count]
+    if all(item is None for _, _, item in properties):
+        values = np.array(b" ".join(rows).split(), dtype=np.float64).reshape(count, len(properties))
+        return {name: values[:, i] for i, (name, _, _) in enumerate(properties)}
+    result = {}
+    # Only the common layout with a single list property is vectorized
+    tokens = [row.split() for row in rows]
+    if len(properties) == 1:
+        name = properties[0][0]
+        lengths = np.array([len(t) for t in tokens], dtype=np.int64)
+        if count and (lengths == lengths[0]).all():
+            values = np.array(b" ".join(rows).split(), dtype=np.int64).reshape(count, lengths[0])
+            result[name] = values[:, 1:]
+        else:
+            result[name] = [np.array(t[1:], dtype=np.int64) for t in tokens]
+        return result
+    for name, _, _ in properties:
+        result[name] = []
+    for t in tokens:
+        position = 0
+        for name, _, item in properties:
+            if item is None:
+                result[name].append(float(t[position]))
+                position += 1
+            else:
+                size = int(t[position])
+                result[name].append(np.array(t[position + 1:position + 1 + size], dtype=np.int64))
+                position += 1 + size
+    return result
+
+
+def _faces_to_loops(faces):
+    if isinstance(faces, np.ndarray) and faces.ndim == 2:
+        loop_totals = np.full(len(faces), faces.shape[1], dtype=np.int32)
+        return faces.astype(np.int32).ravel(), loop_totals
+    if len(faces) == 0:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    loop_totals = np.array([len(face) for face in faces], dtype=np.int32)
+    return np.concatenate(faces).astype(np.int32), loop_totals
+
+
+def read_ply(filePath, scale=1.0):
+    with open(filePath, 'rb') as f:
+        fmt, elements = _parse_ply_header(f)
+        data = f.read()
+
+    vertices = None
+    faces = []
+    if fmt == "ascii":
+        lines = data.splitlines()
+        position = 0
+        for name, count, properties in elements:
+            element = _read_ply_ascii_element(lines[position:], count, properties)
+            position += count
+            if name == "vertex":
+                vertices = np.column_stack([element["x"], element["y"], element["z"]])
+            elif name == "face":
+                key = "vertex_indices" if "vertex_indices" in element else "vertex_index"
+                faces = element[key]
+    elif fmt in ("binary_little_endian", "binary_big_endian"):
+        endian = "<" if fmt == "binary_little_endian" else ">"
+        offset = 0
+        for name, count, properties in elements:
+            element, offset = _read_ply_binary_element(data, offset, count, properties, endian)
+            if name == "vertex":
+                vertices = np.column_stack([element["x"], element["y"], element["z"]])
+            elif name == "face":
+                key = "vertex_indices" if any(p[0] == "vertex_indices" for p in properties) else "vertex_index"
+                if isinstance(element, np.ndarray):
+                    faces = element[key]
+                else:
+                    faces = [row[key] for row in element]
+    else:
+        raise ValueError("Unsupported ply format {} in {}".format(fmt, filePath))
+
+    if vertices is None:
+        raise ValueError("No vertex element in {}".format(filePath))
+    vertices = (vertices.astype(np.float64) * scale).astype(np.float32)
+    loop_vertices, loop_totals = _faces_to_loops(faces)
+    return vertices, loop_vertices, loop_totals
+
+
+def read_ply_vertices(filePath):
+    # Only the (N,3) vertex positions of a ply file, the elements after the
+    # vertices (e.g. the faces) are not read
+    with open(filePath, 'rb') as f:
+        fmt, elements = _parse_ply_header(f)
+        if fmt == "ascii":
+            for name, count, properties in elements:
+                lines = list(itertools.islice(f, count))
+                if name == "vertex":
+                    element = _read_ply_ascii_element(lines, count, properties)
+                    return np.column_stack([element["x"], element["y"], element["z"]])
+        elif fmt in ("binary_little_endian", "binary_big_endian"):
+            endian = "<" if fmt == "binary_little_endian" else ">"
+            for name, count, properties in elements:
+                if any(item is not None for _, _, item in properties):
+                    # The size of the elements with lists is known only once read
+                    break
+                dtype = np.dtype([(p, endian + kind) for p, kind, _ in properties])
+                data = f.read(count * dtype.itemsize)
+                if name == "vertex":
+                    element = np.frombuffer(data, dtype=dtype, count=count)
+                    return np.column_stack([element["x"], element["y"], element["z"]])
+            else:
+                raise ValueError("No vertex element in {}".format(filePath))
+        else:
+            raise ValueError("Unsupported ply format {} in {}".format(fmt, filePath))
+    # Vertices after an element with lists, unusual
+    return read_ply(filePath)[0]
+
+
+READERS = {".stl": read_stl,
+           ".ply": read_ply}
+
+
+def can_read(filePath):
+    return os.path.splitext(filePath)[1].lower() in READERS
+
+
+def read_mesh(filePath, scale=1.0):
+    return READERS[os.path.splitext(filePath)[1].lower()](filePath, scale)
+
+
+def read_bounds(filePath, scale=1.0):
+    # Axis aligned bounding box of the mesh as the (2,3) array of the min and
+    # max corners, the binary STL files are only mapped, not decoded, and of
+    # the ply files only the vertices are read
+    extension = os.path.splitext(filePath)[1].lower()
+    points = None
+    if extension == ".stl":
+        size = os.path.getsize(filePath)
+        if size >= STL_BINARY_HEADER_SIZE:
+            with open(filePath, 'rb') as f:
+                f.seek(80)
+                count = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+            if count > 0 and size == STL_BINARY_HEADER_SIZE + count * STL_BINARY_DTYPE.itemsize:
+                facets = np.memmap(filePath, dtype=STL_BINARY_DTYPE, mode='r',
+                                   offset=STL_BINARY_HEADER_SIZE, shape=(count,))
+                points = facets["vertices"].reshape(-1, 3)
+        if points is None:
+            with open(filePath, 'rb') as f:
+                points = np.array(STL_ASCII_VERTEX.findall(f.read()), dtype=np.float64).reshape(-1, 3)
+    elif extension == ".ply":
+        points = read_ply_vertices(filePath)
+    else:
+        points = read_mesh(filePath)[0]
+    if len(points) == 0:
+        raise ValueError("No vertices in {}".format(filePath))
+    return np.array([points.min(axis=0), points.max(axis=0)], dtype=np.float64) * scale
+
+
+def read_meshes(filePaths, scale=1.0, max_workers=None):
+    # Decode the meshes in parallel, returns a dict path->arrays.
+    # The workers are forked, spawning them would import again the __main__
+    # of blender, that in background mode is the conversion script itself.
+    # Forking is safe only on Linux (on macOS it can crash in the system
+    # libraries), elsewhere the meshes are decoded by threads: numpy releases
+    # the GIL in the heavy parts.
+    filePaths = list(dict.fromkeys(filePaths))
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    results = {}
+    if len(filePaths) > 1 and max_workers > 1:
+        workers = min(max_workers, len(filePaths))
+        try:
+            if sys.platform.startswith("linux") and "fork" in multiprocessing.get_all_start_methods():
+                pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                              mp_context=multiprocessing.get_context("fork"))
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            with pool:
+                futures = {pool.submit(read_mesh, path, scale): path for path in filePaths}
+                for future in concurrent.futures.as_completed(futures):
+                    path = futures[future]
+                    try:
+                        results[path] = future.result()
+                    except (OSError, ValueError, KeyError, IndexError) as e:
+                        print("Unable to decode", path, ":", e, file=sys.stderr)
+            return results
+        except (OSError, BrokenProcessPool) as e:
+            print("Parallel decoding not available, falling back to a single process:", e)
+    for path in filePaths:
+        if path in results:
+            continue
+        try:
+            results[path] = read_mesh(path, scale)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            print("Unable to decode", path, ":", e, file=sys.stderr)
+    return results
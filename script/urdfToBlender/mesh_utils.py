@@ -0,0 +1,240 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import bpy, bmesh
+import mathutils
+import numpy as np
+import os
+
+# Same resolution used by the bpy.ops.mesh.primitive_* operators
+SPHERE_U_SEGMENTS = 32
+SPHERE_V_SEGMENTS = 16
+CYLINDER_SEGMENTS = 32
+# Size of the placeholders of the meshes whose bounds are not known
+PLACEHOLDER_SIZE = 0.02
+
+
+def _radius_kwargs(prefix, radius):
+    # Up to Blender 2.93 the bmesh.ops parameters are called "diameter", even
+    # if they are actually used as radius. In 3.0 they have been renamed.
+    if bpy.app.version >= (3, 0, 0):
+        return {prefix.replace("diameter", "radius"): radius}
+    return {prefix: radius}
+
+
+def link_object(name, mesh, collection=None):
+    # Create the object that owns the mesh and link it to the scene
+    obj = bpy.data.objects.new(name, mesh)
+    if collection is None:
+        collection = bpy.context.scene.collection
+    collection.objects.link(obj)
+    return obj
+
+
+def createGeometricShape(iDynTree_solidshape, name="geometry", collection=None):
+    # Build the basic geometries (sphere, cylinder, box) directly through the
+    # data API, without relying on the operators and on the viewport context.
+    # Returns the object created or None if the shape is not supported.
+    bm = bmesh.new()
+    if iDynTree_solidshape.isSphere():
+        bmesh.ops.create_uvsphere(bm,
+                                  u_segments=SPHERE_U_SEGMENTS,
+                                  v_segments=SPHERE_V_SEGMENTS,
+                                  **_radius_kwargs("diameter", iDynTree_solidshape.asSphere().getRadius()))
+    elif iDynTree_solidshape.isCylinder():
+        cylinder = iDynTree_solidshape.asCylinder()
+        bmesh.ops.create_cone(bm,
+                              cap_ends=True,
+                              cap_tris=False,
+                              segments=CYLINDER_SEGMENTS,
+                              depth=cylinder.getLength(),
+                              **_radius_kwargs("diameter1", cylinder.getRadius()),
+                              **_radius_kwargs("diameter2", cylinder.getRadius()))
+    elif iDynTree_solidshape.isBox():
+        box = iDynTree_solidshape.asBox()
+        # Unit cube scaled along the three axis
+        bmesh.ops.create_cube(bm, size=1.0)
+        bmesh.ops.scale(bm,
+                        vec=mathutils.Vector((box.getX(), box.getY(), box.getZ())),
+                        verts=bm.verts)
+    else:
+        bm.free()
+        print("Geometric shape not supported")
+        return None
+
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.update()
+    return link_object(name, mesh, collection)
+
+
+def createBoundingBox(name, bounds=None, collection=None):
+    # Box standing for a mesh not loaded yet, bounds is the (2,3) array of its
+    # min and max corners. The box is displayed as wireframe.
+    if bounds is None:
+        bounds = np.array([[-PLACEHOLDER_SIZE / 2] * 3, [PLACEHOLDER_SIZE / 2] * 3])
+    bounds = np.asarray(bounds, dtype=np.float64)
+    # Flat meshes (e.g. a plane) still get a visible box
+    size = np.maximum(bounds[1] - bounds[0], 1e-4)
+    bm = bmesh.new()
+    bmesh.ops.create_cube(bm, size=1.0)
+    bmesh.ops.scale(bm, vec=mathutils.Vector(size), verts=bm.verts)
+    bmesh.ops.translate(bm, vec=mathutils.Vector((bounds[0] + bounds[1]) / 2), verts=bm.verts)
+    mesh = bpy.data.meshes.new(name)
+    bm.to_mesh(mesh)
+    bm.free()
+    mesh.update()
+    obj = link_object(name, mesh, collection)
+    obj.display_type = 'WIRE'
+    return obj
+
+
+def importExternalMesh(filePath, scale=0.001):
+    # Import the mesh through the blender importers and return the object created
+    if ".stl" in filePath:
+        bpy.ops.import_mesh.stl(filepath=os.path.join(filePath),global_scale=scale)
+    elif ".ply" in filePath:
+        bpy.ops.import_mesh.ply(filepath=os.path.join(filePath),global_scale=scale)
+    elif ".dae" in filePath:
+        bpy.ops.wm.collada_import(filepath=os.path.join(filePath), import_units=True) #TODO check how to handle scale here !
+    # The importers leave selected only the objects just created,
+    # deselect them so that the next import is not confused
+    created = list(bpy.context.selected_objects)
+    for obj in created:
+        obj.select_set(False)
+    imported = [obj for obj in created if obj.type == 'MESH']
+    extras = [obj for obj in created if obj.type != 'MESH']
+    if not imported:
+        for obj in extras:
+            bpy.data.objects.remove(obj)
+        return None
+    # Some files (e.g. collada scenes) create several objects: the meshes are
+    # joined in the first one and the rest (empties, cameras, lights) is
+    # removed, so that nothing is left in the scene untracked
+    obj = imported[0]
+    if len(imported) > 1:
+        joinObjects(obj, imported)
+    world = obj.matrix_world.copy()
+    obj.parent = None
+    obj.matrix_world = world
+    for other in extras:
+        bpy.data.objects.remove(other)
+    return obj
+
+
+def joinObjects(target, objects):
+    # Join the mesh objects in target, keeping their materials and placement
+    override = {"active_object": target,
+                "object": target,
+                "selected_objects": objects,
+                "selected_editable_objects": objects}
+    if hasattr(bpy.context, "temp_override"):
+        with bpy.context.temp_override(**override):
+            bpy.ops.object.join()
+    else:
+        bpy.ops.object.join(override)
+
+
+def meshFromArrays(name, vertices, loop_vertices, loop_totals):
+    # Create a mesh datablock from the arrays returned by mesh_readers, the
+    # data is written in bulk, without creating python objects per vertex
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(vertices, dtype=np.float32).ravel())
+    mesh.loops.add(len(loop_vertices))
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loop_vertices, dtype=np.int32))
+    mesh.polygons.add(len(loop_totals))
+    loop_starts = np.zeros(len(loop_totals), dtype=np.int32)
+    np.cumsum(loop_totals[:-1], out=loop_starts[1:])
+    mesh.polygons.foreach_set("loop_start", loop_starts)
+    # Since 3.6 loop_total is read-only and derived from loop_start
+    if bpy.app.version < (3, 6, 0):
+        mesh.polygons.foreach_set("loop_total", np.ascontiguousarray(loop_totals, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    mesh.validate()
+    return mesh
+
+
+def lodKey(ratio):
+    return "{:.3f}".format(ratio)
+
+
+def fullResolutionMesh(mesh):
+    # The proxies keep the name of the full resolution mesh they come from
+    if "lod_full" in mesh:
+        return bpy.data.meshes.get(mesh["lod_full"], mesh)
+    return mesh
+
+
+def orphanLodMeshes():
+    # The full resolution meshes and their proxies that no object uses
+    # anymore, kept alive only by the fake user set by createProxyMeshes
+    orphans = set()
+    for mesh in bpy.data.meshes:
+        if "lod" in mesh:
+            group = [mesh] + [bpy.data.meshes[name] for name in mesh["lod"].values() if name in bpy.data.meshes]
+        elif "lod_full" in mesh and mesh["lod_full"] not in bpy.data.meshes:
+            group = [mesh]
+        else:
+            continue
+        if all(block.users == int(block.use_fake_user) for block in group):
+            orphans.update(group)
+    return orphans
+
+
+def createProxyMeshes(objects, ratios, min_faces=500):
+    # Generate the decimated copies of the meshes of the objects, one for each
+    # ratio. The meshes shared by more objects are decimated only once, the
+    # ones with less than min_faces polygons are not decimated.
+    # Returns the number of proxy meshes created.
+    created = 0
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    done = set()
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        full = fullResolutionMesh(obj.data)
+        if full.name in done or len(full.polygons) < min_faces:
+            continue
+        done.add(full.name)
+        current = obj.data
+        obj.data = full
+        proxies = dict(full["lod"]) if "lod" in full else {}
+        for ratio in ratios:
+            key = lodKey(ratio)
+            if key in proxies and proxies[key] in bpy.data.meshes:
+                continue
+            modifier = obj.modifiers.new("lod_decimate", 'DECIMATE')
+            modifier.ratio = ratio
+            depsgraph.update()
+            proxy = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph))
+            obj.modifiers.remove(modifier)
+            proxy.name = full.name + "_lod" + key
+            proxy["lod_full"] = full.name
+            # The meshes not assigned to any object must survive the save
+            proxy.use_fake_user = True
+            proxies[key] = proxy.name
+            created += 1
+        full["lod"] = proxies
+        full.use_fake_user = True
+        obj.data = current
+    return created
+
+
+def setLevelOfDetail(objects, ratio=None):
+    # Display the objects with the proxy closest to ratio, or with the full
+    # resolution meshes if ratio is None
+    for obj in objects:
+        if obj.type != 'MESH':
+            continue
+        full = fullResolutionMesh(obj.data)
+        target = full
+        if ratio is not None and "lod" in full and len(full["lod"]) > 0:
+            key = min(full["lod"].keys(), key=lambda k: abs(float(k) - ratio))
+            target = bpy.data.meshes.get(full["lod"][key], full)
+        if obj.data != target:
+            obj.data = target
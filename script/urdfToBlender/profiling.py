@@ -0,0 +1,85 @@
+# Copyright (C) 2006-2022 Istituto Italiano di Tecnologia (IIT)
+# All rights reserved.
+#
+# This software may be modified and distributed under the terms of the
+# BSD-3-Clause license. See the accompanying LICENSE file for details.
+
+import contextlib
+import json
+import sys
+import time
+
+import bpy
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+class Profiler:
+    # Collects the time spent in each stage of the conversion, the counters
+    # (e.g. meshes and vertices imported) and the number of bpy.ops calls.
+    # When disabled every method is a no-op, so that it can always be passed.
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+        self.operators = {}
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def counting_operators(self):
+        # Wrap the call of the operators exposed by bpy.ops for counting them
+        if not self.enabled:
+            yield
+            return
+        operator_class = type(bpy.ops.object.mode_set)
+        original_call = operator_class.__call__
+        operators = self.operators
+
+        def counting_call(op, *args, **kwargs):
+            name = op.idname_py() if hasattr(op, "idname_py") else repr(op)
+            operators[name] = operators.get(name, 0) + 1
+            return original_call(op, *args, **kwargs)
+
+        operator_class.__call__ = counting_call
+        try:
+            yield
+        finally:
+            operator_class.__call__ = original_call
+
+    def report(self):
+        return {"total_time": time.perf_counter() - self.start,
+                "stages": self.stages,
+                "counters": self.counters,
+                "operators": self.operators,
+                "operator_calls": sum(self.operators.values()),
+                "peak_rss_mb": peak_rss_mb()}
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+        print("Profiling report written in", filename)
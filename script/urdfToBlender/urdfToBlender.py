@@ -5,15 +5,20 @@
 # BSD-3-Clause license. See the accompanying LICENSE file for details.
 
 import bpy, bmesh
+import concurrent.futures
 import copy
+import json
 import mathutils
 import math
+import numpy as np
 import os
+import subprocess
 import sys
+import time
 import idyntree.bindings as iDynTree
 import xml.etree.ElementTree as ET
 
-from bpy.props import StringProperty, BoolProperty
+from bpy.props import StringProperty, BoolProperty, FloatProperty, EnumProperty
 from bpy_extras.io_utils import ImportHelper
 from bpy.types import (Panel,
                        Menu,
@@ -21,320 +26,523 @@ from bpy.types import (Panel,
                        PropertyGroup,
                        )
 
-def createGeometricShape(iDynTree_solidshape):
-    if iDynTree_solidshape.isSphere():
-        bpy.ops.mesh.primitive_uv_sphere_add(radius=iDynTree_solidshape.asSphere().getRadius())
-    elif iDynTree_solidshape.isCylinder():
-        cylinder = iDynTree_solidshape.asCylinder()
-        bpy.ops.mesh.primitive_cylinder_add(radius=cylinder.getRadius(), depth=cylinder.getLength())
-    elif iDynTree_solidshape.isBox():
-        box = iDynTree_solidshape.asBox()
-        if box.getX() != box.getY() or box.getZ() != box.getX() or box.getZ() != box.getY():
-            print("WARNING: the box has different dimensions along the three axis but it will be imported as cube with size equal to the X length")
-        bpy.ops.mesh.primitive_cube_add(size=box.getX()) # Seems that blender support only cubes
-    else:
-        print("Geometric shape not supported")
-        return False
-    return True
-
-def rigify(path):
+try:
+    from .mesh_utils import (createGeometricShape, createBoundingBox, createProxyMeshes, setLevelOfDetail,
+                             orphanLodMeshes)
+    from .mesh_readers import read_bounds
+    from .mesh_cache import MeshCache, default_cache_dir
+    from .profiling import Profiler
+    from .kinematics import buildSnapshot, encodeSnapshot, computeRestTransforms, buildTopology
+except ImportError:
+    # Executed as script (e.g. blender -b -P urdfToBlender.py), the modules
+    # next to this file are not reachable as a package.
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from mesh_utils import (createGeometricShape, createBoundingBox, createProxyMeshes, setLevelOfDetail,
+                            orphanLodMeshes)
+    from mesh_readers import read_bounds
+    from mesh_cache import MeshCache, default_cache_dir
+    from profiling import Profiler
+    from kinematics import buildSnapshot, encodeSnapshot, computeRestTransforms, buildTopology
+
+def parentMeshesToBones(armature_object, bone_to_mesh):
+    # Equivalent of parent_set(type='BONE', keep_transform=True) done directly
+    # on the data, without selections and mode switches.
+    # A bone parent is placed in the tail of the bone, the parent inverse
+    # compensates it so that the meshes keep their current transform.
+    bones = armature_object.data.bones
+    armature_matrix = armature_object.matrix_world
+    for bone_name, meshobj in bone_to_mesh.items():
+        bone = bones[bone_name]
+        bone_tail_matrix = armature_matrix @ bone.matrix_local @ \
+                           mathutils.Matrix.Translation((0.0, bone.length, 0.0))
+        meshobj.parent = armature_object
+        meshobj.parent_type = 'BONE'
+        meshobj.parent_bone = bone_name
+        meshobj.matrix_parent_inverse = bone_tail_matrix.inverted()
+
+def loadModel(path):
 
     armature_name = ""
 
+    urdf_str = ""
+    with open(path, 'r') as file:
+        urdf_str = file.read()
     # Get robot name needed until https://github.com/robotology/idyntree/issues/908 is not fixed
-    root = ET.parse(path).getroot()
+    root = ET.fromstring(urdf_str)
     armature_name = root.attrib["name"]
     # Get the urdf and parse it
-    dynComp = iDynTree.KinDynComputations();
     mdlLoader = iDynTree.ModelLoader();
-    mdlExporter = iDynTree.ModelExporter();
-    urdf_str = ""
-    with open(path, 'r') as file:
-        urdf_str = file.read()
     mdlLoader.loadModelFromFile(path);
 
     # Produce the reduced urdf
     model = mdlLoader.model()
 
-    # Save the model in the scene
-    bpy.context.scene['model_urdf'] = urdf_str
     traversal = iDynTree.Traversal()
     ok_traversal = model.computeFullTreeTraversal(traversal)
     print(ok_traversal)
     if not ok_traversal:
         print("Failed to compute the traversal!")
-        return 0
+        return None
+
+    print("The loaded model has", model.getNrOfDOFs(), \
+    "internal degrees of freedom and",model.getNrOfLinks(),"links.")
+
+    # root->link transforms of all the links, at the zero configuration
+    root_H_link = computeRestTransforms(model, traversal)
+
+    return armature_name, urdf_str, model, traversal, root_H_link
+
+# Datablocks left over by a previous rig, in the order in which they become
+# orphan: the objects use meshes and armatures, that use materials, that use
+# images.
+PURGED_DATA = ("meshes", "armatures", "materials", "textures", "images")
+
+def purgeScene(keep=()):
+    # Remove all the objects of the scene and the datablocks they leave orphan,
+    # with a bulk removal for each pass instead of one datablock at a time.
+    # The datablocks in keep (e.g. the action of the previous rig) are preserved.
+    keep = {block for block in keep if block is not None}
+    bpy.data.batch_remove(set(bpy.data.objects))
+    while True:
+        orphans = {block for name in PURGED_DATA for block in getattr(bpy.data, name)
+                   if block.users == 0 and block not in keep}
+        # The proxy and full resolution meshes are kept alive only by the fake
+        # user, they belong to the previous rig too. The other datablocks with
+        # a fake user have been explicitly saved, they are kept.
+        orphans.update(mesh for mesh in orphanLodMeshes() if mesh not in keep)
+        # The actions with a fake user have been explicitly saved, keep them
+        orphans.update(action for action in bpy.data.actions
+                       if action.users == 0 and action not in keep)
+        if not orphans:
+            break
+        bpy.data.batch_remove(orphans)
+
+def visualSignature(solidshape, mesh_cache, lazy=False):
+    # String identifying the geometry of a visual and its placement in the link,
+    # it is stored in the objects for detecting the changes in the re-rig.
+    # With lazy the mesh files are identified by their stamp and not read.
+    link_H_geometry = solidshape.getLink_H_geometry()
+    placement = [round(v, 9) for v in list(link_H_geometry.getPosition().toNumPy()) +
+                                      list(link_H_geometry.getRotation().toNumPy().ravel())]
+    if solidshape.isExternalMesh():
+        filePath = solidshape.asExternalMesh().getFileLocationOnLocalFileSystem()
+        if lazy:
+            geometry = ["mesh", mesh_cache.stamp_key(filePath, 0.001)]
+        else:
+            geometry = ["mesh", mesh_cache.key(filePath, 0.001)]
+    elif solidshape.isSphere():
+        geometry = ["sphere", solidshape.asSphere().getRadius()]
+    elif solidshape.isCylinder():
+        cylinder = solidshape.asCylinder()
+        geometry = ["cylinder", cylinder.getRadius(), cylinder.getLength()]
+    elif solidshape.isBox():
+        box = solidshape.asBox()
+        geometry = ["box", box.getX(), box.getY(), box.getZ()]
+    else:
+        geometry = ["unsupported"]
+    return repr(geometry + placement)
+
+def createPlaceholder(linkname, filePath, scale):
+    # Bounding box of the mesh, the source is recorded for loading it later
+    try:
+        bounds = read_bounds(filePath, scale)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        print("Unable to compute the bounds of", filePath, ":", e)
+        bounds = None
+    meshobj = createBoundingBox(linkname, bounds)
+    meshobj["urdf_mesh_source"] = filePath
+    meshobj["urdf_mesh_scale"] = scale
+    return meshobj
+
+def createLinkObject(linkname, solidshape, mesh_cache, lazy_meshes=False):
+    if solidshape.isExternalMesh():
+        filePath = solidshape.asExternalMesh().getFileLocationOnLocalFileSystem()
+        if lazy_meshes:
+            meshobj = createPlaceholder(linkname, filePath, 0.001)
+        else:
+            # import the mesh, the files already imported are shared
+            meshobj = mesh_cache.import_mesh(linkname, filePath, 0.001)
+    else:
+        # it is a basic geometry(sphere, cylinder, box)
+        meshobj = createGeometricShape(solidshape, linkname)
+    if meshobj is None:
+        return None
+    # Tag the object with its link, used when the rig is updated
+    meshobj["urdf_link"] = linkname
+    meshobj["urdf_visual"] = visualSignature(solidshape, mesh_cache, "urdf_mesh_source" in meshobj)
+    return meshobj
+
+def placeLinkObject(meshobj, link_id, solidshape, root_H_link):
+    # link->geometry transform
+    LinkToGtransform = solidshape.getLink_H_geometry().asHomogeneousTransform().toNumPy()
+    # root->geometry transform
+    RToGtransform = mathutils.Matrix(root_H_link[link_id] @ LinkToGtransform)
+
+    meshobj.location = RToGtransform.to_translation()
+    meshobj.rotation_mode = "QUATERNION"
+    meshobj.rotation_quaternion = RToGtransform.to_quaternion()
+
+def jointBoneData(model, topology, root_H_link, idyn_joint_idx):
+    # Return the links connected by the joint, its type, the rest
+    # position of the bone and the limits.
+    parentIdx = int(topology["joint_parent_link"][idyn_joint_idx])
+    childIdx = int(topology["joint_child_link"][idyn_joint_idx])
+    parentname = model.getLinkName(parentIdx)
+    childname = model.getLinkName(childIdx)
+    joint = model.getJoint(idyn_joint_idx)
+    jointtype = ""
+    if joint.isRevoluteJoint():
+        joint = joint.asRevoluteJoint()
+        jointtype = "REVOLUTE"
+        direction =	joint.getAxis(childIdx,parentIdx).getDirection().toNumPy()
+    # This is missing from idyntree api :(
+    #elif joint.isPrismaticJoint():
+    #    joint = joint.asPrismaticJoint()
+    #    jointtype = "PRISMATIC"
+    elif joint.isFixedJoint():
+        joint = joint.asFixedJoint()
+        jointtype = "FIXED"
+    #else:
+    #    joint = joint.asRevoluteJoint()
+    #    jointtype = "REVOLUTE"
+    #    direction =	joint.getAxis(childIdx,parentIdx).getDirection().toNumPy()
+    min = joint.getMinPosLimit(0)
+    max = joint.getMaxPosLimit(0)
+
+    parent_link_position  = mathutils.Vector(root_H_link[parentIdx, :3, 3]);
+    child_link_position   = mathutils.Vector(root_H_link[childIdx, :3, 3]);
+    child_link_rotation   = mathutils.Matrix(root_H_link[childIdx, :3, :3]);
+    # Start defining the bone like parent->child link
+    head = parent_link_position
+    tail = child_link_position
+    if jointtype == "REVOLUTE":
+        length = (tail - head).length
+        if length == 0.0:
+            length = 0.01 # bones with zero length are deleted by Blender
+        direction = mathutils.Vector(direction).normalized()
+        direction.rotate(child_link_rotation)
+        # In our representation the revolute joint is a bone placed in the child origin
+        # oriented towards the axis of the joint.
+        head = child_link_position
+        tail = head + direction * length
+
+    return {"parent": parentname,
+            "child": childname,
+            "type": jointtype,
+            "head": head,
+            "tail": tail,
+            # Consider the y-axis orientation in the limits
+            "limits": [min, max, jointtype]}
+
+def configurePoseBone(pbone, lim):
+    pbone.lock_location = (True, True, True)
+    pbone.lock_rotation = (True, True, True)
+    pbone.lock_scale = (True, True, True)
+    # check the nr of DOFs
+    if lim[2] == "FIXED" :
+        for c in [c for c in pbone.constraints if c.type == 'LIMIT_ROTATION']:
+            pbone.constraints.remove(c)
+        return
+
+    c = next((c for c in pbone.constraints if c.type == 'LIMIT_ROTATION'), None)
+    if c is None:
+        c = pbone.constraints.new('LIMIT_ROTATION')
+    c.owner_space = 'LOCAL'
+
+    if lim[2] == "REVOLUTE":
+        # The bones should rotate around y-axis
+        pbone.lock_rotation[1] = False
+    elif lim[2] == "PRISMATIC":
+        # The bones should move along y-axis
+        pbone.lock_location[1] = False
+    if lim:
+        c.use_limit_y = True
+        # TODO maybe we have to put also the ik constraints ???
+        #print(bone_name, math.degrees(lim[0]), math.degrees(lim[1]))
+        c.min_y = lim[0] # min
+        c.max_y = lim[1] # max
+
+    # TODO not sure if it is the right rotation_mode
+    pbone.rotation_mode = 'XYZ'
+
+def rigify(path, mesh_cache_dir=default_cache_dir(), profiler=None, lazy_meshes=False):
+    # profiler is an optional profiling.Profiler collecting the time spent
+    # in each stage of the conversion.
+    # With lazy_meshes the external meshes are replaced by their bounding
+    # boxes, see loadLinkMeshes.
+    if profiler is None:
+        profiler = Profiler(enabled=False)
+
+    with profiler.counting_operators():
+        return _rigify(path, mesh_cache_dir, profiler, lazy_meshes)
+
+def _rigify(path, mesh_cache_dir, profiler, lazy_meshes):
+
+    with profiler.stage("load_model"):
+        loaded = loadModel(path)
+        if loaded is None:
+            return 0
+        armature_name, urdf_str, model, traversal, root_H_link = loaded
+        topology = buildTopology(model, traversal)
+    profiler.count("links", model.getNrOfLinks())
+    profiler.count("joints", model.getNrOfJoints())
+
+    with profiler.stage("snapshot"):
+        # Save the model in the scene, together with its compiled kinematic
+        # description that avoids parsing the urdf again when the rig is opened
+        bpy.context.scene['model_urdf'] = urdf_str
+        bpy.context.scene['model_snapshot'] = encodeSnapshot(buildSnapshot(model, traversal, root_H_link))
+    # The proxies of the previous rig are removed with its meshes
+    if "lod_ratios" in bpy.context.scene:
+        del bpy.context.scene["lod_ratios"]
     linkVisual=model.visualSolidShapes().getLinkSolidShapes();
 
-    dofs = dynComp.model().getNrOfDOFs();
-    s = iDynTree.VectorDynSize(dofs);
-    ds = iDynTree.VectorDynSize(dofs);
-    dds = iDynTree.VectorDynSize(dofs);
-    for dof in range(dofs):
-        # For the sake of the example, we fill the joints vector with gibberish data (remember in any case
-        # that all quantities are expressed in radians-based units
-        s.setVal(dof, 0.0);
-        ds.setVal(dof, 0.0);
-        dds.setVal(dof, 0.3);
-
-
-    # The gravity acceleration is a 3d acceleration vector.
-    gravity = iDynTree.Vector3();
-    gravity.zero();
-    gravity.setVal(2, -9.81);
-    dynComp.setRobotState(s,ds,gravity);
-
-    dynComp.loadRobotModel(mdlLoader.model());
-    print("The loaded model has", dynComp.model().getNrOfDOFs(), \
-    "internal degrees of freedom and",dynComp.model().getNrOfLinks(),"links.")
-
-    # Remove meshes leftovers
-    # Will collect meshes from delete objects
-    meshes = set()
-    # Delete all the objects in the scene
-    # Get objects in the collection if they are meshes
-    for obj in bpy.data.objects:
-        # Store the internal mesh
-        if obj.type == 'MESH':
-            meshes.add( obj.data )
-        # Delete the object
-        bpy.data.objects.remove( obj )
-    # Look at meshes that are orphean after objects removal
-    for mesh in [m for m in meshes if m.users == 0]:
-        # Delete the meshes
-        bpy.data.meshes.remove( mesh )
-
-    # Check if there are still orphean meshes
-    # It may happens when you delete the object from UI
-    for mesh in bpy.data.meshes:
-       if mesh.name not in  bpy.data.objects.keys():
-           bpy.data.meshes.remove( mesh )
+    # Keep the animation of the previous rig, the bones are named after the
+    # joints so the action still applies to the new armature
+    previous_action = None
+    if armature_name in bpy.data.objects and bpy.data.objects[armature_name].animation_data:
+        previous_action = bpy.data.objects[armature_name].animation_data.action
+
+    with profiler.stage("cleanup"):
+        purgeScene(keep=[previous_action])
 
     # Import the meshes
     meshMap = {}
     meshesInfo = {}
+    mesh_cache = MeshCache(mesh_cache_dir)
+    with profiler.stage("mesh_decode"):
+        # decode in parallel all the external meshes before creating the objects
+        if not lazy_meshes:
+            mesh_cache.prefetch([linkVisual[link_id][0].asExternalMesh().getFileLocationOnLocalFileSystem()
+                                 for link_id in range(model.getNrOfLinks())
+                                 if len(linkVisual[link_id]) != 0 and linkVisual[link_id][0].isExternalMesh()],
+                                0.001)
+
+    with profiler.stage("mesh_import"):
+        # import meshes and do the mapping to the link
+        for link_id in range(model.getNrOfLinks()):
+            if len(linkVisual[link_id]) == 0:
+                continue
+            linkname = model.getLinkName(link_id)
+            meshesInfo[linkname] = linkVisual[link_id][0]
+            meshobj = createLinkObject(linkname, meshesInfo[linkname], mesh_cache, lazy_meshes)
+            if meshobj is None:
+                continue
+            meshMap[linkname] = meshobj
+    if profiler.enabled:
+        placeholders = placeholderObjects(meshMap.values())
+        unique_meshes = {obj.data for obj in meshMap.values() if obj not in placeholders}
+        profiler.count("mesh_objects", len(meshMap))
+        profiler.count("placeholders", len(placeholders))
+        profiler.count("meshes_imported", len(unique_meshes))
+        profiler.count("vertices_imported", sum(len(mesh.vertices) for mesh in unique_meshes))
+        profiler.count("mesh_cache_hits", mesh_cache.hits)
+        profiler.count("mesh_cache_disk_hits", mesh_cache.disk_hits)
+
+    with profiler.stage("mesh_placement"):
+        # Place the meshes
+        for linkname, meshobj in meshMap.items():
+            placeLinkObject(meshobj, model.getLinkIndex(linkname), meshesInfo[linkname], root_H_link)
+
+    with profiler.stage("bones"):
+        # Define the armature
+        # Create armature and armature object
+        try:
+            armature_object = bpy.data.objects[armature_name]
+        except KeyError:
+        # create armature
+            armature = bpy.data.armatures.new(armature_name)
+            armature_object = bpy.data.objects.new(armature_name, armature)
+            # Link armature object to our scene
+            bpy.context.scene.collection.objects.link(armature_object)
+
+        if previous_action is not None:
+            armature_object.animation_data_create().action = previous_action
+
+        #Make a coding shortcut
+        armature_data = bpy.data.objects[armature_name]
+        # must be in edit mode to add bones
+        bpy.context.view_layer.objects.active = armature_object
+        bpy.ops.object.mode_set(mode='EDIT')
+        edit_bones = armature_data.data.edit_bones
+        pose_bones = armature_data.pose.bones
+
+        limits = {}
+        # bone of each link, i.e. the bone of its parent joint
+        link_bones = {}
+        # The base link has a bone that has not correspondences to the joints
+        base_link = int(topology["visit_order"][0])
+        root_bone = edit_bones.new(model.getLinkName(base_link))
+        # TODO I have to put random value for head and tail bones otherwise bones with 0 lenght are removed
+        root_bone.head = (0,0,0)
+        root_bone.tail = (0,0,-0.01)
+        link_bones[base_link] = root_bone
+        # Create the bones in traversal order, the parent bone always exists already
+        for linkIdx in topology["visit_order"][1:]:
+            idyn_joint_idx = int(topology["link_parent_joint"][linkIdx])
+            bone_data = jointBoneData(model, topology, root_H_link, idyn_joint_idx)
+            bonename = model.getJointName(idyn_joint_idx)
+            bchild = edit_bones.new(bonename)
+            bchild.parent = link_bones[int(topology["joint_parent_link"][idyn_joint_idx])]
+            bchild.head = bone_data["head"]
+            bchild.tail = bone_data["tail"]
+            link_bones[int(linkIdx)] = bchild
+            limits[bonename] = bone_data["limits"]
 
-    # import meshes and do the mapping to the link
-    for link_id in range(model.getNrOfLinks()):
-        if len(linkVisual[link_id]) == 0:
-            continue
-        meshesInfo[model.getLinkName(link_id)] = linkVisual[link_id][0]
-        linkname = model.getLinkName(link_id)
-        if meshesInfo[model.getLinkName(link_id)].isExternalMesh():
-            # import the mesh
-            filePath = meshesInfo[model.getLinkName(link_id)].asExternalMesh().getFileLocationOnLocalFileSystem()
-            if ".stl" in filePath:
-                bpy.ops.import_mesh.stl(filepath=os.path.join(filePath),global_scale=0.001)
-            elif ".ply" in filePath:
-                bpy.ops.import_mesh.ply(filepath=os.path.join(filePath),global_scale=0.001)
-            elif ".dae" in filePath:
-                bpy.ops.wm.collada_import(filepath=os.path.join(filePath), import_units=True) #TODO check how to handle scale here !
-        else:
-            # it is a basic geometry(sphere, cylinder, box)
-            if not createGeometricShape(meshesInfo[model.getLinkName(link_id)]):
+        # exit edit mode to save bones so they can be used in pose mode
+        bpy.ops.object.mode_set(mode='OBJECT')
+        # just for checking that the map link->mesh is ok.
+        #for k,v in meshMap.items():
+        #    print(k,v.name)
+    profiler.count("bones", len(link_bones))
+
+    with profiler.stage("parenting"):
+        # Now iterate over all the joints(bones) and link them to the meshes.
+        bone_to_mesh = {}
+        for idyn_joint_idx in range(model.getNrOfJoints()):
+            # The joint should move the child link(?)
+            childname = model.getLinkName(int(topology["joint_child_link"][idyn_joint_idx]))
+            if childname not in meshMap:
                 continue
-        meshName = ""
-        # We are assuming we are starting in a clean environment
-        if not meshMap.keys() :
-            meshName = bpy.data.objects.keys()[0]
-        else:
-            for mesh in bpy.data.objects:
-                if mesh.name not in meshMap.values():
-                    meshName = mesh.name
-                    break
-        meshMap[linkname] = meshName
+            bone_to_mesh[model.getJointName(idyn_joint_idx)] = meshMap[childname]
+        parentMeshesToBones(armature_data, bone_to_mesh)
+
+    with profiler.stage("constraints"):
+        # configure the bones limits
+        bpy.ops.object.mode_set(mode='POSE')
+        for pbone in pose_bones:
+            bone_name = pbone.basename
+            # root_link is a special case, it is a bone that has not correspondences to the joints
+            if bone_name not in limits:
+                pbone.lock_location = (True, True, True)
+                pbone.lock_rotation = (True, True, True)
+                pbone.lock_scale = (True, True, True)
+                continue
+            configurePoseBone(pbone, limits[bone_name])
 
-    # Place the meshes
+    bpy.context.scene.transform_orientation_slots[0].type = 'LOCAL'
+    return 1
+
+def updateRig(path, mesh_cache_dir=default_cache_dir(), lazy_meshes=False):
+    # Incremental version of rigify: the new urdf is compared with the one
+    # stored in the scene and only the bones, the constraints and the meshes
+    # that changed are updated. The armature object is kept, hence also its
+    # animation. If the kinematic tree changed the whole rig is rebuilt.
+    # The meshes of new links, and the changed meshes of links that were not
+    # loaded yet, are created as placeholders if lazy_meshes is set.
+    scene = bpy.context.scene
+    if 'model_urdf' not in scene:
+        print("No model stored in the scene, converting from scratch.")
+        return rigify(path, mesh_cache_dir, lazy_meshes=lazy_meshes)
+
+    loaded = loadModel(path)
+    if loaded is None:
+        return 0
+    armature_name, urdf_str, model, traversal, root_H_link = loaded
+    topology = buildTopology(model, traversal)
+    if armature_name not in bpy.data.objects or bpy.data.objects[armature_name].type != 'ARMATURE':
+        print("Armature", armature_name, "not found, converting from scratch.")
+        return rigify(path, mesh_cache_dir, lazy_meshes=lazy_meshes)
+    armature_object = bpy.data.objects[armature_name]
+
+    # Load the previous model from the scene
+    mdlLoader = iDynTree.ModelLoader()
+    if not mdlLoader.loadModelFromString(scene['model_urdf']):
+        return rigify(path, mesh_cache_dir, lazy_meshes=lazy_meshes)
+    old_model = mdlLoader.model()
+    old_traversal = iDynTree.Traversal()
+    old_model.computeFullTreeTraversal(old_traversal)
+    old_root_H_link = computeRestTransforms(old_model, old_traversal)
+    old_topology = buildTopology(old_model, old_traversal)
+
+    old_joints = {old_model.getJointName(i): jointBoneData(old_model, old_topology, old_root_H_link, i)
+                  for i in range(old_model.getNrOfJoints())}
+    new_joints = {model.getJointName(i): jointBoneData(model, topology, root_H_link, i)
+                  for i in range(model.getNrOfJoints())}
+
+    # Bones are added/removed/re-parented: the hierarchy has to be rebuilt
+    if old_joints.keys() != new_joints.keys() or \
+       any((old_joints[j]["parent"], old_joints[j]["child"]) != (new_joints[j]["parent"], new_joints[j]["child"])
+           for j in new_joints):
+        print("The kinematic tree changed, rebuilding the rig.")
+        return rigify(path, mesh_cache_dir, lazy_meshes=lazy_meshes)
+
+    def changed(a, b):
+        return (a - b).length > 1e-9
+
+    moved_bones = [j for j in new_joints
+                   if changed(old_joints[j]["head"], new_joints[j]["head"]) or
+                      changed(old_joints[j]["tail"], new_joints[j]["tail"])]
+    changed_limits = [j for j in new_joints if old_joints[j]["limits"] != new_joints[j]["limits"]]
+
+    # Links whose placement changed, i.e. the ones after a moved joint
+    moved_links = set()
     for link_id in range(model.getNrOfLinks()):
         linkname = model.getLinkName(link_id)
-        if linkname not in meshMap.keys():
+        old_link_id = old_model.getLinkIndex(linkname)
+        if old_link_id < 0:
+            moved_links.add(linkname)
             continue
-        meshname = meshMap[linkname]
-        meshobj = bpy.data.objects[meshname]
-        # root->link transform
-        RtoLinktransform = dynComp.getRelativeTransform("root_link", linkname)
-        # link->geometry transform
-        LinkToGtransform = meshesInfo[linkname].getLink_H_geometry()
-        # root->geometry transform
-        RToGtransform = RtoLinktransform * LinkToGtransform
-
-        meshobj.location = RToGtransform.getPosition().toNumPy()
-        meshobj.rotation_mode = "QUATERNION"
-        meshobj.rotation_quaternion = RToGtransform.getRotation().asQuaternion()
-
-    # Define the armature
-    # Create armature and armature object
-    try:
-        armature_object = bpy.data.objects[armature_name]
-    except KeyError:
-    # create armature
-        armature = bpy.data.armatures.new(armature_name)
-        armature_object = bpy.data.objects.new(armature_name, armature)
-        # Link armature object to our scene
-        bpy.context.scene.collection.objects.link(armature_object)
-
-    #Make a coding shortcut
-    armature_data = bpy.data.objects[armature_name]
-    # must be in edit mode to add bones
-    bpy.context.view_layer.objects.active = armature_object
-    bpy.ops.object.mode_set(mode='EDIT')
-    edit_bones = armature_data.data.edit_bones
-    pose_bones = armature_data.pose.bones
-
-    limits = {}
-    bone_list = {}
-    # Loop for defining the hierarchy of the bonse and its locations
-    for idyn_joint_idx in range(model.getNrOfJoints()):
-        parentIdx = traversal.getParentLinkIndexFromJointIndex(model,
-                                                               idyn_joint_idx)
-        childIdx = traversal.getChildLinkIndexFromJointIndex(model,
-                                                              idyn_joint_idx)
-        parentname = model.getLinkName(parentIdx)
-        childname = model.getLinkName(childIdx)
-        joint = model.getJoint(idyn_joint_idx)
-        jointtype = ""
-        if joint.isRevoluteJoint():
-            joint = joint.asRevoluteJoint()
-            jointtype = "REVOLUTE"
-            direction =	joint.getAxis(childIdx,parentIdx).getDirection().toNumPy()
-        # This is missing from idyntree api :(
-        #elif joint.isPrismaticJoint():
-        #    joint = joint.asPrismaticJoint()
-        #    jointtype = "PRISMATIC"
-        elif joint.isFixedJoint():
-            joint = joint.asFixedJoint()
-            jointtype = "FIXED"
-        #else:
-        #    joint = joint.asRevoluteJoint()
-        #    jointtype = "REVOLUTE"
-        #    direction =	joint.getAxis(childIdx,parentIdx).getDirection().toNumPy()
-        min = joint.getMinPosLimit(0)
-        max = joint.getMaxPosLimit(0)
-        bparent = None
-        if parentname in bone_list.keys():
-            bparent = bone_list[parentname]
-        else:
-            if parentname != "root_link":
-                for i in range(model.getNrOfJoints()):
-                    childname_prev = model.getLinkName(traversal.getChildLinkIndexFromJointIndex(model,
-                                                                         i))
-                    if childname_prev == parentname:
-                        bonename = model.getJointName(i)
-                        if bonename not in edit_bones.keys():
-                            bparent = edit_bones.new(bonename)
-                        else:
-                            bparent = edit_bones[bonename]
-                        break
-            else:
-                bparent = edit_bones.new(parentname)
-            # TODO I have to put random value for head and tail bones otherwise bones with 0 lenght are removed
-            bparent.head = (0,0,0)
-            bparent.tail = (0,0,-0.01)
-            bone_list[parentname] = bparent
-
-        bonename = model.getJointName(idyn_joint_idx)
-        if bonename not in edit_bones.keys():
-            bchild = edit_bones.new(bonename)
-        else:
-            bchild = edit_bones[bonename]
-
-        if bparent:
-            bchild.parent = bparent
-
-        parent_link_transform = dynComp.getRelativeTransform("root_link", parentname)
-        parent_link_position  = parent_link_transform.getPosition().toNumPy();
-        child_link_transform  = dynComp.getRelativeTransform("root_link", childname)
-        child_link_position   = child_link_transform.getPosition().toNumPy();
-        child_link_rotation   = mathutils.Matrix(child_link_transform.getRotation().toNumPy());
-        # Start defining the bone like parent->child link
-        bchild.head = parent_link_position
-        bchild.tail = child_link_position
-        if jointtype == "REVOLUTE":
-            length = bchild.length
-            if length == 0.0:
-                length = 0.01 # bones with zero length are deleted by Blender
-            direction = mathutils.Vector(direction).normalized()
-            direction.rotate(child_link_rotation)
-            # In our representation the revolute joint is a bone placed in the child origin
-            # oriented towards the axis of the joint.
-            bchild.head = child_link_position
-            bchild.tail = bchild.head + direction * length
-
-        bone_list[childname] = bchild
-        # Consider the y-axis orientation in the limits
-        limits[model.getJointName(idyn_joint_idx)] = [min, max, jointtype]
-
-    # exit edit mode to save bones so they can be used in pose mode
-    bpy.ops.object.mode_set(mode='OBJECT')
-    # just for checking that the map link->mesh is ok.
-    #for k,v in meshMap.items():
-    #    print(k,v)
-
-    # Now iterate over all the joints(bones) and link them to the meshes.
-    for idyn_joint_idx in range(model.getNrOfJoints()):
-        # The joint should move the child link(?)
-        childIdx = traversal.getChildLinkIndexFromJointIndex(model,
-                                                              idyn_joint_idx)
-        childname = model.getLinkName(childIdx)
-        if childname not in meshMap.keys():
-            continue
-        jointname = model.getJointName(idyn_joint_idx)
-        meshname = meshMap[childname]
-        meshobj = bpy.data.objects[meshname]
+        if not np.allclose(root_H_link[link_id], old_root_H_link[old_link_id], rtol=0.0, atol=1e-9):
+            moved_links.add(linkname)
 
-        bpy.ops.object.select_all(action='DESELECT')
-        armature_data.select_set(True)
-        bpy.context.view_layer.objects.active = armature_data
+    scene['model_urdf'] = urdf_str
+    scene['model_snapshot'] = encodeSnapshot(buildSnapshot(model, traversal, root_H_link))
 
+    # Update the rest position of the moved bones only
+    if moved_bones:
+        bpy.context.view_layer.objects.active = armature_object
         bpy.ops.object.mode_set(mode='EDIT')
-
-        edit_bones.active = edit_bones[jointname]
-
+        edit_bones = armature_object.data.edit_bones
+        for bonename in moved_bones:
+            edit_bones[bonename].head = new_joints[bonename]["head"]
+            edit_bones[bonename].tail = new_joints[bonename]["tail"]
         bpy.ops.object.mode_set(mode='OBJECT')
 
-        bpy.ops.object.select_all(action='DESELECT') #deselect all objects
-        meshobj.select_set(True)
-        armature_data.select_set(True)
-        bpy.context.view_layer.objects.active = armature_data     #the active object will be the parent of all selected object
-
-        bpy.ops.object.parent_set(type='BONE', keep_transform=True)
-
-    # configure the bones limits
-    bpy.ops.object.mode_set(mode='POSE')
-    for pbone in pose_bones:
-        bone_name = pbone.basename
-        pbone.lock_location = (True, True, True)
-        pbone.lock_rotation = (True, True, True)
-        pbone.lock_scale = (True, True, True)
-        # root_link is a special case, it is a bone that has not correspondences to the joints
-        if bone_name == "root_link":
+    # Update the limits
+    for bonename in changed_limits:
+        configurePoseBone(armature_object.pose.bones[bonename], new_joints[bonename]["limits"])
+
+    # Update the meshes
+    link_objects = {obj["urdf_link"]: obj for obj in bpy.data.objects if "urdf_link" in obj}
+    link_to_bone = {data["child"]: name for name, data in new_joints.items()}
+    linkVisual = model.visualSolidShapes().getLinkSolidShapes()
+    mesh_cache = MeshCache(mesh_cache_dir)
+    to_reparent = {}
+    updated_meshes = 0
+    for link_id in range(model.getNrOfLinks()):
+        linkname = model.getLinkName(link_id)
+        meshobj = link_objects.pop(linkname, None)
+        if len(linkVisual[link_id]) == 0:
+            if meshobj is not None:
+                bpy.data.objects.remove(meshobj)
             continue
-        lim = limits[bone_name]
-        # check the nr of DOFs
-        if lim[2] == "FIXED" :
+        solidshape = linkVisual[link_id][0]
+        placeholder = meshobj is not None and "urdf_mesh_source" in meshobj
+        if meshobj is None or meshobj.get("urdf_visual") != visualSignature(solidshape, mesh_cache, placeholder):
+            if meshobj is not None:
+                bpy.data.objects.remove(meshobj)
+            meshobj = createLinkObject(linkname, solidshape, mesh_cache, lazy_meshes or placeholder)
+            if meshobj is None:
+                continue
+        elif linkname not in moved_links and link_to_bone.get(linkname) not in moved_bones:
             continue
-
-        c = pbone.constraints.new('LIMIT_ROTATION')
-        c.owner_space = 'LOCAL'
-
-        if lim[2] == "REVOLUTE":
-            # The bones should rotate around y-axis
-            pbone.lock_rotation[1] = False
-        elif lim[2] == "PRISMATIC":
-            # The bones should move along y-axis
-            pbone.lock_location[1] = False
-        if lim:
-            c.use_limit_y = True
-            # TODO maybe we have to put also the ik constraints ???
-            #print(bone_name, math.degrees(lim[0]), math.degrees(lim[1]))
-            c.min_y = lim[0] # min
-            c.max_y = lim[1] # max
-
-        # TODO not sure if it is the right rotation_mode
-        pbone.rotation_mode = 'XYZ'
-
-    bpy.context.scene.transform_orientation_slots[0].type = 'LOCAL'
-
+        placeLinkObject(meshobj, link_id, solidshape, root_H_link)
+        updated_meshes += 1
+        if linkname in link_to_bone:
+            to_reparent[link_to_bone[linkname]] = meshobj
+    # Links not present anymore
+    for meshobj in link_objects.values():
+        bpy.data.objects.remove(meshobj)
+    # The meshes replaced, with their proxies
+    orphans = {mesh for mesh in bpy.data.meshes if mesh.users == 0}
+    orphans.update(orphanLodMeshes())
+    bpy.data.batch_remove(orphans)
+    parentMeshesToBones(armature_object, to_reparent)
+
+    print("Rig updated:", len(moved_bones), "bones moved,", len(changed_limits),
+          "limits changed,", updated_meshes, "meshes updated.")
+    return 1
 
 class WM_OT_OpenFilebrowser(Operator, ImportHelper):
 
@@ -346,6 +554,18 @@ class WM_OT_OpenFilebrowser(Operator, ImportHelper):
         options={'HIDDEN'}
     )
 
+    incremental: BoolProperty(
+        name="Update existing rig",
+        description="Update only the bones and the meshes that changed with respect to the urdf stored in the scene",
+        default=False
+    )
+
+    lazy_meshes: BoolProperty(
+        name="Skeleton only",
+        description="Create bounding boxes in place of the link meshes, the meshes can be loaded later from the panel",
+        default=False
+    )
+
     def execute(self, context):
         """Do something with the selected file(s)."""
 
@@ -354,8 +574,135 @@ class WM_OT_OpenFilebrowser(Operator, ImportHelper):
         print('Selected file:', self.filepath)
         print('File name:', filename)
         print('File extension:', extension)
-        rigify(self.filepath)
+        if self.incremental:
+            updateRig(self.filepath, lazy_meshes=self.lazy_meshes)
+        else:
+            rigify(self.filepath, lazy_meshes=self.lazy_meshes)
+
+        return {'FINISHED'}
+
+def linkObjects():
+    return [obj for obj in bpy.data.objects if "urdf_link" in obj]
+
+def placeholderObjects(objects=None):
+    # Link objects whose mesh has not been loaded yet
+    if objects is None:
+        objects = linkObjects()
+    return [obj for obj in objects if "urdf_mesh_source" in obj]
+
+def partObjects(armature_object, bone_names):
+    # Link objects moved by the bones and by all the bones that follow them
+    bones = set()
+    for bone_name in bone_names:
+        bone = armature_object.data.bones.get(bone_name)
+        if bone is None:
+            continue
+        bones.add(bone.name)
+        bones.update(child.name for child in bone.children_recursive)
+    return [obj for obj in armature_object.children
+            if obj.parent_type == 'BONE' and obj.parent_bone in bones]
+
+def loadLinkMeshes(objects, mesh_cache_dir=default_cache_dir()):
+    # Replace the placeholders among objects with the meshes they stand for.
+    # Returns the number of meshes loaded.
+    placeholders = placeholderObjects(objects)
+    if not placeholders:
+        return 0
+    mesh_cache = MeshCache(mesh_cache_dir)
+    # The files already loaded for other links are shared
+    mesh_cache.adopt(obj for obj in linkObjects() if "urdf_mesh_source" not in obj)
+    mesh_cache.prefetch([obj["urdf_mesh_source"] for obj in placeholders], 0.001)
+    loaded = 0
+    for obj in placeholders:
+        placeholder_mesh = obj.data
+        source, scale = obj["urdf_mesh_source"], obj["urdf_mesh_scale"]
+        try:
+            stamp_key = mesh_cache.stamp_key(source, scale)
+        except OSError as e:
+            print("Unable to load", source, ":", e)
+            continue
+        if not mesh_cache.load_into(obj, source, scale):
+            continue
+        # The signature identifies the mesh by its content from now on
+        obj["urdf_visual"] = obj["urdf_visual"].replace(stamp_key, mesh_cache.key(source, scale))
+        del obj["urdf_mesh_source"]
+        del obj["urdf_mesh_scale"]
+        obj.display_type = 'TEXTURED'
+        if placeholder_mesh.users == 0:
+            bpy.data.meshes.remove(placeholder_mesh)
+        loaded += 1
+    print("Loaded", loaded, "meshes,", len(placeholderObjects()), "still to load.")
+    return loaded
+
+class WM_OT_LoadLinkMeshes(Operator):
+    bl_idname = "wm.load_link_meshes"
+    bl_label = "Load meshes"
+    bl_description = "Replace the placeholder boxes with the meshes of the links"
+
+    scope: EnumProperty(
+        name="Scope",
+        items=[("SELECTED", "Selected", "Meshes of the selected links"),
+               ("PART", "Part", "Meshes of the selected links and of the links that follow them"),
+               ("ALL", "All", "Meshes of all the links")],
+        default="SELECTED"
+    )
+
+    def execute(self, context):
+        if self.scope == "ALL":
+            objects = linkObjects()
+        else:
+            objects = [obj for obj in context.selected_objects if "urdf_link" in obj]
+            if self.scope == "PART":
+                for obj in list(objects):
+                    if obj.parent is not None and obj.parent_type == 'BONE':
+                        objects += partObjects(obj.parent, [obj.parent_bone])
+        if loadLinkMeshes(objects) == 0:
+            self.report({'INFO'}, "No placeholder to load")
+        return {'FINISHED'}
+
+def generateProxies(ratios):
+    created = createProxyMeshes(linkObjects(), ratios)
+    available = set(bpy.context.scene.get("lod_ratios", []))
+    available.update(ratios)
+    bpy.context.scene["lod_ratios"] = sorted(available)
+    print("Created", created, "proxy meshes.")
+
+class WM_OT_GenerateProxies(Operator):
+    bl_idname = "wm.generate_proxies"
+    bl_label = "Generate proxies"
+    bl_description = "Generate decimated copies of the link meshes for a faster viewport"
+
+    ratio: FloatProperty(
+        name="Ratio",
+        description="Ratio of faces kept in the proxy meshes",
+        default=0.1,
+        min=0.01,
+        max=1.0
+    )
 
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+    def execute(self, context):
+        generateProxies([self.ratio])
+        setLevelOfDetail(linkObjects(), self.ratio)
+        return {'FINISHED'}
+
+class WM_OT_SetLevelOfDetail(Operator):
+    bl_idname = "wm.set_level_of_detail"
+    bl_label = "Set level of detail"
+    bl_description = "Switch the link meshes between the proxies and the full resolution"
+
+    ratio: FloatProperty(
+        name="Ratio",
+        description="Ratio of the proxies to display, 0 for the full resolution meshes",
+        default=0.0,
+        min=0.0,
+        max=1.0
+    )
+
+    def execute(self, context):
+        setLevelOfDetail(linkObjects(), self.ratio if self.ratio > 0.0 else None)
         return {'FINISHED'}
 
 class OBJECT_PT_urdf2blender_converter(Panel):
@@ -373,11 +720,136 @@ class OBJECT_PT_urdf2blender_converter(Panel):
         row_configure = layout.row(align=True)
         row_configure.operator("wm.open_filebrowser")
 
+        placeholders = len(placeholderObjects())
+        if placeholders > 0:
+            box_meshes = layout.box()
+            box_meshes.label(text="{} link meshes not loaded".format(placeholders))
+            row_meshes = box_meshes.row(align=True)
+            row_meshes.operator("wm.load_link_meshes", text="Selected").scope = "SELECTED"
+            row_meshes.operator("wm.load_link_meshes", text="Part").scope = "PART"
+            row_meshes.operator("wm.load_link_meshes", text="All").scope = "ALL"
+
+        box_lod = layout.box()
+        box_lod.label(text="Level of detail")
+        box_lod.operator("wm.generate_proxies")
+        row_lod = box_lod.row(align=True)
+        row_lod.operator("wm.set_level_of_detail", text="Full").ratio = 0.0
+        for ratio in scene.get("lod_ratios", []):
+            row_lod.operator("wm.set_level_of_detail", text="{:g}%".format(ratio * 100)).ratio = ratio
+
 
 # Main function
-def main(urdf_filename, blend_filename):
-    rigify(urdf_filename)
-    bpy.ops.wm.save_as_mainfile(filepath=blend_filename)
+def profileFilename(blend_filename):
+    # The profiling report is written next to the .blend
+    return os.path.splitext(blend_filename)[0] + ".profile.json"
+
+def main(urdf_filename, blend_filename, mesh_cache_dir, incremental=False, lod_ratios=(), profile=False, lazy_meshes=False):
+    profiler = Profiler(enabled=profile)
+    if incremental and os.path.isfile(blend_filename):
+        with profiler.stage("open"):
+            bpy.ops.wm.open_mainfile(filepath=blend_filename)
+        with profiler.stage("update"), profiler.counting_operators():
+            ok = updateRig(urdf_filename, mesh_cache_dir, lazy_meshes)
+    else:
+        ok = rigify(urdf_filename, mesh_cache_dir, profiler, lazy_meshes)
+    if not ok:
+        return False
+    if lod_ratios:
+        # The rig is saved with the full resolution meshes displayed
+        with profiler.stage("proxies"):
+            generateProxies(lod_ratios)
+    with profiler.stage("save"):
+        bpy.ops.wm.save_as_mainfile(filepath=blend_filename)
+    if profile:
+        profiler.write(profileFilename(blend_filename))
+    return True
+
+def loadManifest(manifest_filename):
+    # The manifest is a json file listing the models to convert:
+    # {"models": [{"urdf": "iCubGazeboV3/model.urdf", "blend": "rigs/iCubBlenderV3.blend"}, ...]}
+    # relative paths are relative to the manifest.
+    with open(manifest_filename, 'r') as f:
+        data = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_filename))
+    models = []
+    for entry in data["models"]:
+        models.append((os.path.join(base_dir, entry["urdf"]),
+                       os.path.join(base_dir, entry["blend"])))
+    return models
+
+def convertInProcess(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes):
+    # Start every model from an empty file, nothing of the previous rig
+    # (armatures, actions, materials) has to leak in the next one.
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    return main(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes)
+
+def convertInWorker(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes):
+    # Run the conversion in a headless blender
+    command = [bpy.app.binary_path, "--python-use-system-env", "-b",
+               "--python-exit-code", "1",
+               "-P", os.path.abspath(__file__), "--",
+               "--urdf_filename", urdf_filename,
+               "--blend_filename", blend_filename]
+    if mesh_cache_dir is None:
+        command.append("--no_mesh_cache")
+    else:
+        command += ["--mesh_cache_dir", mesh_cache_dir]
+    if incremental:
+        command.append("--incremental")
+    if lod_ratios:
+        command += ["--lod_ratios", ",".join(str(ratio) for ratio in lod_ratios)]
+    if profile:
+        command.append("--profile")
+    if lazy_meshes:
+        command.append("--lazy_meshes")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if result.returncode != 0:
+        print(result.stdout)
+    return result.returncode == 0
+
+def batchConvert(manifest_filename, summary_filename, mesh_cache_dir, incremental=False, workers=0, lod_ratios=(), profile=False, lazy_meshes=False):
+    # Convert all the models of the manifest, in this process if workers is 0,
+    # otherwise distributing them on a pool of headless blender processes.
+    # A summary with the outcome and the time of each model is written in
+    # summary_filename.
+    models = loadManifest(manifest_filename)
+    summary = []
+
+    def convert(urdf_filename, blend_filename):
+        start = time.perf_counter()
+        error = ""
+        try:
+            if workers > 0:
+                ok = convertInWorker(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes)
+            else:
+                ok = convertInProcess(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes)
+        except Exception as e:
+            ok = False
+            error = str(e)
+        entry = {"urdf": urdf_filename,
+                 "blend": blend_filename,
+                 "success": bool(ok),
+                 "time": time.perf_counter() - start}
+        if error:
+            entry["error"] = error
+        if profile and ok:
+            entry["profile"] = profileFilename(blend_filename)
+        print("Converted" if ok else "FAILED", urdf_filename, "in", round(entry["time"], 2), "s")
+        return entry
+
+    start = time.perf_counter()
+    if workers > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            summary = list(pool.map(lambda model: convert(*model), models))
+    else:
+        summary = [convert(*model) for model in models]
+
+    with open(summary_filename, 'w') as f:
+        json.dump({"manifest": os.path.abspath(manifest_filename),
+                   "workers": workers,
+                   "total_time": time.perf_counter() - start,
+                   "models": summary}, f, indent=4)
+    return all(entry["success"] for entry in summary)
 
 # Execute main()
 if __name__=='__main__':
@@ -390,4 +862,36 @@ if __name__=='__main__':
         blend_filename = argv[argv.index("--blend_filename") + 1]
     except ValueError:
         blend_filename = "./robot.blend"
-    main(urdf_filename, blend_filename)
+    mesh_cache_dir = default_cache_dir()
+    if "--no_mesh_cache" in argv:
+        mesh_cache_dir = None
+    else:
+        try:
+            mesh_cache_dir = argv[argv.index("--mesh_cache_dir") + 1]
+        except ValueError:
+            pass
+    incremental = "--incremental" in argv
+    profile = "--profile" in argv
+    lazy_meshes = "--lazy_meshes" in argv
+    try:
+        lod_ratios = [float(ratio) for ratio in argv[argv.index("--lod_ratios") + 1].split(",")]
+    except ValueError:
+        lod_ratios = []
+    try:
+        manifest_filename = argv[argv.index("--manifest") + 1]
+    except ValueError:
+        manifest_filename = None
+    if manifest_filename is not None:
+        try:
+            summary_filename = argv[argv.index("--summary") + 1]
+        except ValueError:
+            summary_filename = "./batch_summary.json"
+        try:
+            workers = int(argv[argv.index("--workers") + 1])
+        except ValueError:
+            workers = 0
+        ok = batchConvert(manifest_filename, summary_filename, mesh_cache_dir, incremental, workers, lod_ratios, profile, lazy_meshes)
+    else:
+        ok = main(urdf_filename, blend_filename, mesh_cache_dir, incremental, lod_ratios, profile, lazy_meshes)
+    if not ok:
+        sys.exit(1)